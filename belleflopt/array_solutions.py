@@ -0,0 +1,194 @@
+"""
+	Compact solutions for big networks. Platypus keeps decision variables in a Python list of Python floats, which
+	costs upwards of 30 bytes per variable - with segments * 365 variables per solution, a population on a large network
+	runs to gigabytes, and every evaluation has to convert the list back into an array. ArraySolution keeps the
+	variables in a single contiguous NumPy array instead (float64, or float32 to halve it again), that evaluation reads
+	directly and that pickles as a raw buffer. It still behaves like a regular Solution to Platypus's algorithms and
+	variation operators, which index into the variables one at a time and deepcopy solutions to make children.
+
+	Problems opt in with their variable_dtype argument - generators then make ArraySolutions with make_solution.
+
+	Also has helpers for keeping solutions as plain arrays between processes, like the nondominated archives that
+	coevolution and islands merge results into (merge_archive).
+
+	Nothing in this module should import Django.
+"""
+
+import copy
+import logging
+
+import numpy
+from platypus import Solution
+from platypus.core import FixedLengthArray
+
+log = logging.getLogger("belleflopt.array_solutions")
+
+
+class ArrayVariables(FixedLengthArray):
+	"""
+		Drop-in replacement for Platypus's FixedLengthArray of decision variables, backed by a NumPy array. Getting a
+		slice returns a view, and numpy.asarray gives back the underlying array without copying.
+	"""
+
+	def __init__(self, size, dtype=numpy.float64):
+		self._size = size
+		self._data = numpy.zeros(size, dtype=dtype)
+		self.convert = None
+
+	@property
+	def array(self):
+		return self._data
+
+	def __setitem__(self, index, value):
+		self._data[index] = value
+
+	def __getitem__(self, index):
+		return self._data[index]
+
+	def __iter__(self):
+		return iter(self._data)
+
+	def __array__(self, dtype=None, copy=None):
+		if dtype is None or numpy.dtype(dtype) == self._data.dtype:
+			return self._data.copy() if copy else self._data
+		return self._data.astype(dtype)
+
+	def __eq__(self, other):
+		if isinstance(other, FixedLengthArray):
+			return self._size == len(other) and numpy.array_equal(self._data, numpy.asarray(other._data, dtype=float))
+		return NotImplemented
+
+	def __deepcopy__(self, memo):
+		result = ArrayVariables.__new__(ArrayVariables)
+		result._size = self._size
+		result._data = self._data.copy()
+		result.convert = None
+		memo[id(self)] = result
+		return result
+
+	def __str__(self):
+		return numpy.array2string(self._data, threshold=20)
+
+
+class ArraySolution(Solution):
+	"""
+		Platypus Solution whose decision variables are an ArrayVariables
+	"""
+
+	def __init__(self, problem, dtype=None):
+		"""
+		:param problem: the problem the solution is for
+		:param dtype: NumPy dtype for the variables. Defaults to the problem's variable_dtype, then float64
+		"""
+		super(ArraySolution, self).__init__(problem)
+		if dtype is None:
+			dtype = getattr(problem, "variable_dtype", None) or numpy.float64
+		self.variables = ArrayVariables(problem.nvars, dtype=dtype)
+
+	def __deepcopy__(self, memo):
+		"""
+			Solution.__deepcopy__ would give us back a plain Solution, so do the same thing it does, but keep our class
+			and skip building variables we're about to replace
+		"""
+		result = ArraySolution.__new__(ArraySolution)
+		memo[id(self)] = result
+		result.problem = self.problem
+		for key, value in self.__dict__.items():
+			if key != "problem":
+				setattr(result, key, copy.deepcopy(value, memo))
+		return result
+
+
+def make_solution(problem):
+	"""
+		Makes an empty solution for the problem - an ArraySolution if the problem has a variable_dtype, otherwise a
+		regular Platypus Solution
+	"""
+	if getattr(problem, "variable_dtype", None) is not None:
+		return ArraySolution(problem)
+	return Solution(problem)
+
+
+def variables_array(solution):
+	"""
+		The solution's decision variables as a 1D NumPy array - the array itself for ArraySolutions, with no copying,
+		or a new array for regular Solutions
+	"""
+	if isinstance(solution.variables, ArrayVariables):
+		return solution.variables.array
+	return numpy.array(list(solution.variables), dtype=float)
+
+
+def set_variables(solution, values):
+	"""
+		Sets all of a solution's decision variables from an array, in place for ArraySolutions
+	"""
+	if isinstance(solution.variables, ArrayVariables):
+		solution.variables.array[:] = values
+	else:
+		solution.variables[:] = numpy.asarray(values, dtype=float).tolist()
+
+
+def stack_variables(solutions, dtype=None):
+	"""
+		Stacks the decision variables of many solutions into one (solutions, variables) array, such as for evaluating
+		a batch of them together or writing them out
+	:param dtype: dtype of the stacked array. Defaults to whatever the variables are stored as
+	"""
+	stacked = numpy.stack([variables_array(solution) for solution in solutions])
+	return stacked if dtype is None else stacked.astype(dtype, copy=False)
+
+
+def evaluated_solutions(problem, variables, objectives):
+	"""
+		Makes solutions that were already evaluated somewhere else - in another process, or kept as arrays in an
+		archive - from their variables and objectives, without evaluating them again
+	:param variables: (solutions, variables) array
+	:param objectives: (solutions, objectives) array
+	:return: list of evaluated solutions for the problem
+	"""
+	solutions = []
+	for solution_variables, solution_objectives in zip(variables, objectives):
+		solution = make_solution(problem)
+		set_variables(solution, solution_variables)
+		solution.objectives[:] = [float(value) for value in solution_objectives]
+		solution.constraint_violation = 0.0
+		solution.feasible = True
+		solution.evaluated = True
+		solutions.append(solution)
+	return solutions
+
+
+def nondominated_rows(objectives):
+	"""
+		Which rows of an objectives array aren't dominated by any other row, maximizing every objective. Of rows with
+		identical objectives, only the first is kept.
+	:param objectives: (solutions, objectives) array
+	:return: boolean mask
+	"""
+	objectives = numpy.asarray(objectives, dtype=float)
+	at_least = numpy.all(objectives[:, numpy.newaxis, :] >= objectives[numpy.newaxis, :, :], axis=2)  # [i, j]: i at least as good as j everywhere
+	better = numpy.any(objectives[:, numpy.newaxis, :] > objectives[numpy.newaxis, :, :], axis=2)
+	dominated = numpy.any(at_least & better, axis=0)
+	duplicate = numpy.any(numpy.tril(at_least & at_least.T, k=-1), axis=1)  # same objectives as an earlier row
+	return ~dominated & ~duplicate
+
+
+def merge_archive(archive_variables, archive_objectives, variables, objectives, size=None):
+	"""
+		Adds solutions to an archive kept as arrays, keeping only the nondominated ones - and if there are more than
+		size of those, keeping ones spread evenly along the front
+	:param archive_variables: (solutions, variables) array of what's in the archive now
+	:param archive_objectives: (solutions, objectives) array of what's in the archive now
+	:param variables: (solutions, variables) array of solutions to add
+	:param objectives: (solutions, objectives) array of solutions to add
+	:param size: most solutions to keep, or None to keep every nondominated solution
+	:return: tuple of the new archive's variables and objectives arrays
+	"""
+	variables = numpy.concatenate([archive_variables, variables])
+	objectives = numpy.concatenate([archive_objectives, objectives])
+	keep = numpy.flatnonzero(nondominated_rows(objectives))
+	if size is not None and keep.size > size:
+		keep = keep[numpy.argsort(objectives[keep, 0])]
+		keep = keep[numpy.unique(numpy.round(numpy.linspace(0, keep.size - 1, size)).astype(int))]
+	return variables[keep], objectives[keep]
@@ -1,5 +1,7 @@
+import collections
 import functools
 import logging
+import pickle
 
 import numpy
 from matplotlib import pyplot as plt
@@ -8,8 +10,172 @@ from matplotlib.colors import ListedColormap
 
 from eflows_optimization.settings import DEFAULT_COLORRAMP, GRAYSCALE_COLORRAMP, PREGENERATE_COMPONENTS
 
+from belleflopt import caching
+
 log = logging.getLogger("belleflopt.benefit")
 
+DAYS_OF_WATER_YEAR = numpy.arange(1, 366)  # day values we evaluate timeseries against - index 0 == day 1 of water year
+
+
+def ramp_benefit(values, q1, q2, q3, q4, max_benefit=1):
+	"""
+		Array version of the benefit calculation in BenefitItem.single_value_benefit. Values and corners can be
+		anything that broadcasts together, so the same kernel handles a single timeseries against one box or a whole
+		stack of timeseries against per-row corners. Returns exactly what the scalar version would for each value.
+	:param values: numpy array of values (flows or days) to get the benefit of
+	:param q1: where benefit starts ramping up from 0
+	:param q2: where benefit reaches max_benefit
+	:param q3: where benefit starts ramping back down
+	:param q4: where benefit hits 0 again
+	:param max_benefit: the benefit inside the q2 -> q3 window
+	:return: numpy array of benefit values, broadcast from the inputs
+	"""
+	with numpy.errstate(divide="ignore", invalid="ignore"):  # square edges (q1 == q2) divide by zero, but those values are masked out below
+		rising = numpy.divide(max_benefit, numpy.subtract(q2, q1)) * (values - q1)
+		falling = max_benefit - numpy.divide(max_benefit, numpy.subtract(q4, q3)) * (values - q3)
+
+	benefit = numpy.where(values < q2, rising, falling)  # anything left on a ramp below q2 is on the rising side
+	benefit = numpy.where((values <= q1) | (values >= q4), 0.0, benefit)
+	return numpy.where((q2 <= values) & (values <= q3), numpy.asarray(max_benefit, dtype=float), benefit)  # checked last so always valid windows win
+
+
+def _row_parameter(value, rows):
+	"""
+		Lets batched functions take either a single value for every row or one value per row
+	"""
+	return numpy.broadcast_to(numpy.asarray(value, dtype=float), (rows,))
+
+
+def peak_event_benefit(base_benefit, max_benefit, minimum_max_benefit, peak_duration, intraevent_reduction_factor,
+						interevent_decay_factor):
+	"""
+		Batched version of the peak flow event logic in PeakBenefitBox. Instead of walking each day and tracking
+		the state of the current event, it finds events as runs of days with base benefit, gets the day number within
+		each event from the start of its run, and gets the max benefit available to each event by subtracting the
+		decay from prior events cumulatively. The exponential tailoff is then applied to every day at once.
+
+		Each parameter can be a single value or an array with one value per row of base_benefit so that many
+		components can be evaluated together.
+	:param base_benefit: numpy array of base benefit, either 365 values or (N, 365) with one water year per row
+	:param max_benefit: benefit available to the first event of the year
+	:param minimum_max_benefit: benefit used once max benefit decays to 1 or lower
+	:param peak_duration: expected length of a single event in days
+	:param intraevent_reduction_factor: 1/peak_duration - the exponent scaling for the tailoff curve
+	:param interevent_decay_factor: how much max benefit drops after each event, scaled by the event's largest base benefit
+	:return: numpy array of peak benefit with the same shape as base_benefit
+	"""
+	base_benefit = numpy.asarray(base_benefit, dtype=float)
+	base = numpy.atleast_2d(base_benefit)
+	rows, days = base.shape
+
+	max_benefit = _row_parameter(max_benefit, rows)
+	minimum_max_benefit = _row_parameter(minimum_max_benefit, rows)
+	peak_duration = _row_parameter(peak_duration, rows)
+	intraevent_reduction_factor = _row_parameter(intraevent_reduction_factor, rows)
+	interevent_decay_factor = _row_parameter(interevent_decay_factor, rows)
+
+	peak_benefit = numpy.zeros(base.shape)
+	in_peak = base > 0
+	event_starts = in_peak.copy()
+	event_starts[:, 1:] &= ~in_peak[:, :-1]
+	start_rows, start_days = numpy.nonzero(event_starts)
+	if start_rows.size == 0:
+		return peak_benefit.reshape(base_benefit.shape)
+
+	# run-length encode the events - which event each day belongs to and how far into that event it is
+	positions = numpy.arange(days)
+	days_in_peak = positions - numpy.maximum.accumulate(numpy.where(event_starts, positions, 0), axis=1)
+	event_number = numpy.cumsum(event_starts, axis=1) - 1
+
+	# largest base benefit in each event - segments run from one start to the next, but anything between events is 0
+	event_max_base_benefit = numpy.maximum.reduceat(base.ravel(), start_rows * days + start_days)
+	event_rank = event_number[start_rows, start_days]
+
+	# max benefit available to each event - subtract each event's decay in order, then keep it from dropping
+	# below the minimum after the first event. Subtracting sequentially matches the day by day version exactly
+	decrements = numpy.zeros((rows, event_rank.max() + 2))
+	decrements[:, 0] = max_benefit
+	decrements[start_rows, event_rank + 1] = interevent_decay_factor[start_rows] * event_max_base_benefit
+	event_max_benefit = numpy.subtract.accumulate(decrements, axis=1)
+	event_max_benefit[:, 1:] = numpy.maximum(event_max_benefit[:, 1:], minimum_max_benefit[:, numpy.newaxis])
+
+	peak_rows, peak_days = numpy.nonzero(in_peak)
+	current_max_benefit = event_max_benefit[peak_rows, event_number[peak_rows, peak_days]]
+	with numpy.errstate(over="ignore"):
+		tailoff = base[peak_rows, peak_days] * (current_max_benefit ** (-intraevent_reduction_factor[peak_rows] *
+															(days_in_peak[peak_rows, peak_days] - peak_duration[peak_rows])))
+
+	# max benefit of 1 or less won't decay in the tailoff equation, so those events get the constant minimum instead
+	peak_benefit[peak_rows, peak_days] = numpy.where(current_max_benefit <= 1, minimum_max_benefit[peak_rows], tailoff)
+	return peak_benefit.reshape(base_benefit.shape)
+
+
+def recession_benefit(base_benefit, timeseries, fail_rate_of_change, full_benefit_rate, steep_rate, steep_reduction,
+						min_time_before_fail, max_time_before_fail):
+	"""
+		Batched version of the recession rate logic in RecessionBenefitBox. Rates of drop for every day come from
+		numpy.diff, the time in recession counter is rebuilt from cumulative sums of the days that add to it, reset
+		wherever the day by day version would have reset it, and any row that drops faster than fail_rate_of_change
+		while it's far enough into the recession gets zeroed out entirely.
+
+		Each parameter can be a single value or an array with one value per row of base_benefit.
+	:param base_benefit: numpy array of base benefit, either 365 values or (N, 365) with one water year per row
+	:param timeseries: flows matching base_benefit
+	:param fail_rate_of_change: daily rate of drop that zeroes out the whole row when hit inside the min/max window
+	:param full_benefit_rate: rates of drop below this get full benefit
+	:param steep_rate: rates of drop below this (but above full_benefit_rate) get benefit multiplied by steep_reduction
+	:param steep_reduction: multiplier for benefit in the steep range
+	:param min_time_before_fail: fail_rate_of_change only applies after this many days in the recession
+	:param max_time_before_fail: and before this many days in the recession
+	:return: tuple of (recession benefit with the same shape as base_benefit, time in recession at the end of each
+				row - or at the failure for rows that failed)
+	"""
+	base_benefit = numpy.asarray(base_benefit, dtype=float)
+	base = numpy.atleast_2d(base_benefit)
+	flows = numpy.atleast_2d(numpy.asarray(timeseries, dtype=float))
+	rows = base.shape[0]
+
+	fail_rate_of_change = _row_parameter(fail_rate_of_change, rows)[:, numpy.newaxis]
+	full_benefit_rate = _row_parameter(full_benefit_rate, rows)[:, numpy.newaxis]
+	steep_rate = _row_parameter(steep_rate, rows)[:, numpy.newaxis]
+	steep_reduction = _row_parameter(steep_reduction, rows)[:, numpy.newaxis]
+	min_time_before_fail = _row_parameter(min_time_before_fail, rows)[:, numpy.newaxis]
+	max_time_before_fail = _row_parameter(max_time_before_fail, rows)[:, numpy.newaxis]
+
+	with numpy.errstate(divide="ignore", invalid="ignore"):
+		rate_of_drop = -numpy.diff(flows, axis=1) / flows[:, :-1]  # negated so drops are positive, same as the daily version
+
+	# which branch each day falls into - days without base benefit don't touch anything, including the counter
+	in_recession_box = base[:, 1:] != 0
+	too_fast = in_recession_box & (rate_of_drop > fail_rate_of_change)
+	full_rate = in_recession_box & ~too_fast & (rate_of_drop < full_benefit_rate)
+	steep = in_recession_box & ~too_fast & ~full_rate & (rate_of_drop < steep_rate)
+	very_steep = in_recession_box & ~too_fast & ~full_rate & ~steep
+
+	final_benefit = numpy.zeros(base.shape)
+	final_benefit[:, 0] = base[:, 0]  # day 1 is copied over because we can't compare rate of change for it
+	final_benefit[:, 1:] = numpy.where(full_rate, base[:, 1:], numpy.where(steep, base[:, 1:] * steep_reduction, 0))
+
+	# rebuild the time in recession counter - count up on every day that adds to it, then subtract the count as of the
+	# most recent reset. The count only increases, so a running max of the count at resets gives the last reset's value
+	resets = too_fast | (very_steep & (rate_of_drop < 0))
+	additions = numpy.cumsum(full_rate | steep | (very_steep & ~(rate_of_drop < 0)), axis=1)
+	time_in_recession = additions - numpy.maximum.accumulate(numpy.where(resets, additions, 0), axis=1)
+	time_before_day = numpy.zeros(rate_of_drop.shape, dtype=time_in_recession.dtype)
+	time_before_day[:, 1:] = time_in_recession[:, :-1]
+
+	failures = too_fast & (min_time_before_fail < time_before_day) & (time_before_day < max_time_before_fail)
+	failed_rows = failures.any(axis=1)
+	final_benefit[failed_rows] = 0
+
+	final_time_in_recession = time_in_recession[:, -1] if time_in_recession.shape[1] else numpy.zeros(rows, dtype=int)
+	first_failures = failures.argmax(axis=1)
+	final_time_in_recession = numpy.where(failed_rows, time_before_day[numpy.arange(rows), first_failures], final_time_in_recession)
+
+	if base_benefit.ndim == 1:
+		return final_benefit[0], int(final_time_in_recession[0])
+	return final_benefit, final_time_in_recession
+
 
 class BenefitItem(object):
 	"""
@@ -138,6 +304,31 @@ class BenefitItem(object):
 
 		return low_value, high_value
 
+	def corners(self):
+		"""
+			The q values that benefit should be compared against - uses the unwrapped values when the window
+			crosses the rollover point so that q1 -> q4 stay sequential
+		:return: tuple of q1, q2, q3, q4
+		"""
+		if self._q4 < self._q1:
+			return self._q1_rollover, self._q2_rollover, self._q3_rollover, self._q4_rollover
+		else:
+			return self._q1, self._q2, self._q3, self._q4
+
+	def array_value_benefit(self, values):
+		"""
+			Same as single_value_benefit, but for a whole numpy array of values at once using the current margin.
+			Values below q1 get the rollover added, same as in the single value version.
+		:param values: array-like of values to get the benefit of
+		:return: numpy array of continuous 0-max_benefit benefits with the same shape as values
+		"""
+		values = numpy.asarray(values, dtype=float)
+		if self.rollover:
+			values = numpy.where(values >= self._q1, values, values + self.rollover)
+
+		q1, q2, q3, q4 = (float(q) for q in self.corners())
+		return ramp_benefit(values, q1, q2, q3, q4, max_benefit=self.max_benefit)
+
 	def single_value_benefit(self, value, margin):
 		"""
 			Calculates the benefit of a single flow in relation to this box.
@@ -155,16 +346,7 @@ class BenefitItem(object):
 		self.margin = margin  # set it this way, and it will recalculate q1 -> q4 only if it needs to
 
 		value = value if not self.rollover or value >= self._q1 else value + self.rollover
-		if self._q4 < self._q1:
-			q1 = self._q1_rollover
-			q2 = self._q2_rollover
-			q3 = self._q3_rollover
-			q4 = self._q4_rollover
-		else:
-			q1 = self._q1
-			q2 = self._q2
-			q3 = self._q3
-			q4 = self._q4
+		q1, q2, q3, q4 = self.corners()
 
 		if q2 <= value <= q3:  # if it's well in the window, benefit is 1
 			# this check should be before the next one to account for always valid windows (ie, q1 == q2 and q3 == q4)
@@ -192,6 +374,8 @@ class BenefitBox(object):
 	date_item = None
 
 	_annual_benefit = None
+	_day_benefit = None  # cached benefit for each day of the water year - only depends on the date item
+	_day_benefit_corners = None
 
 	def __init__(self, low_flow=None,
 				 high_flow=None,
@@ -278,6 +462,7 @@ class BenefitBox(object):
 		self.start_day_of_water_year = values[1] - abs((values[1] - values[0]) / 2)
 		self.end_day_of_water_year = values[3] - abs((values[3] - values[2]) / 2)
 		self._annual_benefit = None  # reset annual benefit to nothing since we just changed all the parameters
+		self._day_benefit = None
 
 	def recalculate_annual_benefit(self):
 		"""
@@ -302,10 +487,49 @@ class BenefitBox(object):
 
 		date_max = self.date_item.plot_window()[1]
 		flow_max = self.flow_item.plot_window()[1]
-		days, flows = numpy.indices((date_max, flow_max))  # get the indices to pass through the vectorized function as flows and days
-		self._annual_benefit = self.vectorized_single_day_flow_benefit(flows, days)
+		days, flows = numpy.indices((date_max, flow_max))  # get the indices to pass through the array kernel as flows and days
+		self._annual_benefit = self.flow_item.array_value_benefit(flows) * self.date_item.array_value_benefit(days)
 		return self._annual_benefit
 
+	@property
+	def day_benefit(self):
+		"""
+			The date portion of the benefit for every day of the water year. It doesn't depend on flow, so we only
+			compute it again if the date item's q values change.
+		:return: numpy array with 365 values
+		"""
+		corners = self.date_item.corners()
+		if self._day_benefit is None or self._day_benefit_corners != corners:
+			self._day_benefit = self.date_item.array_value_benefit(DAYS_OF_WATER_YEAR)
+			self._day_benefit_corners = corners
+		return self._day_benefit
+
+	def _pregenerated_benefit(self, timeseries):
+		"""
+			Looks benefit up in the pregenerated annual benefit surface the same way single_flow_benefit does -
+			anything that falls outside of the surface has 0 benefit
+		"""
+		surface = self.annual_benefit
+		flows = timeseries.astype(int)
+		days = numpy.broadcast_to(DAYS_OF_WATER_YEAR, flows.shape)
+		in_surface = (flows >= -surface.shape[0]) & (flows < surface.shape[0]) & (days < surface.shape[1])
+		benefit = numpy.zeros(flows.shape)
+		benefit[in_surface] = surface[flows[in_surface], days[in_surface]]
+		return benefit
+
+	def base_benefit_for_timeseries(self, timeseries):
+		"""
+			The base benefit (flow benefit * date benefit) for every day of a water year timeseries, computed as arrays
+			instead of day by day. Gives the same results as calling single_flow_benefit for each day.
+		:param timeseries: array-like of flows by day of water year. Can be 2-dimensional, with one water year per row
+		:return: numpy array of base benefit with the same shape as timeseries
+		"""
+		timeseries = numpy.asarray(timeseries, dtype=float)
+		if PREGENERATE_COMPONENTS and self._annual_benefit is not None:
+			return self._pregenerated_benefit(timeseries)
+
+		return self.flow_item.array_value_benefit(timeseries) * self.day_benefit
+
 	def get_benefit_for_timeseries(self, timeseries):
 		"""
 			Supplies the full benefit *just for this component* across a year given a day of water year-based timeseries
@@ -321,12 +545,7 @@ class BenefitBox(object):
 		:param timeseries:
 		:return:
 		"""
-		#if self.start_day_of_water_year < self.end_day_of_water_year: # subset the evaluation to only the times that are valid for this component. Everything else will be 0 anyway, so this could be faster
-		#	days = range(self.start_day_of_water_year, self.end_day_of_water_year + 1)  # index 0 == day 1 of water year, index 364 == day 365 of water year
-		#	return self.vectorized_single_day_flow_benefit(timeseries[self.start_day_of_water_year:self.end_day_of_water_year + 1], days)
-		#else:
-		days = range(1, 366)
-		return self.vectorized_single_day_flow_benefit(timeseries, days)
+		return self.base_benefit_for_timeseries(timeseries)
 
 	def plot_flow_benefit(self, min_flow=None, max_flow=None, day_of_year=100, screen=True):
 		"""
@@ -543,42 +762,21 @@ class PeakBenefitBox(BenefitBox):
 
 			This version overrides the parent implementation of this function - we won't call the parent - we don't need
 			to - this should return the benefit by day on its own.
+
+			Events are tracked with array operations in peak_event_benefit rather than day by day, so timeseries can
+			also be a 2D array of many hydrographs, one per row, and each row is evaluated independently.
 		:param timeseries:
 		:param testing: When True, returns the original benefit in addition to the peak benefit
 		:return:
 		"""
-		days = range(1, 366)  # index 0 == day 1 of water year, index 364 == day 365 of water year
-		original_base_benefit = self.vectorized_single_day_flow_benefit(timeseries, days)
-
-		days_in_peak = 0  # how many days long is the current peak_flow event
-		current_max_benefit = float(self.max_benefit)  # what's the max benefit available to a new peak flow event?
+		original_base_benefit = self.base_benefit_for_timeseries(timeseries)
 
-		max_event_base_benefit = 0  # we'll use this to track if the peak event in the main body of the window, or just barely happened
-		base_daily_benefit = [0, ] * 365
-		for day, benefit in enumerate(original_base_benefit):
-			if benefit > 0:  # basically, we're in the peak box
-				if current_max_benefit <= 1:  # max benefit of 1 is a flat line in this equation, and won't decay.
-												# Max benefits below 1 will actually cause the benefit to increase with
-												# days in the peak benefit equation
-					base_daily_benefit[day] = self.minimum_max_benefit
-				else:
-					base_daily_benefit[day] = self._get_peak_benefit(benefit, days_in_peak, current_max_benefit)
-				days_in_peak += 1  # add 1 to the current event
-				max_event_base_benefit = max(max_event_base_benefit, benefit)  # store the current max_event_base_benefit, or the new benefit, whichever is larger
-			else:  # benefit = 0, reset peak calcs
-				if days_in_peak > 0:  # if we were in a peak event, we need to reduce max benefit for the next event
-					# we'll reduce the current max benefit by the decay factor, scaled by how big this current event go
-					# if it never hit the main body of the range, then it'll only drop a little. This prevents the situation
-					# where we get 2 events that barely hit the 10th percentile, then a 50th percentile event gets no
-					# benefit right after that.
-					current_max_benefit -= float(self.peak_interevent_decay_factor) * max_event_base_benefit
-					current_max_benefit = max(self.minimum_max_benefit, current_max_benefit)  # if somehow current_max
-						# _benefit got to be super low, bump it to some value, but keep it lower than base flow.
-						# this value will also trigger using itself as a constant benefit value above because if it was
-						# used as the base in an exponential equation, benefit would increase by day
-
-					max_event_base_benefit = 0
-					days_in_peak = 0  # reset counter for next flow event
+		base_daily_benefit = peak_event_benefit(original_base_benefit,
+												max_benefit=self.max_benefit,
+												minimum_max_benefit=self.minimum_max_benefit,
+												peak_duration=self.peak_duration,
+												intraevent_reduction_factor=self.peak_intraevent_reduction_factor,
+												interevent_decay_factor=self.peak_interevent_decay_factor)
 
 		if testing is True:
 			return original_base_benefit, base_daily_benefit  # now contains peak benefits, not base benefit
@@ -644,49 +842,403 @@ class RecessionBenefitBox(BenefitBox):
 		self.max_time_before_fail = max_time_before_fail
 
 	def get_benefit_for_timeseries(self, timeseries, testing=False):
-		days = range(1, 366)  # index 0 == day 1 of water year, index 364 == day 365 of water year
-		original_base_benefit = self.vectorized_single_day_flow_benefit(timeseries, days)  # get the base benefit
+		"""
+			Recession benefit for a water year of flows. Rates of drop are computed for the whole year at once in
+			recession_benefit, so timeseries can also be an (N, 365) block of hydrographs, one per row - rows that
+			drop too fast during the recession are zeroed out without affecting the others.
+		:param timeseries:
+		:param testing: When True, also returns the base benefit and the time in recession at the end of the year
+		:return:
+		"""
+		original_base_benefit = self.base_benefit_for_timeseries(timeseries)  # get the base benefit
 
-		final_benefit = [0,] * 365  # start with zeros, we'll update as we go through if it's different
-		final_benefit[0] = original_base_benefit[0]  # copy over day 1 because we can't compare rate of change for it
+		final_benefit, time_in_recession = recession_benefit(original_base_benefit,
+																timeseries,
+																fail_rate_of_change=self.fail_rate_of_change,
+																full_benefit_rate=self.very_steep_reduction,
+																steep_rate=self.steep_rates[1],
+																steep_reduction=self.steep_reduction,
+																min_time_before_fail=self.min_time_before_fail,
+																max_time_before_fail=self.max_time_before_fail)
 
-		time_in_recession = 0  # we need to keep track of this - we'll only fail when going above the max drop rate if we've been in the recession for a little while
+		if testing is True:
+			return original_base_benefit, final_benefit, time_in_recession
+		else:
+			return final_benefit
 
-		for day, benefit in enumerate(original_base_benefit[1:]):  # only iterate over items 1-end because we already did item 0 on previous line
-			cur_day_idx = day + 1  # add one for mismatch with slicing.
 
-			if benefit == 0:  # if we're outside of the recession box, just go to the next day
-				continue
+class NetworkBenefitTable(object):
+	"""
+		Holds the parameters of every benefit box on every segment of a network as contiguous arrays, shaped
+		(segments, components), so that a whole network's worth of eflows can be scored with a few array operations
+		instead of a Python call per segment and component. Build it once from the segments' benefit boxes (after
+		ready_run) with from_stream_segments, then pass it (segments, 365) eflows matrices - or stacks of them - to
+		get_segment_benefits.
+
+		Base, peak, and recession boxes are converted into arrays. Any other benefit class (see the extension points
+		in the README) is kept as an object and called directly, so custom benefit classes still work. So are boxes
+		with pregenerated surfaces when PREGENERATE_COMPONENTS is set, since those give slightly different values than
+		the exact calculation, and boxes that fail to evaluate when the table is built - those get another try every
+		evaluation and are skipped whenever they fail, the same as StreamSegment.get_benefit_for_timeseries does.
+	"""
 
-			# calculate the rate of drop - we add 1 for current day because of slicing we do in this loop, then "day" is the previous day
-			rate_of_drop = float(timeseries[day] - timeseries[day+1])/timeseries[day]  # numerator reversed so it can be positive and we don't need to use abs (and don't want to - a positive 0.04 rate is *not* same as negation 0.04 rate
-
-			if rate_of_drop > self.fail_rate_of_change:
-				if self.min_time_before_fail < time_in_recession < self.max_time_before_fail:
-					if not testing:
-						return [0, ] * 365
-					else:
-						return original_base_benefit, [0,] * 365, time_in_recession  # return no benefit anywhere - we dropped too fast
-				else:  # if we're not yet really in the recession, then just reset the time in the recession to 0 and skip the rest of the loop
-					time_in_recession = 0  # this reset could create an incentive to do big drops every min_time_before_fail-1 days, but I think the other incentives will overpower that.
-					continue
+	NO_COMPONENT = 0
+	BASE = 1
+	PEAK = 2
+	RECESSION = 3
+	CUSTOM = 4
 
-			elif rate_of_drop < self.very_steep_reduction:  # if it's in this segment's normal range
-				final_benefit[cur_day_idx] = benefit  # return the normal amount of benefit
-			elif rate_of_drop < self.steep_rates[1]:  # if we're in the steep range, reduce benefit
-				final_benefit[cur_day_idx] = benefit * self.steep_reduction
-			else:
-				final_benefit[cur_day_idx] = 0
-				if rate_of_drop < 0:  # if we have a negative rate of drop, that means flow went up, reset counter
-					time_in_recession = 0
+	max_cells_per_chunk = 20000000  # limits the size of the (population, segments, components, days) intermediates
+
+	def __init__(self, component_types, flow_corners, flow_max_benefit, day_corners, day_benefit, peak_parameters,
+					recession_parameters, species_presence, custom_components=None):
+		"""
+			Most code will want from_stream_segments or from_benefit_boxes instead - this takes the already built arrays
+		:param component_types: (segments, components) integer array of NO_COMPONENT, BASE, PEAK, RECESSION, or CUSTOM
+		:param flow_corners: (segments, components, 4) array of q1-q4 for flow
+		:param flow_max_benefit: (segments, components) array of the max benefit of the flow item
+		:param day_corners: (segments, components, 4) array of q1-q4 for days of the water year, unwrapped so they're sequential
+		:param day_benefit: (segments, components, 365) array of the date portion of benefit for each day
+		:param peak_parameters: (segments, components, 5) array of max_benefit, minimum_max_benefit, peak_duration,
+				intraevent reduction factor, and interevent decay factor for peak components
+		:param recession_parameters: (segments, components, 6) array of fail rate of change, full benefit rate, steep rate,
+				steep reduction, min time before fail, and max time before fail for recession components
+		:param species_presence: (segments,) array of the species presence multiplier on each segment
+		:param custom_components: dict of {(segment index, component index): benefit object} for CUSTOM components
+		"""
+		self.component_types = numpy.asarray(component_types, dtype=numpy.int8)
+		self.flow_corners = numpy.asarray(flow_corners, dtype=float)
+		self.flow_max_benefit = numpy.asarray(flow_max_benefit, dtype=float)
+		self.day_corners = numpy.asarray(day_corners, dtype=float)
+		self.day_benefit = numpy.asarray(day_benefit, dtype=float)
+		self.peak_parameters = numpy.asarray(peak_parameters, dtype=float)
+		self.recession_parameters = numpy.asarray(recession_parameters, dtype=float)
+		self.species_presence = numpy.asarray(species_presence, dtype=float)
+		self.custom_components = custom_components or {}
+
+		self.segment_count, self.component_count = self.component_types.shape
+
+		# the segment and component indices of each kind of component, in a stable order we can index by
+		self._components = numpy.nonzero(self.component_types != self.NO_COMPONENT)
+		self._array_components = numpy.nonzero(numpy.isin(self.component_types, (self.BASE, self.PEAK, self.RECESSION)))
+		array_types = self.component_types[self._array_components]
+		self._peak_rows = numpy.flatnonzero(array_types == self.PEAK)
+		self._recession_rows = numpy.flatnonzero(array_types == self.RECESSION)
+
+		self.segment_memo = None  # segment benefit by hydrograph - see use_memo
+
+	@classmethod
+	def from_stream_segments(cls, stream_segments):
+		"""
+			Builds the table from StreamSegment objects that have already had ready_run called, in the order provided.
+			Components whose benefit couldn't be set up at all are left out, since get_benefit_for_timeseries on the
+			segment could never score them either.
+		:param stream_segments: iterable of StreamSegment model instances
+		:return: NetworkBenefitTable
+		"""
+		component_boxes = []
+		species_presence = []
+		for segment in stream_segments:
+			component_boxes.append([getattr(component, "benefit", None) for component in segment._runtime_components])
+			species_presence.append(float(segment.species_presence))
+
+		return cls.from_benefit_boxes(component_boxes, species_presence)
+
+	@classmethod
+	def from_benefit_boxes(cls, component_boxes, species_presence):
+		"""
+			Builds the table from benefit box objects directly.
+		:param component_boxes: list with an item per segment, each a list of that segment's benefit boxes. Boxes that
+				are None are skipped, and boxes that fail to evaluate are kept as custom components - see the class docstring
+		:param species_presence: list of species presence values, one per segment
+		:return: NetworkBenefitTable
+		"""
+		segments = len(component_boxes)
+		components = max([len(boxes) for boxes in component_boxes] + [1, ])
+
+		component_types = numpy.zeros((segments, components), dtype=numpy.int8)
+		flow_corners = numpy.zeros((segments, components, 4))
+		flow_max_benefit = numpy.zeros((segments, components))
+		day_corners = numpy.zeros((segments, components, 4))
+		day_benefit = numpy.zeros((segments, components, 365))
+		peak_parameters = numpy.zeros((segments, components, 5))
+		recession_parameters = numpy.zeros((segments, components, 6))
+		custom_components = {}
+
+		for segment_index, boxes in enumerate(component_boxes):
+			for component_index, box in enumerate(boxes):
+				if box is None:
+					continue
+				try:
+					box.get_benefit_for_timeseries(numpy.zeros(365))
+					evaluates = True
+				except Exception:  # its parameters can't be trusted, so call it directly and skip it whenever it fails
+					log.warning("failed to calculate benefit for {} - it'll be evaluated on its own and skipped when it fails".format(getattr(box, "name", box)))
+					evaluates = False
+
+				pregenerated = PREGENERATE_COMPONENTS and getattr(box, "_annual_benefit", None) is not None
+				if not evaluates or pregenerated or type(box) not in (BenefitBox, PeakBenefitBox, RecessionBenefitBox) or box.flow_item.rollover:
+					component_types[segment_index, component_index] = cls.CUSTOM
+					custom_components[(segment_index, component_index)] = box
 					continue
 
-			time_in_recession += 1  # add a day to our time in the recession - if we make it to this part of the loop, we're going down at a recession rate
+				flow_corners[segment_index, component_index] = [float(q) for q in box.flow_item.corners()]
+				flow_max_benefit[segment_index, component_index] = box.flow_item.max_benefit
+				day_corners[segment_index, component_index] = [float(q) for q in box.date_item.corners()]
+				day_benefit[segment_index, component_index] = box.day_benefit
+
+				if isinstance(box, PeakBenefitBox):
+					component_types[segment_index, component_index] = cls.PEAK
+					peak_parameters[segment_index, component_index] = [box.max_benefit,
+																		box.minimum_max_benefit,
+																		box.peak_duration,
+																		box.peak_intraevent_reduction_factor,
+																		box.peak_interevent_decay_factor]
+				elif isinstance(box, RecessionBenefitBox):
+					component_types[segment_index, component_index] = cls.RECESSION
+					recession_parameters[segment_index, component_index] = [box.fail_rate_of_change,
+																			box.very_steep_reduction,
+																			box.steep_rates[1],
+																			box.steep_reduction,
+																			box.min_time_before_fail,
+																			box.max_time_before_fail]
+				else:
+					component_types[segment_index, component_index] = cls.BASE
+
+		return cls(component_types=component_types,
+					flow_corners=flow_corners,
+					flow_max_benefit=flow_max_benefit,
+					day_corners=day_corners,
+					day_benefit=day_benefit,
+					peak_parameters=peak_parameters,
+					recession_parameters=recession_parameters,
+					species_presence=species_presence,
+					custom_components=custom_components)
+
+	def segment_subset(self, segments):
+		"""
+			A table for just some of the segments
+		:param segments: sequence of segment indices to keep, in the order the new table should have them. Segments
+				can be repeated
+		:return: NetworkBenefitTable
+		"""
+		segments = numpy.asarray(segments, dtype=numpy.int64)
+		new_positions = collections.defaultdict(list)
+		for position, segment in enumerate(segments):
+			new_positions[int(segment)].append(position)
+		return NetworkBenefitTable(component_types=self.component_types[segments],
+									flow_corners=self.flow_corners[segments],
+									flow_max_benefit=self.flow_max_benefit[segments],
+									day_corners=self.day_corners[segments],
+									day_benefit=self.day_benefit[segments],
+									peak_parameters=self.peak_parameters[segments],
+									recession_parameters=self.recession_parameters[segments],
+									species_presence=self.species_presence[segments],
+									custom_components={(position, component): box
+														for (segment, component), box in self.custom_components.items()
+														for position in new_positions.get(segment, [])})
+
+	def component_windows(self):
+		"""
+			The runs of days where each component can give benefit (nonzero date benefit), as flat arrays - useful for
+			making changes that line up with the components. Runs that cross the end of the water year come back as one
+			window starting late in the year, so add days and wrap them with % 365. Custom components don't have date
+			benefit in the table, so they don't have windows.
+		:return: tuple of (segments, starts, lengths) integer arrays, with an item per window
+		"""
+		segments, starts, lengths = [], [], []
+		for segment, component in zip(*self._components):
+			active = self.day_benefit[segment, component] > 0
+			if not numpy.any(active):
+				continue
+			if numpy.all(active):
+				segments.append(segment)
+				starts.append(0)
+				lengths.append(365)
+				continue
 
-		if testing is True:
-			return original_base_benefit, final_benefit, time_in_recession
+			shift = int(numpy.argmin(active))  # roll the year so it starts on an inactive day, then no run wraps around
+			edges = numpy.diff(numpy.concatenate([[0], numpy.roll(active, -shift).astype(numpy.int8), [0]]))
+			run_starts = numpy.flatnonzero(edges == 1)
+			run_ends = numpy.flatnonzero(edges == -1)
+			segments.extend([segment, ] * run_starts.size)
+			starts.extend(((run_starts + shift) % 365).tolist())
+			lengths.extend((run_ends - run_starts).tolist())
+
+		return numpy.array(segments, dtype=numpy.int64), numpy.array(starts, dtype=numpy.int64), numpy.array(lengths, dtype=numpy.int64)
+
+	def to_arrays(self):
+		"""
+			The arrays that define this table, keyed by their argument names for the constructor, so the table can be
+			saved and rebuilt with from_arrays. Custom components are Python objects, not arrays, so they're pickled
+			into a byte array under custom_components - empty when there aren't any. Only load tables that have them
+			from files you trust, like you would any pickle.
+		:return: dict of numpy arrays
+		"""
+		if self.custom_components:
+			try:
+				custom_components = numpy.frombuffer(pickle.dumps(self.custom_components), dtype=numpy.uint8)
+			except (pickle.PicklingError, AttributeError, TypeError) as e:
+				raise ValueError("Custom benefit components need to be picklable to convert a benefit table to arrays: {}".format(e))
 		else:
-			return final_benefit
+			custom_components = numpy.zeros(0, dtype=numpy.uint8)
+
+		return {
+			"custom_components": custom_components,
+			"component_types": self.component_types,
+			"flow_corners": self.flow_corners,
+			"flow_max_benefit": self.flow_max_benefit,
+			"day_corners": self.day_corners,
+			"day_benefit": self.day_benefit,
+			"peak_parameters": self.peak_parameters,
+			"recession_parameters": self.recession_parameters,
+			"species_presence": self.species_presence,
+		}
+
+	@classmethod
+	def from_arrays(cls, arrays):
+		"""
+			Rebuilds a table from the arrays to_arrays made. custom_components is optional, so arrays saved before
+			there was one still load.
+		:param arrays: dict (or other mapping) of numpy arrays, keyed like to_arrays
+		:return: NetworkBenefitTable
+		"""
+		arrays = dict(arrays)
+		custom_components = arrays.pop("custom_components", None)
+		if custom_components is not None and custom_components.size > 0:
+			custom_components = pickle.loads(numpy.asarray(custom_components, dtype=numpy.uint8).tobytes())
+		else:
+			custom_components = None
+		return cls(custom_components=custom_components, **arrays)
 
+	def get_component_benefits(self, eflows):
+		"""
+			Benefit for every component on every segment, before components are collapsed together
+		:param eflows: numpy array of environmental flows shaped (segments, 365), or (population, segments, 365)
+		:return: numpy array shaped (population, segments, components, 365) - population is 1 for 2D input
+		"""
+		flows = numpy.asarray(eflows, dtype=float).reshape(-1, self.segment_count, 365)
+		population = flows.shape[0]
+		benefits = numpy.zeros((population, self.segment_count, self.component_count, 365))
+
+		segments, components = self._array_components
+		if segments.size > 0:
+			q1, q2, q3, q4 = (corner[numpy.newaxis, :, numpy.newaxis] for corner in self.flow_corners[segments, components].T)
+			component_flows = flows[:, segments, :]  # (population, array components, 365)
+			base_benefit = ramp_benefit(component_flows, q1, q2, q3, q4,
+										max_benefit=self.flow_max_benefit[segments, components][numpy.newaxis, :, numpy.newaxis])
+			base_benefit *= self.day_benefit[segments, components][numpy.newaxis]
+
+			if self._peak_rows.size > 0:
+				parameters = numpy.tile(self.peak_parameters[segments[self._peak_rows], components[self._peak_rows]], (population, 1))
+				peak_benefit = peak_event_benefit(base_benefit[:, self._peak_rows].reshape(-1, 365), *parameters.T)
+				peak_benefit = peak_benefit.reshape(population, -1, 365)
+			if self._recession_rows.size > 0:
+				parameters = numpy.tile(self.recession_parameters[segments[self._recession_rows], components[self._recession_rows]], (population, 1))
+				recession, _ = recession_benefit(base_benefit[:, self._recession_rows].reshape(-1, 365),
+													component_flows[:, self._recession_rows].reshape(-1, 365),
+													*parameters.T)
+				recession = recession.reshape(population, -1, 365)
+
+			if self._peak_rows.size > 0:
+				base_benefit[:, self._peak_rows] = peak_benefit
+			if self._recession_rows.size > 0:
+				base_benefit[:, self._recession_rows] = recession
+			benefits[:, segments, components] = base_benefit
+
+		for (segment, component), box in self.custom_components.items():
+			for member in range(population):
+				try:
+					benefits[member, segment, component] = box.get_benefit_for_timeseries(flows[member, segment])
+				except Exception:  # skipped for this evaluation, like StreamSegment.get_benefit_for_timeseries does
+					log.warning("failed to calculate benefit for {}".format(getattr(box, "name", box)))
+
+		return benefits
+
+	def use_memo(self, max_bytes):
+		"""
+			Turns on memoization of segment benefits - a caching.ArrayMemo of each segment's total benefit keyed by a
+			fingerprint of the segment and the eflows hydrograph it was scored on, so hydrographs we've already seen,
+			like on headwaters that didn't change or on survivors that get evaluated again, don't get scored twice.
+			Only applies to annual totals with the default collapse function.
+		:param max_bytes: memory budget for the memo across the whole network. None or 0 turns memoization off
+		"""
+		self.segment_memo = caching.ArrayMemo(max_bytes, name="segment benefit") if max_bytes else None
 
+	def memo_stats(self):
+		"""
+			Hits, misses, and memory use of the segment benefit memo - see caching.ArrayMemo.stats
+		"""
+		return caching.combine_stats([self.segment_memo] if self.segment_memo is not None else [])
 
+	def get_segment_benefits(self, eflows, daily=False, collapse_function=numpy.max, segments=None):
+		"""
+			Total benefit on each segment, equivalent to calling get_benefit_for_timeseries on each StreamSegment
+		:param eflows: numpy array of environmental flows shaped (segments, 365), or (..., segments, 365) for many
+				allocations at once, such as a whole population
+		:param daily: When True, returns benefit by day instead of summing across the water year
+		:param collapse_function: numpy function used to combine overlapping components. Defaults to numpy.max
+		:param segments: indices of the segments the eflows are for, when only scoring some of them. By default, eflows
+				has every segment in order
+		:return: numpy array shaped (..., segments), or (..., segments, 365) when daily is True
+		"""
+		eflows = numpy.asarray(eflows, dtype=float)
+		if self.segment_memo is not None and not daily and collapse_function is numpy.max:
+			if segments is None:
+				segments = numpy.arange(self.segment_count)
+			return self._get_memoized_segment_benefits(eflows, numpy.asarray(segments, dtype=numpy.int64))
+		if segments is not None:
+			return self.segment_subset(segments).get_segment_benefits(eflows, daily=daily, collapse_function=collapse_function)
+
+		leading_shape = eflows.shape[:-2]
+		flows = eflows.reshape(-1, self.segment_count, 365)
+
+		# work through the population in chunks so the intermediate arrays stay a reasonable size on big networks
+		chunk_size = max(1, int(self.max_cells_per_chunk / (self.segment_count * self.component_count * 365)))
+		results = []
+		for chunk_start in range(0, flows.shape[0], chunk_size):
+			daily_values = collapse_function(self.get_component_benefits(flows[chunk_start:chunk_start + chunk_size]), axis=2)
+			if daily:
+				results.append(daily_values * self.species_presence[:, numpy.newaxis])
+			else:
+				results.append(numpy.sum(daily_values, axis=-1) * self.species_presence)
+
+		results = numpy.concatenate(results)
+		if daily:
+			return results.reshape(leading_shape + (self.segment_count, 365))
+		return results.reshape(leading_shape + (self.segment_count,))
+
+	def _get_memoized_segment_benefits(self, eflows, segments):
+		"""
+			get_segment_benefits, but looking every (segment, hydrograph) pair up in the memo first, all at once.
+			Everything that isn't there gets scored together as one flat batch of pairs, with repeats only scored once,
+			then added to the memo.
+		"""
+		leading_shape = eflows.shape[:-2]
+		flows = eflows.reshape(-1, 365)  # one row per (member, segment) pair
+		pair_segments = numpy.tile(segments, flows.shape[0] // max(segments.size, 1))
+		high, low = caching.ArrayMemo.keys_for(flows, pair_segments)
+		results, found = self.segment_memo.get(high, low)
+
+		missing = numpy.flatnonzero(~found)
+		if missing.size > 0:
+			_, first, inverse = numpy.unique(numpy.stack([high[missing], low[missing]], axis=1), axis=0, return_index=True, return_inverse=True)
+			to_score = missing[first]
+
+			# score the missing pairs as if each were its own segment, in chunks so intermediates stay a reasonable size
+			chunk_size = max(1, int(self.max_cells_per_chunk / (self.component_count * 365)))
+			values = numpy.concatenate([self.segment_subset(pair_segments[to_score[start:start + chunk_size]]).get_segment_benefits(flows[to_score[start:start + chunk_size]])
+										for start in range(0, to_score.size, chunk_size)])
+
+			results[missing] = values[inverse.ravel()]
+			self.segment_memo.put(high[to_score], low[to_score], values)
+
+		return results.reshape(leading_shape + (segments.size,))
+
+	def get_benefit(self, eflows):
+		"""
+			Total environmental benefit across the network
+		:param eflows: numpy array of environmental flows shaped (segments, 365), or (..., segments, 365)
+		:return: float, or array shaped (...) for stacked input
+		"""
+		return numpy.sum(self.get_segment_benefits(eflows), axis=-1)
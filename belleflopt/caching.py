@@ -0,0 +1,353 @@
+"""
+	Small building blocks for skipping work we've already done - fast fingerprints of float arrays, a least recently
+	used cache that's bounded by memory instead of by a number of entries, and an array-based memo that looks up a
+	whole batch of fingerprinted rows at once.
+
+	Nothing in this module should import Django.
+"""
+
+import collections
+import logging
+import sys
+
+import numpy
+
+log = logging.getLogger("belleflopt.caching")
+
+_fingerprint_weights = {}
+_ENTRY_OVERHEAD = 100  # rough bytes of dictionary and linked list bookkeeping for each cache entry
+_GROUP_MIX = numpy.uint64(0x9E3779B97F4A7C15)  # odd constant that spreads group numbers across all 64 bits of a key
+
+
+def fingerprint_rows(array, seed=0):
+	"""
+		Quick 64 bit fingerprint of each row of a float array - a weighted sum of the raw bits of every value, which
+		wraps around instead of overflowing. Rows with the same values always get the same fingerprint, and rows with
+		different values almost never do, so it's good for narrowing down which rows to compare, but it isn't a
+		guarantee they match. Different seeds give independent fingerprints.
+	:param array: float array - the last axis is the row
+	:param seed: which set of weights to use
+	:return: uint64 array of fingerprints, with the shape of array minus its last axis
+	"""
+	array = numpy.ascontiguousarray(array, dtype=numpy.float64)
+	length = array.shape[-1]
+	if (length, seed) not in _fingerprint_weights:  # fixed seeds so fingerprints are the same from run to run and process to process
+		_fingerprint_weights[(length, seed)] = numpy.random.RandomState([seed, length]).randint(1, 2 ** 62, size=length, dtype=numpy.uint64) * 2 + 1
+	return numpy.sum(array.view(numpy.uint64) * _fingerprint_weights[(length, seed)], axis=-1, dtype=numpy.uint64)
+
+
+def hydrograph_keys(array):
+	"""
+		Cache keys for float64 hydrographs (or any rows of floats) - two independent fingerprints packed into 16
+		bytes, which makes telling two different hydrographs apart all but certain, without keeping the hydrographs
+		around to compare.
+	:param array: float array - the last axis is the hydrograph
+	:return: a bytes key for a single hydrograph, or nested lists of them matching the shape of array minus its last axis
+	"""
+	fingerprints = numpy.stack([fingerprint_rows(array, seed=0), fingerprint_rows(array, seed=1)], axis=-1)
+	return numpy.ascontiguousarray(fingerprints).view(numpy.dtype((numpy.void, 16)))[..., 0].tolist()
+
+
+def _size_of(value):
+	if isinstance(value, numpy.ndarray):
+		return value.nbytes + sys.getsizeof(numpy.empty(0))
+	return sys.getsizeof(value)
+
+
+class LRUCache(object):
+	"""
+		Least recently used cache that drops its oldest entries once its keys and values take up more than max_bytes.
+		Keeps count of hits and misses so we can tell whether it's earning its keep.
+	"""
+
+	def __init__(self, max_bytes, name=None):
+		"""
+		:param max_bytes: roughly how much memory the cache can use, counting its keys, values, and bookkeeping
+		:param name: what to call the cache in log messages
+		"""
+		self.max_bytes = max_bytes
+		self.name = name
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+		self._entries = collections.OrderedDict()  # least recently used first - values are (value, size)
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	def get(self, key, default=None):
+		"""
+			Gets a value and counts the hit or miss
+		:return: the cached value, or default if it's not in the cache
+		"""
+		try:
+			value, _ = self._entries[key]
+		except KeyError:
+			self.misses += 1
+			return default
+
+		self.hits += 1
+		self._entries.move_to_end(key)
+		return value
+
+	def put(self, key, value):
+		"""
+			Adds a value, dropping the least recently used entries if the cache is over its memory limit. Values that
+			wouldn't fit in the cache on their own aren't stored.
+		"""
+		size = _size_of(key) + _size_of(value) + _ENTRY_OVERHEAD
+		if key in self._entries:
+			self.nbytes -= self._entries.pop(key)[1]
+		if size > self.max_bytes:
+			return
+
+		self._entries[key] = (value, size)
+		self.nbytes += size
+		while self.nbytes > self.max_bytes:
+			_, (_, dropped_size) = self._entries.popitem(last=False)
+			self.nbytes -= dropped_size
+			self.evictions += 1
+
+	def clear(self):
+		self._entries.clear()
+		self.nbytes = 0
+
+	@property
+	def hit_rate(self):
+		lookups = self.hits + self.misses
+		return self.hits / lookups if lookups else 0.0
+
+	def stats(self):
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": self.hit_rate,
+			"evictions": self.evictions,
+			"entries": len(self._entries),
+			"bytes": self.nbytes,
+		}
+
+
+def combine_stats(caches):
+	"""
+		Adds up the stats of a group of caches, like the per-segment caches of a network
+	:param caches: iterable of LRUCache objects
+	:return: dict with the same keys as LRUCache.stats
+	"""
+	totals = {"hits": 0, "misses": 0, "evictions": 0, "entries": 0, "bytes": 0}
+	for cache in caches:
+		for key, value in cache.stats().items():
+			if key in totals:
+				totals[key] += value
+	lookups = totals["hits"] + totals["misses"]
+	totals["hit_rate"] = totals["hits"] / lookups if lookups else 0.0
+	return totals
+
+
+class SolutionCache(LRUCache):
+	"""
+		Remembers the objectives of solutions we've already evaluated, keyed by their decision variables, so elitist
+		algorithms that come up with the same solution again don't pay for evaluating it again. With a tolerance,
+		variables are rounded to multiples of it first, so solutions that only differ by less than that (roughly) count
+		as the same solution.
+	"""
+
+	def __init__(self, max_bytes, tolerance=None, name="solution"):
+		"""
+		:param max_bytes: roughly how much memory the cache can use
+		:param tolerance: when set, decision variables that round to the same multiple of this share an entry
+		:param name: what to call the cache in log messages
+		"""
+		super(SolutionCache, self).__init__(max_bytes, name=name)
+		self.tolerance = tolerance
+
+	def key_for(self, variables):
+		variables = numpy.asarray(variables, dtype=numpy.float64)
+		if self.tolerance:
+			variables = numpy.round(variables / self.tolerance) + 0.0  # adding zero turns any -0.0 into 0.0 so they share a key
+		return hydrograph_keys(variables)
+
+	def apply(self, solution, key=None):
+		"""
+			Sets the objectives on a platypus Solution and marks it evaluated if we've seen its variables before
+		:param key: the solution's key_for, if the caller already has it
+		:return: True if the solution came from the cache, False if it still needs evaluating
+		"""
+		objectives = self.get(self.key_for(solution.variables) if key is None else key)
+		if objectives is None:
+			return False
+
+		solution.objectives[:] = objectives
+		solution.constraint_violation = 0.0  # our problems don't have constraints
+		solution.feasible = True
+		solution.evaluated = True
+		return True
+
+	def store(self, solution):
+		"""
+			Remembers an evaluated solution's objectives
+		"""
+		self.put(self.key_for(solution.variables), tuple(solution.objectives))
+
+
+class ArrayMemo(object):
+	"""
+		Remembers a float for each of many (group, row) pairs - like each segment's benefit for the eflows hydrographs
+		it's been scored on - doing lookups and inserts for a whole batch of pairs with array operations instead of a
+		dictionary lookup per pair. Keys are two independent fingerprints of each row (see hydrograph_keys), with the
+		group mixed into the first, and are kept sorted by that first word so a batch of lookups is a searchsorted.
+		New entries go in a small sorted buffer that gets merged into the rest of the entries once it's a fraction of
+		their size, so inserts don't have to re-sort everything each time. Once it holds more than max_bytes worth of
+		entries, the least recently used ones get dropped, a buffer's worth at a time.
+	"""
+
+	entry_bytes = 32  # two key words, the value, and when it was last used
+	buffer_fraction = 8  # the buffer gets merged in when it has 1/8 as many entries as the memo can hold
+	min_buffer_entries = 1024
+
+	def __init__(self, max_bytes, name=None):
+		"""
+		:param max_bytes: how much memory the entries can use
+		:param name: what to call the memo in log messages
+		"""
+		self.max_bytes = max_bytes
+		self.max_entries = max(int(max_bytes // self.entry_bytes), 0)
+		self.buffer_entries = min(max(self.max_entries // self.buffer_fraction, self.min_buffer_entries), self.max_entries)
+		self.name = name
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.clear()
+
+	def __len__(self):
+		return self._entries[2].size + self._buffer[2].size
+
+	@staticmethod
+	def _empty_entries():
+		# high, low, values, last used - sorted by high
+		return [numpy.empty(0, dtype=numpy.uint64), numpy.empty(0, dtype=numpy.uint64), numpy.empty(0), numpy.empty(0, dtype=numpy.int64)]
+
+	def clear(self):
+		self._entries = self._empty_entries()
+		self._buffer = self._empty_entries()
+		self._clock = 0
+
+	@staticmethod
+	def keys_for(rows, groups):
+		"""
+			Keys for rows of floats that belong to groups - the same row in two groups gets two different keys
+		:param rows: float array - the last axis is the row
+		:param groups: non-negative integer array of the group each row is in, broadcastable to rows minus its last axis
+		:return: tuple of (high, low) uint64 arrays, shaped like rows minus its last axis
+		"""
+		high = fingerprint_rows(rows, seed=0)
+		groups = numpy.broadcast_to(numpy.asarray(groups, dtype=numpy.uint64), high.shape)
+		return high ^ (groups * _GROUP_MIX), fingerprint_rows(rows, seed=1)  # uint64 arrays wrap instead of overflowing
+
+	def _find(self, entries, high, low, values, found):
+		"""
+			Fills in values and found for keys that are in one set of sorted entries and marks them used
+		"""
+		entry_high, entry_low, entry_values, last_used = entries
+		if entry_values.size == 0:
+			return
+		# this is the first entry that could match. A different key with the same high word is just a miss, so results
+		# are never wrong - but that's all but impossible anyway
+		positions = numpy.minimum(numpy.searchsorted(entry_high, high), entry_values.size - 1)
+		matches = (entry_high[positions] == high) & (entry_low[positions] == low)
+		values[matches] = entry_values[positions[matches]]
+		last_used[positions[matches]] = self._clock
+		found |= matches
+
+	def get(self, high, low):
+		"""
+			Looks up a batch of keys, counting hits and misses
+		:param high: uint64 array of keys' first words, from keys_for
+		:param low: uint64 array of keys' second words, the same shape
+		:return: tuple of (values, found) - a float array with nan wherever the key wasn't found, and a boolean array
+				of which keys were found
+		"""
+		high = numpy.asarray(high, dtype=numpy.uint64)
+		low = numpy.asarray(low, dtype=numpy.uint64)
+		values = numpy.full(high.shape, numpy.nan)
+		found = numpy.zeros(high.shape, dtype=bool)
+		self._clock += 1
+		self._find(self._entries, high, low, values, found)
+		self._find(self._buffer, high, low, values, found)
+
+		hits = int(numpy.count_nonzero(found))
+		self.hits += hits
+		self.misses += found.size - hits
+		return values, found
+
+	@staticmethod
+	def _merge(entries, new_entries):
+		"""
+			Merges two sets of entries that are each sorted by high, without sorting them all again
+		"""
+		positions = numpy.searchsorted(entries[0], new_entries[0])
+		return [numpy.insert(column, positions, new_column) for column, new_column in zip(entries, new_entries)]
+
+	def put(self, high, low, values):
+		"""
+			Adds entries for keys that aren't in the memo yet. They go in the buffer, which gets merged into the rest of
+			the entries when it's full or the memo is over its memory limit, dropping the least recently used entries
+			if need be.
+		:param high: uint64 array of keys' first words, from keys_for - without repeats
+		:param low: uint64 array of keys' second words
+		:param values: float array of the values for the keys
+		"""
+		self._clock += 1
+		high = numpy.asarray(high, dtype=numpy.uint64).ravel()
+		order = numpy.argsort(high, kind="stable")  # only sorts the new entries
+		new_entries = [high[order], numpy.asarray(low, dtype=numpy.uint64).ravel()[order],
+						numpy.asarray(values, dtype=float).ravel()[order], numpy.full(high.size, self._clock, dtype=numpy.int64)]
+		self._buffer = self._merge(self._buffer, new_entries)
+
+		if self._buffer[2].size >= self.buffer_entries or len(self) > self.max_entries:
+			self._flush()
+
+	def _flush(self):
+		"""
+			Merges the buffer into the rest of the entries. When that puts the memo over its memory limit, drops the least
+			recently used entries until there's room for another full buffer, so evictions don't happen on every put
+		"""
+		entries = self._merge(self._entries, self._buffer)
+		self._buffer = self._empty_entries()
+		if entries[2].size > self.max_entries:
+			keep_entries = self.max_entries - self.buffer_entries if self.buffer_entries < self.max_entries else self.max_entries
+			dropped = entries[2].size - keep_entries
+			self.evictions += dropped
+			if keep_entries > 0:
+				keep = numpy.sort(numpy.argpartition(entries[3], dropped - 1)[dropped:])  # keeps them in order
+			else:
+				keep = numpy.empty(0, dtype=numpy.int64)
+			entries = [column[keep] for column in entries]
+		self._entries = entries
+
+	@property
+	def nbytes(self):
+		return len(self) * self.entry_bytes
+
+	@property
+	def hit_rate(self):
+		lookups = self.hits + self.misses
+		return self.hits / lookups if lookups else 0.0
+
+	def stats(self):
+		"""
+			The same counts as LRUCache.stats
+		"""
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": self.hit_rate,
+			"evictions": self.evictions,
+			"entries": len(self),
+			"bytes": self.nbytes,
+		}
@@ -0,0 +1,337 @@
+"""
+	Cooperative coevolution across sub-basins. The decision variables for separate tributaries only interact through
+	the water they send downstream and the basin-wide total of economic water, so instead of one NSGAII population
+	searching every segment's variables at once, this splits the network into sub-basins and optimizes each one's
+	variables on its own - in parallel worker processes - while every other segment keeps its allocations from a
+	shared context: a full-network solution from the current archive. After each round, the sub-basins' results are
+	merged back into full-network solutions, both as they came back and recombined across sub-basins, and the
+	nondominated ones become the archive the next round draws its contexts from.
+
+	Sub-basin solutions are always scored on the whole network, so every objective value here is a real full-network
+	value - only the search is split up.
+
+	Nothing in this module should import Django - worker processes import it to get started.
+"""
+
+import concurrent.futures
+import logging
+import math
+import multiprocessing
+import random
+
+import numpy
+from platypus import Problem, Real, Generator, NSGAII, nondominated
+
+from belleflopt import array_solutions
+from belleflopt import compiled
+from belleflopt import evaluators
+from belleflopt import parallel
+from belleflopt import variation
+
+log = logging.getLogger("belleflopt.coevolution")
+
+
+def partition_subbasins(router, max_segments):
+	"""
+		Splits a network into sub-basins of at most max_segments segments. Each sub-basin is the whole network upstream
+		of (and including) a segment that's small enough when the segment below it isn't - so cuts land where a
+		tributary joins a bigger river. Whatever's left over, usually the mainstem, becomes one more sub-basin.
+	:param router: routing.NetworkRouter for the network
+	:param max_segments: the most segments any sub-basin above the mainstem can have
+	:return: list of sorted segment index arrays, one per sub-basin
+	"""
+	upstream_sizes = numpy.ones(router.segment_count, dtype=numpy.int64)  # segments at and above each segment
+	for sources, targets in router.level_outflows:
+		if sources.size > 0:
+			numpy.add.at(upstream_sizes, targets, upstream_sizes[sources])
+
+	downstream = router.downstream_indices
+	small = upstream_sizes <= max_segments
+	roots = numpy.flatnonzero(small & ((downstream < 0) | ~small[numpy.maximum(downstream, 0)]))
+
+	subbasins = numpy.full(router.segment_count, -1, dtype=numpy.int64)
+	subbasins[roots] = numpy.arange(roots.size)
+	for sources, targets in reversed(router.level_outflows):  # from the outlets up, everything takes its root's sub-basin
+		if sources.size > 0:
+			unassigned = subbasins[sources] < 0
+			subbasins[sources[unassigned]] = subbasins[targets[unassigned]]
+
+	partition = [numpy.flatnonzero(subbasins == subbasin) for subbasin in range(roots.size)]
+	leftover = numpy.flatnonzero(subbasins < 0)
+	if leftover.size > 0:
+		partition.append(leftover)
+	return partition
+
+
+class _InitialVariablesGenerator(Generator):
+	"""
+		Starts a population from given variables, cycling through them if the population is bigger
+	"""
+
+	def __init__(self, initial_variables):
+		super(_InitialVariablesGenerator, self).__init__()
+		self.initial_variables = initial_variables
+		self._next = 0
+
+	def generate(self, problem):
+		solution = array_solutions.make_solution(problem)
+		array_solutions.set_variables(solution, self.initial_variables[self._next % len(self.initial_variables)])
+		self._next += 1
+		return solution
+
+
+class SubbasinProblem(Problem):
+	"""
+		The decision variables of one sub-basin, scored on the full network with every other segment's allocations
+		taken from a context allocation
+	"""
+
+	def __init__(self, stream_network, segments, context, min_proportion=0, variable_dtype=None):
+		"""
+		:param stream_network: CompiledStreamNetwork (or StreamNetwork) to score on
+		:param segments: indices of the sub-basin's segments
+		:param context: (segments, 365) allocations for the whole network - the sub-basin's rows get replaced
+		:param min_proportion: lowest allocation proportion allowed
+		:param variable_dtype: see StreamNetworkProblem
+		"""
+		self.stream_network = stream_network
+		self.segments = numpy.asarray(segments)
+		self.context = numpy.asarray(context, dtype=float).reshape(-1, 365)
+		self.variable_dtype = numpy.dtype(variable_dtype) if variable_dtype is not None else None
+		self.eflows_nfe = 0
+
+		super(SubbasinProblem, self).__init__(self.segments.size * 365, 2)
+		self.directions[:] = Problem.MAXIMIZE
+		self.types[:] = Real(min_proportion, 1)
+
+	def full_allocations(self, variables):
+		"""
+			Puts sub-basin variables into the context
+		:param variables: (solutions, sub-basin variables) array
+		:return: (solutions, network segments * 365) array
+		"""
+		variables = numpy.asarray(variables, dtype=float)
+		allocations = numpy.repeat(self.context[numpy.newaxis], variables.shape[0], axis=0)
+		allocations[:, self.segments] = variables.reshape(variables.shape[0], self.segments.size, 365)
+		return allocations.reshape(variables.shape[0], -1)
+
+	def evaluate(self, solution):
+		self.evaluate_batch([solution])
+
+	def evaluate_batch(self, solutions):
+		allocations = self.full_allocations(array_solutions.stack_variables(solutions, dtype=float))
+		benefits = self.stream_network.get_population_benefits(allocations)
+		for solution, environmental_benefit, economic_benefit in zip(solutions, benefits["environmental_benefit"], benefits["economic_benefit"]):
+			solution.objectives[:] = [float(environmental_benefit), float(economic_benefit)]
+			solution.constraint_violation = 0.0
+			solution.feasible = True
+			solution.evaluated = True
+		self.eflows_nfe += len(solutions)
+
+
+def _optimize_subbasin(stream_network, task):
+	"""
+		Runs the algorithm on one sub-basin
+	:return: tuple of ((solutions, sub-basin variables) array, (solutions, 2) objectives array, NFE used)
+	"""
+	random.seed(task["seed"])  # platypus draws from the random module
+	problem = SubbasinProblem(stream_network, task["segments"], task["context"], min_proportion=task["min_proportion"])
+	algorithm_args = variation.vectorized_operators(task["algorithm"], seed=task["seed"]) if task["vectorized_operators"] else {}
+	algorithm = task["algorithm"](problem,
+									population_size=task["popsize"],
+									generator=_InitialVariablesGenerator(task["initial_variables"]),
+									evaluator=evaluators.BatchEvaluator(),
+									**algorithm_args)
+	algorithm.run(task["nfe"])
+
+	results = nondominated(algorithm.result)
+	variables = array_solutions.stack_variables(results, dtype=float)
+	objectives = numpy.array([solution.objectives[:] for solution in results], dtype=float)
+	return variables, objectives, problem.eflows_nfe
+
+
+def _optimize_subbasin_in_worker(task):
+	return _optimize_subbasin(parallel._worker_network, task)
+
+
+class CooperativeCoevolution(object):
+	"""
+		Optimizes a network problem one sub-basin at a time against a shared context, merging the results into a
+		full-network archive after every round (see the module docstring). Use run like a platypus algorithm's, and
+		the archive ends up in result as solutions of the original problem, so the usual plotting and output code
+		works on it.
+
+		With more than one worker, sub-basins are optimized in worker processes that share a compiled copy of the
+		network (see parallel.SharedNetworkArrays) and evaluate incrementally, since only their own sub-basin and
+		what's downstream of it ever changes. Call close when done to shut them down.
+	"""
+
+	def __init__(self, problem, subbasins=None, max_segments=None, workers=1, algorithm=NSGAII, popsize=50,
+					subbasin_nfe=None, archive_size=None, vectorized_operators=False, seed=None, start_method="spawn"):
+		"""
+		:param problem: StreamNetworkProblem or CompiledNetworkProblem with daily decision variables for every segment -
+				not simplified, encoded, or with collapsed reaches
+		:param subbasins: roughly how many sub-basins to split the network into. Defaults to twice the number of workers
+		:param max_segments: the most segments in a sub-basin - overrides subbasins when set
+		:param workers: number of worker processes. With 1, sub-basins are optimized in this process, one at a time
+		:param algorithm: platypus algorithm class to optimize each sub-basin with
+		:param popsize: population size for each sub-basin, and how many recombined solutions to try in each merge
+		:param subbasin_nfe: NFE per sub-basin per round. Defaults to 10 generations' worth
+		:param archive_size: most full-network solutions to keep between rounds. Defaults to popsize
+		:param vectorized_operators: when True, sub-basin algorithms use the operators from belleflopt.variation
+		:param seed: seed for picking contexts and recombining, and for the sub-basin runs
+		:param start_method: multiprocessing start method for the workers
+		"""
+		if getattr(problem, "simplified", False) or getattr(problem, "encoding", None) is not None or getattr(problem, "reaches", None) is not None:
+			raise ValueError("Cooperative coevolution needs daily decision variables for every segment - it doesn't work with simplified, encoded, or collapsed problems")
+
+		self.problem = problem
+		self.stream_network = problem.stream_network
+		self.workers = workers
+		self.algorithm = algorithm
+		self.popsize = popsize
+		self.subbasin_nfe = subbasin_nfe or popsize * 10
+		self.archive_size = archive_size or popsize
+		self.vectorized_operators = vectorized_operators
+		self.start_method = start_method
+		self.min_proportion = float(problem.types[0].min_value)
+
+		router = self.stream_network.router
+		if max_segments is None:
+			max_segments = int(math.ceil(router.segment_count / float(subbasins or 2 * workers)))
+		self.subbasins = partition_subbasins(router, max(1, max_segments))
+		log.info("Split {} segments into {} sub-basins of up to {} segments".format(router.segment_count, len(self.subbasins), max(subbasin.size for subbasin in self.subbasins)))
+
+		self.random_generator = numpy.random.default_rng(seed if seed is not None else random.getrandbits(64))
+		self.archive_variables = numpy.zeros((0, problem.nvars))
+		self.archive_objectives = numpy.zeros((0, 2))
+		self.nfe = 0
+		self.rounds = 0
+
+		self._pool = None
+		self._shared_arrays = None
+
+	def _start_pool(self):
+		network = self.stream_network
+		if not isinstance(network, compiled.CompiledStreamNetwork):
+			network = network.compile()
+		self._shared_arrays = parallel.SharedNetworkArrays(network)
+
+		log.info("Starting {} sub-basin workers".format(self.workers))
+		self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+															mp_context=multiprocessing.get_context(self.start_method),
+															initializer=parallel._initialize_worker,
+															initargs=(self._shared_arrays.manifest, self.stream_network.economic_benefit_calculator, True))
+
+	def close(self):
+		"""
+			Shuts down the worker processes and releases their shared memory, if there are any. Safe to call more than once
+		"""
+		if self._pool is not None:
+			self._pool.shutdown(wait=True)
+			self._pool = None
+		if self._shared_arrays is not None:
+			self._shared_arrays.close()
+			self._shared_arrays = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def _evaluate(self, variables):
+		"""
+			Scores full-network variables through the original problem, so its tracking values and NFE count include them
+		:return: (solutions, 2) objectives array
+		"""
+		solutions = []
+		for values in variables:
+			solution = array_solutions.make_solution(self.problem)
+			array_solutions.set_variables(solution, values)
+			solutions.append(solution)
+		self.problem.evaluate_batch(solutions)
+		self.nfe += len(solutions)
+		return numpy.array([solution.objectives[:] for solution in solutions], dtype=float)
+
+	def _initialize(self):
+		# the same starting point as optimize.InitialFlowsGenerator - almost everything for the environment
+		levels = self.random_generator.uniform(0.6, 1.0, self.popsize)
+		variables = numpy.clip(numpy.repeat(levels[:, numpy.newaxis], self.problem.nvars, axis=1), self.min_proportion, 1)
+		self._update_archive(variables, self._evaluate(variables))
+
+	def _update_archive(self, variables, objectives):
+		self.archive_variables, self.archive_objectives = array_solutions.merge_archive(self.archive_variables, self.archive_objectives,
+																		variables, objectives, self.archive_size)
+
+	def _tasks(self):
+		archive = self.archive_variables.reshape(len(self.archive_variables), -1, 365)
+		tasks = []
+		for subbasin in self.subbasins:
+			context = archive[self.random_generator.integers(len(archive))]
+			initial = archive[self.random_generator.permutation(len(archive))][:, subbasin].reshape(len(archive), -1)
+			tasks.append({
+				"segments": subbasin,
+				"context": context,
+				"initial_variables": initial,
+				"algorithm": self.algorithm,
+				"popsize": self.popsize,
+				"nfe": self.subbasin_nfe,
+				"min_proportion": self.min_proportion,
+				"vectorized_operators": self.vectorized_operators,
+				"seed": int(self.random_generator.integers(2 ** 31)),
+			})
+		return tasks
+
+	def run_round(self):
+		"""
+			Optimizes every sub-basin against a context from the archive, then merges the results into the archive
+		"""
+		if len(self.archive_variables) == 0:
+			self._initialize()
+
+		tasks = self._tasks()
+		if self.workers > 1:
+			if self._pool is None:
+				self._start_pool()
+			results = list(self._pool.map(_optimize_subbasin_in_worker, tasks))
+		else:
+			results = [_optimize_subbasin(self.stream_network, task) for task in tasks]
+
+		# each sub-basin's results in its own context are already scored on the full network
+		candidates, candidate_objectives = [], []
+		for task, (variables, objectives, nfe) in zip(tasks, results):
+			self.nfe += nfe
+			allocations = numpy.repeat(task["context"][numpy.newaxis], len(variables), axis=0)
+			allocations[:, task["segments"]] = variables.reshape(len(variables), task["segments"].size, 365)
+			candidates.append(allocations.reshape(len(variables), -1))
+			candidate_objectives.append(objectives)
+
+		# and recombining them across sub-basins, on top of archive members, is where the cooperation comes in
+		archive = self.archive_variables.reshape(len(self.archive_variables), -1, 365)
+		recombined = archive[self.random_generator.integers(len(archive), size=self.popsize)].copy()
+		for task, (variables, _, _) in zip(tasks, results):
+			picks = variables[self.random_generator.integers(len(variables), size=self.popsize)]
+			recombined[:, task["segments"]] = picks.reshape(self.popsize, task["segments"].size, 365)
+		recombined = recombined.reshape(self.popsize, -1)
+		candidates.append(recombined)
+		candidate_objectives.append(self._evaluate(recombined))
+
+		self._update_archive(numpy.concatenate(candidates), numpy.concatenate(candidate_objectives))
+		self.rounds += 1
+		log.info("Round {} done at {} NFE - {} solutions in the archive".format(self.rounds, self.nfe, len(self.archive_variables)))
+
+	def run(self, NFE):
+		"""
+			Runs rounds until at least NFE more evaluations have been used - counting the sub-basin runs and the merges
+		"""
+		target = self.nfe + NFE
+		while self.nfe < target:
+			self.run_round()
+
+	@property
+	def result(self):
+		"""
+			The archive as evaluated solutions of the original problem
+		"""
+		return array_solutions.evaluated_solutions(self.problem, self.archive_variables, self.archive_objectives)
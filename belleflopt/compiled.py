@@ -0,0 +1,511 @@
+"""
+	Django-free networks and problems. Building a StreamNetwork queries daily flows and flow components for every
+	segment, which is slow, and needs the database - so once a network is built, StreamNetwork.compile (or the
+	compile_model_run management command) can save everything needed to evaluate it - topology, flows, benefit
+	component parameters, and species presence - into a single .npz file. CompiledStreamNetwork.load gets a network
+	ready to evaluate back from that file without importing Django, which also makes it cheap to load in worker
+	processes.
+
+	Evaluation only needs arrays, so it lives here, in ArrayStreamNetwork and ArrayNetworkProblem - StreamNetwork and
+	StreamNetworkProblem in optimize build on them and add the segment objects and plotting that need Django.
+
+	Nothing in this module should import Django or anything that needs it.
+"""
+
+import abc
+import hashlib
+import logging
+
+import numpy
+from platypus import Problem, Real
+
+from belleflopt import array_solutions
+from belleflopt import benefit
+from belleflopt import caching
+from belleflopt import economic_components
+from belleflopt import encodings
+from belleflopt import incremental
+from belleflopt import routing
+
+log = logging.getLogger("belleflopt.compiled")
+
+SNAPSHOT_VERSION = 1
+DEFAULT_BENEFIT_MEMO_BYTES = 64 * 1024 ** 2  # segment benefit memo budget for problems, unless they set their own
+
+
+class ArrayStreamNetwork(abc.ABC):
+	"""
+		Evaluates allocations on a network from its router and benefit table - routing, scoring benefit, and adding up
+		economic water, for one allocation or a whole population at once. This is everything about a network that
+		optimization needs, so optimize.StreamNetwork (built from the database, with segment objects for plotting) and
+		CompiledStreamNetwork (loaded from a snapshot) both build on it, and evaluate allocations identically.
+	"""
+
+	def __init__(self, router, benefit_table, economic_benefit_instance=None):
+		"""
+		:param router: routing.NetworkRouter for the network, in decision variable order
+		:param benefit_table: benefit.NetworkBenefitTable for the segments, in the same order
+		:param economic_benefit_instance: economic_components.EconomicBenefit instance - usually set by the problem
+		"""
+		self.router = router
+		self.benefit_table = benefit_table
+		self.economic_benefit_calculator = economic_benefit_instance
+
+		self.allocations = None
+		self.routed_water = None
+		self.incremental_evaluator = None
+		self.reaches = None
+		self.reach_report = None
+
+	@abc.abstractmethod
+	def get_total_water_available(self):
+		"""
+			Total local water in the model run for our water year - the basis for how much water economic uses need
+		:return: float
+		"""
+
+	@property
+	def segment_count(self):
+		return self.router.segment_count
+
+	@property
+	def local_flows(self):
+		return self.router.local_flows
+
+	@property
+	def downstream_indices(self):
+		return self.router.downstream_indices
+
+	def identity(self):
+		"""
+			What another copy of this network has to match to evaluate its allocations - the model run, water year, and
+			segments, in order. Comids are hashed so it stays small on big networks.
+		:return: dict of model_run_name, water_year, segment_count, and comids_sha1
+		"""
+		comids = ",".join([str(comid) for comid in self.router.comids])
+		return {
+			"model_run_name": None if self.model_run_name is None else str(self.model_run_name),
+			"water_year": None if self.water_year is None else int(self.water_year),
+			"segment_count": self.segment_count,
+			"comids_sha1": hashlib.sha1(comids.encode("utf-8")).hexdigest(),
+		}
+
+	def collapse_linear_reaches(self):
+		"""
+			Merges chains of single-upstream, single-downstream segments into reaches that share one set of decision
+			variables (see routing.LinearReaches). The problems then have 365 decision variables per reach instead of
+			per segment, and expand them to every segment in the reach before evaluating. Water is still routed and
+			benefit still scored on every segment, and the segments still get their own allocations for plotting.
+		:return: dict reporting how much smaller the problem got - also kept as reach_report
+		"""
+		self.reaches = routing.LinearReaches.from_router(self.router)
+		self.reach_report = self.reaches.report()
+		log.info("Collapsed {segments} segments into {reaches} reaches - {decision_variables_before} decision variables down to {decision_variables_after} ({reduction_factor:.2f}x fewer)".format(**self.reach_report))
+		return self.reach_report
+
+	def _expand_allocations(self, allocations, simplified):
+		allocations = numpy.asarray(allocations, dtype=float)
+		if simplified:
+			return numpy.broadcast_to(allocations.reshape(-1, 1, 365), (allocations.reshape(-1, 365).shape[0], self.segment_count, 365))
+		return allocations.reshape(-1, self.segment_count, 365)
+
+	def set_segment_allocations(self, allocations, simplified=False):
+		"""
+			Sets the allocations that get_benefits scores, and routes them unless we're evaluating incrementally, in
+			which case routing happens in the incremental evaluator and routed_water isn't kept up to date
+		:param allocations: daily allocations for every segment, or a single 365 day allocation when simplified
+		:param simplified: when True, the same allocation is used for every segment
+		"""
+		self.allocations = self._expand_allocations(allocations, simplified)[0]
+		self.routed_water = self.router.route(self.allocations) if self.incremental_evaluator is None else None
+
+	def use_incremental_evaluation(self, enabled=True, **kwargs):
+		"""
+			Turns incremental evaluation on or off - see belleflopt.incremental. When it's on, get_benefits only
+			recalculates the segments that changed since a recent evaluation, plus everything downstream of them, and
+			routed_water isn't kept up to date.
+		:param enabled: whether to evaluate incrementally
+		:param kwargs: passed through to incremental.IncrementalEvaluator, such as max_cache_bytes
+		"""
+		self.incremental_evaluator = incremental.IncrementalEvaluator(self.router, self.benefit_table, **kwargs) if enabled else None
+
+	def use_benefit_memo(self, max_bytes):
+		"""
+			Turns memoization of segment benefits on or off - see benefit.NetworkBenefitTable.use_memo
+		:param max_bytes: memory budget for the memo. None or 0 turns it off
+		"""
+		self.benefit_table.use_memo(max_bytes)
+
+	def get_benefits(self):
+		"""
+			Benefits for the allocations last passed to set_segment_allocations
+		:return: dict with environmental_benefit and economic_benefit
+		"""
+		if self.incremental_evaluator is not None:
+			environmental_benefit, economic_water_total = self.incremental_evaluator.evaluate(self.allocations)
+		else:
+			environmental_benefit = self.benefit_table.get_benefit(self.routed_water.eflows_water)
+			economic_water_total = numpy.sum(self.routed_water.economic_water)
+		self.economic_benefit_calculator.units_of_water = economic_water_total
+		return {
+			"environmental_benefit": environmental_benefit,
+			"economic_benefit": self.economic_benefit_calculator.get_benefit(),
+		}
+
+	def get_population_benefits(self, allocations, simplified=False):
+		"""
+			Like set_segment_allocations followed by get_benefits, but for many allocations at once, such as a whole
+			population. Everything is routed and scored as (population, segments, 365) arrays, and nothing set by
+			set_segment_allocations is touched, so that's still needed before plotting any of these.
+		:param allocations: (population, decision variables) array of allocations
+		:param simplified: when True, each row is a single 365 day allocation used for every segment
+		:return: dict with environmental_benefit and economic_benefit arrays, with a value for each population member
+		"""
+		allocations = self._expand_allocations(allocations, simplified)
+		if self.incremental_evaluator is not None:
+			environmental_benefits, economic_water = self.incremental_evaluator.evaluate_population(allocations)
+			return {
+				"environmental_benefit": environmental_benefits,
+				"economic_benefit": self.economic_benefit_calculator.get_benefits(economic_water),
+			}
+
+		routed_water = self.router.route(allocations)
+		return {
+			"environmental_benefit": self.benefit_table.get_benefit(routed_water.eflows_water),
+			"economic_benefit": self.economic_benefit_calculator.get_benefits(numpy.sum(routed_water.economic_water, axis=(1, 2))),
+		}
+
+
+class CompiledStreamNetwork(ArrayStreamNetwork):
+	"""
+		A network that evaluates allocations using only arrays - the same calculations as StreamNetwork, with the same
+		segment order (so the same decision variables), but without the segment objects or the database.
+	"""
+
+	def __init__(self, comids, downstream_indices, local_flows, total_flows, benefit_table, total_water_available,
+					water_year=None, model_run_name=None, economic_benefit_instance=None):
+		"""
+		:param comids: list of the comids of each segment, in decision variable order
+		:param downstream_indices: index of each segment's downstream segment, or -1 for outlets
+		:param local_flows: (segments, 365) array of local flows for each segment
+		:param total_flows: (segments, 365) array of the total (raw) flows for each segment - just for reference and plotting
+		:param benefit_table: benefit.NetworkBenefitTable for the segments
+		:param total_water_available: total local water in the model run for the water year - used to figure out how
+				much water is needed for economic benefit
+		:param water_year: water year the flows are for
+		:param model_run_name: name of the model run the snapshot came from
+		:param economic_benefit_instance: economic_components.EconomicBenefit instance - usually set by the problem
+		"""
+		self.comids = [str(comid) for comid in comids]
+		super(CompiledStreamNetwork, self).__init__(routing.NetworkRouter(downstream_indices, local_flows, comids=self.comids),
+													benefit_table, economic_benefit_instance=economic_benefit_instance)
+		self.total_flows = numpy.asarray(total_flows, dtype=float)
+		self.total_water_available = float(total_water_available)
+		self.water_year = water_year
+		self.model_run_name = model_run_name
+
+	def get_total_water_available(self):
+		return self.total_water_available
+
+	def save(self, path):
+		"""
+			Writes the network out to a compressed .npz snapshot that load can rebuild it from.
+		:param path: where to write the snapshot. numpy adds .npz if it's not already on the end
+		:return: None
+		"""
+		log.info("Saving compiled network with {} segments to {}".format(self.segment_count, path))
+		numpy.savez_compressed(path,
+								snapshot_version=SNAPSHOT_VERSION,
+								comids=numpy.array(self.comids),
+								downstream_indices=self.downstream_indices,
+								local_flows=self.local_flows,
+								total_flows=self.total_flows,
+								total_water_available=self.total_water_available,
+								water_year=-1 if self.water_year is None else int(self.water_year),
+								model_run_name="" if self.model_run_name is None else str(self.model_run_name),
+								**self.benefit_table.to_arrays())
+
+	@classmethod
+	def load(cls, path):
+		"""
+			Loads a network from a snapshot written by save - doesn't need Django or the database
+		:param path: path to the .npz snapshot
+		:return: CompiledStreamNetwork
+		"""
+		with numpy.load(path, allow_pickle=False) as snapshot:
+			if int(snapshot["snapshot_version"]) != SNAPSHOT_VERSION:
+				raise ValueError("Snapshot {} is version {}, but this code reads version {}. Recompile the model run".format(path, int(snapshot["snapshot_version"]), SNAPSHOT_VERSION))
+
+			benefit_table = benefit.NetworkBenefitTable.from_arrays({key: snapshot[key] for key in ("component_types", "flow_corners",
+																							"flow_max_benefit", "day_corners",
+																							"day_benefit", "peak_parameters",
+																							"recession_parameters", "species_presence",
+																							"custom_components") if key in snapshot.files})
+			water_year = int(snapshot["water_year"])
+			model_run_name = str(snapshot["model_run_name"])
+			return cls(comids=snapshot["comids"].tolist(),
+						downstream_indices=snapshot["downstream_indices"],
+						local_flows=snapshot["local_flows"],
+						total_flows=snapshot["total_flows"],
+						benefit_table=benefit_table,
+						total_water_available=float(snapshot["total_water_available"]),
+						water_year=water_year if water_year >= 0 else None,
+						model_run_name=model_run_name or None)
+
+
+def load_network(path):
+	"""
+		Shortcut for CompiledStreamNetwork.load
+	"""
+	return CompiledStreamNetwork.load(path)
+
+
+class ArrayNetworkProblem(Problem):
+	"""
+		The optimization problem for an ArrayStreamNetwork - decision variables, objectives, evaluation (one solution
+		at a time, or in batches), caching, and tracking values. StreamNetworkProblem adds plots of the best solutions
+		on top of this, and CompiledNetworkProblem uses it as is, so it can run anywhere a snapshot can be loaded.
+	"""
+	def __init__(self,
+	             stream_network,
+	             starting_water_price=800,
+	             total_units_needed_factor=0.99,
+	             objectives=2,
+	             min_proportion=0,
+	             simplified=False,
+	             demand_curve=None,
+	             incremental=False,
+	             benefit_memo_bytes=DEFAULT_BENEFIT_MEMO_BYTES,
+	             solution_cache_bytes=None,
+	             solution_cache_tolerance=None,
+	             variable_dtype=None,
+	             encoding=None,
+	             *args):
+		"""
+		:param stream_network: ArrayStreamNetwork instance, like a StreamNetwork or CompiledStreamNetwork
+		:param starting_water_price: price of the first unit of economic water
+		:param total_units_needed_factor: proportion of the network's total water that would be needed for full
+				economic benefit
+		:param objectives:  default is two (environmental and economic benefit)
+		:param min_proportion: What is the minimum proportion of flow that we can allocate to any single segment? Raising
+				this value (min 0, max 0.999999999) prevents the model from extracting all its water in one spot.
+		:param simplified: when True, there's one set of 365 daily decision variables shared by every segment
+		:param demand_curve: economic_components.DemandCurve instance or class to value economic water with. Defaults
+				to a linear curve from starting_water_price down to 0 at the needed water
+		:param incremental: when True, solutions are evaluated incrementally against recently evaluated ones - only
+				segments whose allocations changed, and everything downstream of them, get routed and scored again.
+				Helps most with mutation-heavy algorithms. See belleflopt.incremental
+		:param benefit_memo_bytes: remembers each segment's benefit for eflows hydrographs it's already scored, using up
+				to this much memory across the network - see ArrayStreamNetwork.use_benefit_memo. Defaults to
+				DEFAULT_BENEFIT_MEMO_BYTES. None or 0 turns it off
+		:param solution_cache_bytes: when set, remembers the objectives of solutions we've evaluated, using up to this
+				much memory, so when an algorithm comes up with the same decision variables again, we skip evaluating
+				them. Those repeats don't count toward eflows_nfe and don't get added to the tracking values again.
+		:param solution_cache_tolerance: when set along with solution_cache_bytes, decision variables are rounded to
+				multiples of this before looking them up, so solutions that only differ by less than about this much
+				get the objectives of the first one that was evaluated
+		:param variable_dtype: when set (numpy.float64 or numpy.float32), solutions made by our generators keep their
+				decision variables in a compact NumPy array of this type instead of a list of Python floats - see
+				belleflopt.array_solutions. float32 halves the memory again, but solutions are evaluated at float32
+				precision
+		:param encoding: when set, each segment gets a few decision variables that are expanded to its daily
+				allocations before evaluation, instead of one per day - an encodings.TemporalEncoding, or a name like
+				"monthly", "weekly", "bspline:24", "components" (one variable per flow component window on each
+				segment), or "masked" (collapses days that can't change environmental benefit). See belleflopt.encodings
+		:param args: passed through to platypus's Problem
+		"""
+		self.stream_network = stream_network
+		self.stream_network.economic_benefit_calculator = economic_components.EconomicBenefit(starting_water_price,
+		                                                                                      total_units_needed=self.get_needed_water(total_units_needed_factor),
+		                                                                                      demand_curve=demand_curve)
+		self.incremental = incremental
+		self.stream_network.use_incremental_evaluation(incremental)
+		self.benefit_memo_bytes = benefit_memo_bytes
+		self.stream_network.use_benefit_memo(benefit_memo_bytes)
+		self.solution_cache = caching.SolutionCache(solution_cache_bytes, tolerance=solution_cache_tolerance) if solution_cache_bytes else None
+		self.variable_dtype = numpy.dtype(variable_dtype) if variable_dtype is not None else None
+
+		self.encoding = encodings.get_encoding(encoding, benefit_table=stream_network.benefit_table, router=stream_network.router)
+		if hasattr(self.encoding, "check_bounds"):  # encodings that fill in allocations themselves have to stay in bounds
+			self.encoding.check_bounds(min_proportion, 1)
+
+		self.reaches = None if simplified else stream_network.reaches  # when the network collapsed its linear reaches
+		variable_segments = stream_network.segment_count if self.reaches is None else self.reaches.reach_count
+
+		self.simplified = simplified
+		# we need a decision variable for every stream segment (or reach) and day - we'll reshape them later
+		self.decision_variables = 365 if simplified else variable_segments * 365
+		if self.encoding is not None:  # a few variables per segment (or just one set when simplified) instead of one per day
+			self.decision_variables = self.encoding.decision_variables(1 if simplified else variable_segments)
+
+		self.iterations = []
+		self.objective_1 = []
+		self.objective_2 = []
+		self.eflows_nfe = 0
+		self.batch_repeats = 0  # solutions that were copied from an identical one in the same batch - see skip_cached
+		self._batch_repeats = {}
+
+		log.info("Number of Decision Variables: {}".format(self.decision_variables))
+		super(ArrayNetworkProblem, self).__init__(self.decision_variables, objectives, *args)  # pass any arguments through
+
+		self.directions[:] = Problem.MAXIMIZE  # we want to maximize all of our objectives
+		self.types[:] = Real(min_proportion, 1)  # we now construe this as a proportion instead of a raw value
+
+	def reset(self):
+		self.iterations = []
+		self.objective_1 = []
+		self.objective_2 = []
+		self.eflows_nfe = 0
+		self.batch_repeats = 0
+		self._batch_repeats = {}
+		if self.solution_cache is not None:  # a new run should evaluate everything itself
+			self.solution_cache.clear()
+
+	def get_needed_water(self, proportion):
+		"""
+			Given a proportion of a basin's total water to extract, calculates the quantity
+		"""
+		total_water = self.stream_network.get_total_water_available()
+		log.info("Total Water Available: {}".format(total_water))
+		return total_water * proportion
+
+	def evaluation_stats(self):
+		"""
+			Summary of how the problem has been spending its evaluations - how many it actually ran, how well its caches
+			and incremental evaluation are doing, and how much collapsing reaches shrank it, if those are on
+		:return: flat dict of numbers, so it can go straight to comet as metrics
+		"""
+		stats = {"evaluations": self.eflows_nfe}
+		if self.solution_cache is not None:
+			stats.update({"solution_cache_{}".format(key): value for key, value in self.solution_cache.stats().items()})
+			stats["batch_repeats"] = self.batch_repeats
+		if self.stream_network.incremental_evaluator is not None:
+			stats.update({"incremental_{}".format(key): value for key, value in self.stream_network.incremental_evaluator.stats().items()})
+		if self.stream_network.benefit_table.segment_memo is not None:
+			stats.update({"benefit_memo_{}".format(key): value for key, value in self.stream_network.benefit_table.memo_stats().items()})
+		if self.reaches is not None:
+			stats.update({"reach_{}".format(key): value for key, value in self.reaches.report().items()})
+		return stats
+
+	def daily_allocations(self, variables):
+		"""
+			Daily allocation proportions for decision variables - expands them if the problem has an encoding, then
+			from reaches to segments if the network collapsed its linear reaches
+		:param variables: one solution's variables, or a (solutions, variables) array
+		:return: array of allocations in the same layout as daily decision variables for every segment
+		"""
+		if self.encoding is not None:
+			variables = self.encoding.expand(variables)
+		if self.reaches is not None:
+			variables = self.reaches.expand(variables)
+		return variables
+
+	def skip_cached(self, solutions):
+		"""
+			Fills in objectives for any solutions we've already evaluated, if we're keeping a solution cache. Solutions
+			in the batch that share a cache key with an earlier one in it (the same variables, or close enough with a
+			tolerance) aren't returned either - apply_batch_benefits copies the first one's objectives to them once
+			it's been evaluated.
+		:param solutions: list of platypus Solution objects
+		:return: list of the solutions that still need evaluating
+		"""
+		if self.solution_cache is None:
+			return list(solutions)
+
+		remaining = []
+		first_with_key = {}
+		for solution in solutions:
+			key = self.solution_cache.key_for(solution.variables)
+			if self.solution_cache.apply(solution, key=key):
+				continue
+			if key in first_with_key:
+				self._batch_repeats.setdefault(id(first_with_key[key]), []).append(solution)
+			else:
+				first_with_key[key] = solution
+				remaining.append(solution)
+		return remaining
+
+	def evaluate(self, solution):
+		"""
+			We want to evaluate a full hydrograph of values for an entire year
+		"""
+		if self.solution_cache is not None and self.solution_cache.apply(solution):
+			return  # we've seen these variables before, and the cache filled in the objectives
+
+		if self.eflows_nfe % 5 == 0:
+			log.info("NFE (inside): {}".format(self.eflows_nfe))
+		self.eflows_nfe += 1
+
+		# attach allocations to segments here - doesn't matter what order we do it in, so long as it's consistent
+		self.stream_network.set_segment_allocations(allocations=self.daily_allocations(array_solutions.variables_array(solution)), simplified=self.simplified)
+
+		benefits = self.stream_network.get_benefits()
+		self._record_benefits(solution, benefits["environmental_benefit"], benefits["economic_benefit"])
+
+	def evaluate_batch(self, solutions):
+		"""
+			Evaluates a whole set of solutions (usually a generation's worth) at once - evaluators.BatchEvaluator calls
+			this. The solutions' variables are stacked into one array and routed and scored together, which gives the
+			same objectives and tracking values as calling evaluate on each solution, without the Python overhead per
+			solution.
+		:param solutions: list of platypus Solution objects for this problem
+		:return: None - objectives are set on the solutions
+		"""
+		solutions = self.skip_cached(solutions)
+		if len(solutions) == 0:
+			return
+
+		log.info("NFE (inside): {}, evaluating {} solutions as a batch".format(self.eflows_nfe, len(solutions)))
+		allocations = self.daily_allocations(array_solutions.stack_variables(solutions, dtype=float))
+		benefits = self.stream_network.get_population_benefits(allocations, simplified=self.simplified)
+		self.apply_batch_benefits(solutions, benefits)
+
+	def apply_batch_benefits(self, solutions, benefits):
+		"""
+			Sets objectives and tracking values for a batch of solutions from their already calculated benefits - used by
+			evaluate_batch and by evaluators that calculate the benefits somewhere else, like in worker processes
+		:param solutions: list of platypus Solution objects
+		:param benefits: dict with environmental_benefit and economic_benefit arrays, in the same order as solutions
+		"""
+		for solution, environmental_benefit, economic_benefit in zip(solutions, benefits["environmental_benefit"], benefits["economic_benefit"]):
+			self.eflows_nfe += 1
+			self._record_benefits(solution, float(environmental_benefit), float(economic_benefit), allocations_set=False)
+
+			# the rest of what Problem.__call__ does after evaluate - we don't have any constraints
+			solution.constraint_violation = 0.0
+			solution.feasible = True
+			solution.evaluated = True
+
+			for repeat in self._batch_repeats.pop(id(solution), []):  # identical solutions from the same batch
+				repeat.objectives[:] = solution.objectives
+				repeat.constraint_violation = 0.0
+				repeat.feasible = True
+				repeat.evaluated = True
+				self.batch_repeats += 1
+
+	def _record_benefits(self, solution, environmental_benefit, economic_benefit, allocations_set=True):
+		"""
+			Sets the objectives on the solution and keeps our tracking values
+		:param allocations_set: whether the stream network currently has this solution's allocations set on it -
+				subclasses that need them, like for plotting, should set them when it's False
+		"""
+		# set the outputs - platypus looks for these here.
+		solution.objectives[0] = environmental_benefit
+		solution.objectives[1] = economic_benefit
+
+		# tracking values
+		self.iterations.append(self.eflows_nfe)
+		self.objective_1.append(environmental_benefit)
+		self.objective_2.append(economic_benefit)
+
+		if self.solution_cache is not None:
+			self.solution_cache.store(solution)
+
+
+class CompiledNetworkProblem(ArrayNetworkProblem):
+	"""
+		StreamNetworkProblem for a CompiledStreamNetwork - same decision variables, objectives, and tracking values,
+		but doesn't need Django, so it can run anywhere the snapshot can be loaded. Doesn't dump plots of best
+		solutions since the segment objects that make those plots aren't available here. Takes the same arguments as
+		ArrayNetworkProblem.
+	"""
@@ -0,0 +1,411 @@
+"""
+	Evaluation across several machines. Each machine runs one or more evaluation workers (python manage.py
+	evaluation_worker), which load a compiled snapshot of the model run (see belleflopt.compiled) and serve batches of
+	allocations to evaluate over TCP. BrokerEvaluator is a platypus Evaluator that splits each generation's solutions
+	into chunks and hands them out to whichever workers are free, so faster machines take on more of the work.
+
+	Messages go over multiprocessing.connection, which frames each one with its length and authenticates both ends
+	with a shared key - messages are pickled, so only run workers on networks you trust, and always with a key. While a
+	worker evaluates, it sends heartbeats, and if the broker doesn't hear from it for a while or its connection drops,
+	the broker gives its chunk to another worker and stops using it until the next generation, when it tries to
+	reconnect.
+
+	Nothing in this module should import Django - workers only need the snapshot.
+"""
+
+import collections
+import logging
+import multiprocessing
+import threading
+import time
+import traceback
+from multiprocessing import connection as mp_connection
+
+import numpy
+from platypus import Evaluator
+
+from belleflopt import array_solutions
+from belleflopt import compiled
+
+log = logging.getLogger("belleflopt.distributed")
+
+
+def parse_address(address):
+	"""
+		Turns "host:port" into the (host, port) tuple connections use. Tuples pass straight through
+	"""
+	if isinstance(address, str):
+		host, port = address.rsplit(":", 1)
+		return host, int(port)
+	return tuple(address)
+
+
+class EvaluationWorker(object):
+	"""
+		Serves evaluations of allocations on a compiled network to one broker at a time. The broker sends the
+		economic benefit calculator to use when it connects, then batches of allocations.
+	"""
+
+	def __init__(self, snapshot_path, address=("localhost", 0), authkey=None):
+		"""
+		:param snapshot_path: compiled model run snapshot, from python manage.py compile_model_run
+		:param address: (host, port) to listen on - port 0 picks a free one, which ends up in the address attribute
+		:param authkey: bytes the broker needs to have to connect
+		"""
+		self.network = compiled.CompiledStreamNetwork.load(snapshot_path)
+		self.listener = mp_connection.Listener(parse_address(address), authkey=authkey)
+		self.address = self.listener.address
+		self.heartbeat_interval = 2.0
+		log.info("Evaluation worker for {} listening on {}:{}".format(self.network.model_run_name, *self.address))
+
+	def serve_forever(self):
+		while True:
+			try:
+				broker = self.listener.accept()
+			except (mp_connection.AuthenticationError, OSError) as e:
+				log.warning("Rejected a connection: {}".format(e))
+				continue
+
+			try:
+				self.handle(broker)
+			except (EOFError, OSError):
+				log.info("Broker disconnected")
+			finally:
+				broker.close()
+
+	def handle(self, broker):
+		"""
+			Answers one broker's messages until it disconnects
+		"""
+		send_lock = threading.Lock()  # heartbeats go out from another thread while we evaluate
+		while True:
+			message = broker.recv()
+			if message[0] == "setup":
+				_, economic_benefit_calculator, incremental, benefit_memo_bytes, self.heartbeat_interval, identity = message
+				mismatched = _identity_mismatches(self.network.identity(), identity)
+				if mismatched:
+					broker.send(("error", None, "Worker's snapshot isn't the broker's network - {}".format(mismatched)))
+					continue
+				self.network.economic_benefit_calculator = economic_benefit_calculator
+				self.network.use_incremental_evaluation(incremental)
+				self.network.use_benefit_memo(benefit_memo_bytes)
+				broker.send(("ready", ))
+			elif message[0] == "evaluate":
+				_, chunk, allocations, simplified = message
+				self._evaluate(broker, send_lock, chunk, allocations, simplified)
+			elif message[0] == "close":
+				return
+
+	def _evaluate(self, broker, send_lock, chunk, allocations, simplified):
+		evaluating = threading.Event()
+		evaluating.set()
+
+		def heartbeat():
+			while evaluating.is_set():
+				time.sleep(self.heartbeat_interval)
+				with send_lock:
+					if evaluating.is_set():
+						try:
+							broker.send(("heartbeat", ))
+						except OSError:  # the broker's gone - the main thread finds out when it sends the result
+							return
+
+		heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+		heartbeat_thread.start()
+		try:
+			benefits = self.network.get_population_benefits(allocations, simplified=simplified)
+			response = ("result", chunk, benefits["environmental_benefit"], benefits["economic_benefit"])
+		except Exception:
+			response = ("error", chunk, traceback.format_exc())
+		finally:
+			with send_lock:
+				evaluating.clear()
+
+		with send_lock:
+			broker.send(response)
+
+	def close(self):
+		self.listener.close()
+
+
+def _identity_mismatches(worker_identity, broker_identity):
+	"""
+		Describes how a worker's network differs from the broker's, from each one's ArrayStreamNetwork.identity
+	:return: string listing the differences, or an empty string if they match
+	"""
+	return ", ".join(["{} is {} here and {} on the broker".format(key, worker_identity.get(key), broker_identity.get(key))
+					for key in sorted(set(worker_identity) | set(broker_identity)) if worker_identity.get(key) != broker_identity.get(key)])
+
+
+def serve(snapshot_path, address, authkey):
+	"""
+		Runs an evaluation worker until the process is stopped
+	"""
+	EvaluationWorker(snapshot_path, address, authkey).serve_forever()
+
+
+def _serve_local(snapshot_path, host, authkey, address_pipe):
+	worker = EvaluationWorker(snapshot_path, (host, 0), authkey)
+	address_pipe.send(worker.address)
+	address_pipe.close()
+	worker.serve_forever()
+
+
+def start_local_workers(snapshot_path, workers, authkey, host="localhost", start_method="spawn"):
+	"""
+		Starts evaluation workers in processes on this machine, each on a free port - for testing, or for mixing local
+		workers in with other machines'
+	:return: tuple of (list of processes, list of (host, port) addresses). Terminate the processes when done
+	"""
+	context = multiprocessing.get_context(start_method)
+	processes, addresses = [], []
+	for _ in range(workers):
+		receiver, sender = context.Pipe(duplex=False)
+		process = context.Process(target=_serve_local, args=(snapshot_path, host, authkey, sender), daemon=True)
+		process.start()
+		sender.close()
+		processes.append(process)
+		addresses.append(receiver.recv())
+	return processes, addresses
+
+
+class _RemoteWorker(object):
+	"""
+		The broker's connection to one worker, and what it's done so far
+	"""
+
+	def __init__(self, address):
+		self.address = address
+		self.connection = None
+		self.problem = None  # the problem the worker was last set up for
+		self.chunk = None  # chunk it's working on now
+		self.dispatched_at = None
+		self.last_seen = None
+
+		self.chunks = 0
+		self.solutions = 0
+		self.busy_seconds = 0.0
+		self.heartbeats = 0
+		self.failures = 0
+
+	@property
+	def name(self):
+		return "{}:{}".format(*self.address)
+
+	def stats(self):
+		return {
+			"connected": self.connection is not None,
+			"chunks": self.chunks,
+			"solutions": self.solutions,
+			"busy_seconds": self.busy_seconds,
+			"solutions_per_second": self.solutions / self.busy_seconds if self.busy_seconds > 0 else None,
+			"heartbeats": self.heartbeats,
+			"failures": self.failures,
+		}
+
+
+class BrokerEvaluator(Evaluator):
+	"""
+		Platypus evaluator that sends batches of solutions to evaluation workers on other machines (or this one) over
+		TCP - see the module docstring. Like ParallelNetworkEvaluator, only decision variables go out and objectives
+		come back, results don't depend on which worker evaluated what, and the problem in this process does all of
+		the tracking through apply_batch_benefits.
+
+		Call close (or use it as a context manager) when done to disconnect from the workers.
+	"""
+
+	def __init__(self, addresses, authkey, chunks_per_worker=2, heartbeat_interval=2.0, heartbeat_timeout=30.0):
+		"""
+		:param addresses: list of worker addresses, as (host, port) tuples or "host:port" strings
+		:param authkey: bytes shared with the workers
+		:param chunks_per_worker: how many pieces to split each batch into per worker - more balances load better
+				between machines of different speeds, and loses less work when a worker drops out
+		:param heartbeat_interval: seconds between heartbeats from a worker while it evaluates
+		:param heartbeat_timeout: seconds without hearing from a busy worker before its chunk goes to another worker
+		"""
+		super(BrokerEvaluator, self).__init__()
+		self.workers = [_RemoteWorker(parse_address(address)) for address in addresses]
+		self.authkey = authkey
+		self.chunks_per_worker = chunks_per_worker
+		self.heartbeat_interval = heartbeat_interval
+		self.heartbeat_timeout = heartbeat_timeout
+		self.resubmitted_chunks = 0
+
+	def _connect(self):
+		for worker in self.workers:
+			if worker.connection is None:
+				try:
+					worker.connection = mp_connection.Client(worker.address, authkey=self.authkey)
+					worker.problem = None
+				except (OSError, mp_connection.AuthenticationError) as e:
+					log.warning("Couldn't connect to evaluation worker {}: {}".format(worker.name, e))
+
+	def _lose(self, worker, pending, reason):
+		"""
+			Stops using a worker until the next batch, giving its chunk to someone else
+		"""
+		log.warning("Lost evaluation worker {} ({})".format(worker.name, reason))
+		try:
+			worker.connection.close()
+		except OSError:
+			pass
+		worker.connection = None
+		worker.failures += 1
+		if worker.chunk is not None:
+			pending.appendleft(worker.chunk)
+			self.resubmitted_chunks += 1
+			worker.chunk = None
+
+	def _abandon(self, worker):
+		"""
+			Disconnects from a worker that's still evaluating a chunk we no longer need, so its result can't turn up in
+			the middle of a later batch. It gets reconnected for the next batch.
+		"""
+		try:
+			worker.connection.close()
+		except OSError:
+			pass
+		worker.connection = None
+		worker.chunk = None
+
+	def _setup(self, worker, problem, pending):
+		"""
+			Sends the problem's economic settings to a worker that hasn't seen this problem yet
+		"""
+		try:
+			worker.connection.send(("setup", problem.stream_network.economic_benefit_calculator, getattr(problem, "incremental", False),
+									getattr(problem, "benefit_memo_bytes", None), self.heartbeat_interval, problem.stream_network.identity()))
+			if not worker.connection.poll(self.heartbeat_timeout):
+				self._lose(worker, pending, "no response to setup")
+				return
+			response = worker.connection.recv()
+		except (EOFError, OSError) as e:
+			self._lose(worker, pending, e)
+			return
+		if response[0] == "error":
+			raise RuntimeError("Evaluation worker {} can't evaluate this problem: {}".format(worker.name, response[2]))
+		worker.problem = problem
+
+	def evaluate_all(self, jobs, **kwargs):
+		jobs = list(jobs)
+
+		batches = {}  # the solutions for each problem - there's almost always just one
+		for job in jobs:
+			problem = job.solution.problem
+			if hasattr(problem, "apply_batch_benefits"):
+				batches.setdefault(problem, []).append(job.solution)
+			else:
+				job.run()
+
+		for problem, solutions in batches.items():
+			if hasattr(problem, "skip_cached"):  # repeats don't need to go to the workers at all
+				solutions = problem.skip_cached(solutions)
+			if len(solutions) == 0:
+				continue
+
+			allocations = array_solutions.stack_variables(solutions, dtype=float)
+			if hasattr(problem, "daily_allocations"):  # workers score daily allocations, so expand any encoding here
+				allocations = problem.daily_allocations(allocations)
+			chunks = numpy.array_split(allocations, min(len(solutions), len(self.workers) * self.chunks_per_worker))
+			results = self._evaluate_chunks(problem, chunks)
+
+			problem.apply_batch_benefits(solutions, {
+				"environmental_benefit": numpy.concatenate([result[0] for result in results]),
+				"economic_benefit": numpy.concatenate([result[1] for result in results]),
+			})
+
+		return jobs
+
+	def _evaluate_chunks(self, problem, chunks):
+		"""
+			Hands chunks out to free workers until every chunk has come back. If a chunk fails, workers still
+			evaluating other chunks get disconnected before the error goes up, since their results would otherwise
+			turn up in the next batch.
+		:return: list of (environmental benefit, economic benefit) array tuples in the same order as chunks
+		"""
+		self._connect()
+		pending = collections.deque(range(len(chunks)))
+		results = [None, ] * len(chunks)
+
+		try:
+			while any([result is None for result in results]):
+				self._dispatch(problem, chunks, pending)
+				self._collect(pending, results)
+		except Exception:
+			for worker in self.workers:
+				if worker.connection is not None and worker.chunk is not None:
+					self._abandon(worker)
+			raise
+
+		return results
+
+	def _dispatch(self, problem, chunks, pending):
+		"""
+			Sets up any workers that haven't seen the problem yet and gives every free worker a pending chunk
+		"""
+		for worker in self.workers:
+			if worker.connection is not None and worker.problem is not problem:
+				self._setup(worker, problem, pending)
+			if worker.connection is not None and worker.chunk is None and pending:
+				worker.chunk = pending.popleft()
+				worker.dispatched_at = worker.last_seen = time.monotonic()
+				try:
+					worker.connection.send(("evaluate", worker.chunk, chunks[worker.chunk], problem.simplified))
+				except OSError as e:
+					self._lose(worker, pending, e)
+
+	def _collect(self, pending, results):
+		"""
+			Takes in whatever the busy workers send back before the next heartbeat is due, then gives up on any that
+			haven't been heard from in too long
+		"""
+		busy = [worker for worker in self.workers if worker.connection is not None and worker.chunk is not None]
+		if not busy:
+			raise RuntimeError("No evaluation workers left to send work to")
+
+		by_connection = {worker.connection: worker for worker in busy}
+		for ready in mp_connection.wait(list(by_connection.keys()), timeout=self.heartbeat_interval):
+			worker = by_connection[ready]
+			try:
+				message = ready.recv()
+			except (EOFError, OSError) as e:
+				self._lose(worker, pending, e)
+				continue
+
+			worker.last_seen = time.monotonic()
+			if message[0] == "heartbeat":
+				worker.heartbeats += 1
+			elif message[0] == "result":
+				_, chunk, environmental_benefit, economic_benefit = message
+				results[chunk] = (environmental_benefit, economic_benefit)
+				worker.chunk = None
+				worker.chunks += 1
+				worker.solutions += len(environmental_benefit)
+				worker.busy_seconds += worker.last_seen - worker.dispatched_at
+			elif message[0] == "error":  # it'd fail the same way anywhere, so don't resubmit it
+				worker.chunk = None
+				raise RuntimeError("Evaluation worker {} failed:\n{}".format(worker.name, message[2]))
+
+		now = time.monotonic()
+		for worker in busy:
+			if worker.connection is not None and worker.chunk is not None and now - worker.last_seen > self.heartbeat_timeout:
+				self._lose(worker, pending, "no heartbeat for {} seconds".format(round(now - worker.last_seen, 1)))
+
+	def stats(self):
+		"""
+			Throughput and failures for each worker, by address, plus how many chunks had to be resubmitted
+		"""
+		stats = {worker.name: worker.stats() for worker in self.workers}
+		stats["resubmitted_chunks"] = self.resubmitted_chunks
+		return stats
+
+	def close(self):
+		for worker in self.workers:
+			if worker.connection is not None:
+				try:
+					worker.connection.send(("close", ))
+					worker.connection.close()
+				except OSError:
+					pass
+				worker.connection = None
+				worker.chunk = None
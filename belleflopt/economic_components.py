@@ -1,21 +1,169 @@
+import abc
+
 import numpy
 
 # Needs: 1 - way to convert CFS to acre-feet
 #       2 - way to express marginal decrease in value of water based on current units
 
 
+def _whole_units(units):
+	"""
+		Total units of water as whole units, the same way int() would truncate them - negative totals count as 0
+	"""
+	return numpy.maximum(numpy.trunc(numpy.asarray(units, dtype=float)), 0)
+
+
+class DemandCurve(abc.ABC):
+	"""
+		Base class for demand curves. A demand curve provides the price of the nth unit of water, and the total
+		willingness to pay for a given number of units - that total is the sum of the prices of units 1 through n.
+		Subclasses should implement both using array operations so that EconomicBenefit can score a whole population's
+		worth of water totals at once, and should implement cumulative_cost in closed form instead of by summing
+		every unit, since basin totals run into the millions of units.
+	"""
+
+	@abc.abstractmethod
+	def price(self, nth_unit):
+		"""
+			Price of the nth unit of water
+		:param nth_unit: the unit of water to get the price of, or an array of them
+		:return: numpy array (or scalar) of prices
+		"""
+
+	@abc.abstractmethod
+	def cumulative_cost(self, units):
+		"""
+			Total cost of units of water - the sum of the price of every whole unit from 1 to units
+		:param units: how many units of water, or an array of totals
+		:return: numpy array (or scalar) of total costs
+		"""
+
+
+class LinearDemandCurve(DemandCurve):
+	"""
+		The original demand curve - price is -(starting_price/units_needed)x + starting_price, which ensures the
+		starting price is starting_price and that by the time we get the number of units we need, the price is 0.
+		It doesn't go below 0 after that.
+	"""
+	def __init__(self, starting_price, total_units_needed):
+		self.starting_price = starting_price
+		self.total_units_needed = total_units_needed
+
+	def price(self, nth_unit):
+		value = -(self.starting_price/self.total_units_needed) * numpy.asarray(nth_unit, dtype=float) + self.starting_price
+		return numpy.maximum(value, 0)  # we won't push the cost of water negative. If it goes negative, return 0.
+
+	def cumulative_cost(self, units):
+		# units after total_units_needed are free, so we only sum (as an arithmetic series) up to there
+		priced_units = numpy.minimum(_whole_units(units), numpy.floor(self.total_units_needed))
+		slope = self.starting_price / self.total_units_needed
+		return priced_units * self.starting_price - slope * priced_units * (priced_units + 1) / 2
+
+
+class PiecewiseLinearDemandCurve(DemandCurve):
+	"""
+		Demand curve defined by prices at a set of breakpoints, with the price linearly interpolated between them. The
+		price holds at the first price before the first breakpoint and at the last price after the last one, so set the
+		last price to 0 to say the water isn't worth anything after that point.
+	"""
+	def __init__(self, breakpoints, prices):
+		"""
+		:param breakpoints: increasing sequence of units of water where the price is specified
+		:param prices: price at each breakpoint
+		"""
+		breakpoints = numpy.asarray(breakpoints, dtype=float)
+		prices = numpy.asarray(prices, dtype=float)
+		if breakpoints.shape != prices.shape or breakpoints.size == 0:
+			raise ValueError("Need the same number of breakpoints and prices, and at least one of each")
+		if numpy.any(numpy.diff(breakpoints) <= 0) or breakpoints[0] < 0:
+			raise ValueError("Breakpoints must be increasing and can't be negative")
+		if numpy.any(prices < 0):
+			raise ValueError("Prices can't be negative")
+
+		if breakpoints[0] > 0:  # flat at the first price from the first unit up to the first breakpoint
+			breakpoints = numpy.insert(breakpoints, 0, 0)
+			prices = numpy.insert(prices, 0, prices[0])
+
+		self.breakpoints = breakpoints
+		self.prices = prices
+
+		# each segment covers the whole units after its start breakpoint, up to and including its end breakpoint
+		self._slopes = numpy.diff(prices) / numpy.diff(breakpoints)
+		self._unit_starts = numpy.floor(breakpoints)
+		self._segment_totals = self._segment_cost(numpy.arange(self._slopes.size), self._unit_starts[1:])
+		self._costs_before = numpy.concatenate(([0], numpy.cumsum(self._segment_totals)))
+
+	def _segment_cost(self, segments, last_units):
+		"""
+			Sum of the prices of the whole units in each segment up to last_units, as an arithmetic series
+		"""
+		first_units = self._unit_starts[segments]
+		count = last_units - first_units
+		unit_sum = (last_units * (last_units + 1) - first_units * (first_units + 1)) / 2
+		return (self.prices[segments] - self._slopes[segments] * self.breakpoints[segments]) * count + self._slopes[segments] * unit_sum
+
+	def price(self, nth_unit):
+		return numpy.interp(nth_unit, self.breakpoints, self.prices)
+
+	def cumulative_cost(self, units):
+		units = _whole_units(units)
+		# which segment does the last unit fall in - anything past the last breakpoint is priced at the last price
+		segments = numpy.searchsorted(self._unit_starts[1:], units, side="left")
+		inside = numpy.minimum(segments, self._slopes.size - 1)
+		partial = numpy.where(segments < self._slopes.size,
+								self._segment_cost(inside, numpy.minimum(units, self._unit_starts[inside + 1])),
+								(units - self._unit_starts[-1]) * self.prices[-1])
+		return self._costs_before[numpy.minimum(segments, self._slopes.size)] + partial
+
+
+class ExponentialDemandCurve(DemandCurve):
+	"""
+		A convex demand curve - the price starts at starting_price and decays exponentially so that it's
+		remaining_price_fraction of the starting price by the time we get the number of units we need. The first
+		units are worth a lot more than later ones, but the price never quite hits 0.
+	"""
+	def __init__(self, starting_price, total_units_needed, remaining_price_fraction=0.01):
+		if not 0 < remaining_price_fraction < 1:
+			raise ValueError("remaining_price_fraction must be between 0 and 1")
+
+		self.starting_price = starting_price
+		self.total_units_needed = total_units_needed
+		self.remaining_price_fraction = remaining_price_fraction
+		self.decay_rate = -numpy.log(remaining_price_fraction) / total_units_needed
+
+	def price(self, nth_unit):
+		return self.starting_price * numpy.exp(-self.decay_rate * numpy.asarray(nth_unit, dtype=float))
+
+	def cumulative_cost(self, units):
+		# geometric series of price(1) through price(units). expm1 keeps it accurate when the decay per unit is tiny
+		units = _whole_units(units)
+		return self.starting_price * numpy.exp(-self.decay_rate) * numpy.expm1(-self.decay_rate * units) / numpy.expm1(-self.decay_rate)
+
+
 class EconomicBenefit(object):
 	"""
 		As currently designed, this class needs to be used BASIN-WIDE. That is, because it uses economic curves, it needs
 		to have those be fed by water values for the whole system. So
 	"""
-	def __init__(self, starting_price, total_units_needed):
+	def __init__(self, starting_price, total_units_needed, demand_curve=None):
+		"""
+		:param starting_price: price of the first unit of water
+		:param total_units_needed: how many units of water are needed - the demand curve gets down to its lowest price here
+		:param demand_curve: DemandCurve instance, or a DemandCurve class to build with starting_price and
+				total_units_needed. Defaults to LinearDemandCurve
+		"""
 		self.starting_price = starting_price
 		self.total_units_needed = total_units_needed
 		self.units_of_water = 0
 		self.unit_conversion_scaling_factor = 1
 
-		self.vectorized_cost = numpy.vectorize(self._cost_of_water)
+		if demand_curve is None:
+			demand_curve = LinearDemandCurve
+		if isinstance(demand_curve, type):
+			demand_curve = demand_curve(starting_price, total_units_needed)
+		self.demand_curve = demand_curve
+
+		self.vectorized_cost = self.demand_curve.price
 
 	def _convert_timeseries_units_to_water_units(self, ts_units):
 		"""
@@ -44,29 +192,32 @@ class EconomicBenefit(object):
 		"""
 		return self._cumulative_cost(self.units_of_water)
 
+	def get_benefits(self, units_of_water):
+		"""
+			Benefit for many totals of economic water at once, such as one for each member of a population
+		:param units_of_water: array of total units of water
+		:return: numpy array of benefits, the same shape as units_of_water
+		"""
+		return numpy.asarray(self.demand_curve.cumulative_cost(units_of_water), dtype=float)
+
 	def _cost_of_water(self, nth_unit):
 		"""
-			Implements the basic demand curve and provides the price of the nth unit of water.
+			Provides the price of the nth unit of water from the demand curve.
 
-			Base cost is -(starting_cost/units_needed)x + starting_cost, which ensures the starting price is starting_price
-			and that by the time we get the number of units we need, the cost is 0. It's linear but would be easy enough
-			to translate into a convex curve, which is probably more appropriate.
+			By default, that's -(starting_cost/units_needed)x + starting_cost, which ensures the starting price is
+			starting_price and that by the time we get the number of units we need, the cost is 0. Pass a different
+			demand_curve in to use a convex (ExponentialDemandCurve) or PiecewiseLinearDemandCurve instead.
 		:param nth_unit: The unit of water to get the price of. Taken sequentially, so 500 means that you want the cost
 				of the 500th unit of water delivered, not that you want the price of 500 units of water
 		:return:
 		"""
-
-		value = -(self.starting_price/self.total_units_needed) * nth_unit + self.starting_price
-		return max(value, 0)  # we won't push the cost of water negative. If it goes negative, return 0.
+		return float(self.demand_curve.price(nth_unit))
 
 	def _cumulative_cost(self, units):
 		"""
-
+			Total willingness to pay for the units of water - equivalent to summing the price of every whole unit, but
+			calculated in closed form by the demand curve
 		:param units: How many units of water do you want?
 		:return:
 		"""
-		if int(units) == 0:
-			return 0
-
-		all_costs = self.vectorized_cost(range(1, int(units)+1))
-		return sum(all_costs)
\ No newline at end of file
+		return float(self.demand_curve.cumulative_cost(units))
\ No newline at end of file
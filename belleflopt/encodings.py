@@ -0,0 +1,327 @@
+"""
+	Reduced decision variable encodings. By default, the network problems have a decision variable for every segment and
+	day (or just 365 shared by every segment when simplified). Most of those days don't need to be set independently,
+	so an encoding gives each segment a handful of variables instead - like one per month, or the control points of a
+	smooth curve - and expands them into the 365 daily allocation proportions right before evaluation with a single
+	matrix multiply. Benefit is still scored on the full daily hydrographs.
+
+	ComponentWindowEncoding goes further and gives each segment one variable per flow component window, with ramps
+	between the windows, so a segment's variables line up with what its benefit is actually scored on.
+
+	SensitiveDayEncoding keeps daily variables only where they can change environmental benefit and collapses the days
+	in between, which only the economic objective sees.
+
+	The basis matrices used here are all nonnegative and each day's weights add up to one, so every day's allocation is
+	a weighted average of the segment's variables and stays within the variables' bounds.
+
+	Nothing in this module should import Django.
+"""
+
+import logging
+
+import numpy
+
+log = logging.getLogger("belleflopt.encodings")
+
+WATER_YEAR_MONTH_DAYS = (31, 30, 31, 31, 28, 31, 30, 31, 30, 31, 31, 30)  # October through September
+
+
+def step_basis(block_starts):
+	"""
+		Basis matrix that holds each variable constant over a block of days
+	:param block_starts: day of the water year (0 indexed) each block starts on - the first must be 0
+	:return: (blocks, 365) array
+	"""
+	block_starts = numpy.asarray(block_starts)
+	days = numpy.arange(365)
+	blocks = numpy.searchsorted(block_starts, days, side="right") - 1
+	basis = numpy.zeros((block_starts.size, 365))
+	basis[blocks, days] = 1
+	return basis
+
+
+def bspline_basis(control_points, degree=3):
+	"""
+		Basis matrix for a clamped, uniform B-spline through the water year, so allocations are a smooth curve shaped by
+		the control points. The curve starts and ends (almost exactly) at the first and last control points.
+	:param control_points: number of control points (variables) per segment
+	:param degree: degree of the spline - lowered if there aren't enough control points for it
+	:return: (control_points, 365) array
+	"""
+	if control_points < 1:
+		raise ValueError("B-splines need at least one control point")
+	degree = min(degree, control_points - 1)
+	interior = numpy.linspace(0, 1, control_points - degree + 1)[1:-1]
+	knots = numpy.concatenate([numpy.zeros(degree + 1), interior, numpy.ones(degree + 1)])
+	t = (numpy.arange(365) + 0.5) / 365  # the middle of each day, so nothing lands exactly on the last knot
+
+	# Cox-de Boor recursion, for every basis function and day at once
+	basis = ((knots[:-1, None] <= t) & (t < knots[1:, None])).astype(float)
+	for order in range(1, degree + 1):
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			left_span = knots[order:-1] - knots[:-order - 1]
+			right_span = knots[order + 1:] - knots[1:-order]
+			left = numpy.where(left_span[:, None] > 0, (t - knots[:-order - 1, None]) / left_span[:, None], 0)
+			right = numpy.where(right_span[:, None] > 0, (knots[order + 1:, None] - t) / right_span[:, None], 0)
+		basis = left * basis[:-1] + right * basis[1:]
+	return basis
+
+
+class TemporalEncoding(object):
+	"""
+		Encodes each segment's year of allocations with a few variables and a shared basis matrix:
+
+			* weekly - 52 variables, each held for a week (the last week gets the 365th day too)
+			* monthly - 12 variables, each held for a month of the water year
+			* bspline - control_points variables (12 by default) for a smooth cubic curve through the year
+	"""
+
+	KINDS = ("weekly", "monthly", "bspline")
+
+	def __init__(self, kind="monthly", control_points=None):
+		"""
+		:param kind: weekly, monthly, or bspline
+		:param control_points: for bspline, how many variables each segment gets. Defaults to 12
+		"""
+		if kind == "weekly":
+			self.basis = step_basis(numpy.arange(52) * 7)
+		elif kind == "monthly":
+			self.basis = step_basis(numpy.concatenate([[0], numpy.cumsum(WATER_YEAR_MONTH_DAYS)[:-1]]))
+		elif kind == "bspline":
+			self.basis = bspline_basis(control_points or 12)
+		else:
+			raise ValueError("Unknown encoding {} - use one of {}".format(kind, ", ".join(self.KINDS)))
+
+		if kind != "bspline" and control_points is not None and control_points != self.basis.shape[0]:
+			raise ValueError("{} encodings always have {} variables per segment".format(kind, self.basis.shape[0]))
+
+		self.kind = kind
+		self.variables_per_segment = self.basis.shape[0]
+
+	def __str__(self):
+		return "{}({})".format(self.kind, self.variables_per_segment)
+
+	def decision_variables(self, segment_count):
+		return segment_count * self.variables_per_segment
+
+	def expand(self, variables):
+		"""
+			Turns encoded variables into daily allocation proportions
+		:param variables: array of variables for one solution, or (solutions, variables) for a batch
+		:return: array of daily allocations for each segment, flattened like the daily decision variables would be -
+				(segments * 365) for one solution or (solutions, segments * 365) for a batch
+		"""
+		variables = numpy.asarray(variables, dtype=float)
+		segments = variables.shape[-1] // self.variables_per_segment
+		encoded = variables.reshape(variables.shape[:-1] + (segments, self.variables_per_segment))
+		return numpy.matmul(encoded, self.basis).reshape(variables.shape[:-1] + (segments * 365, ))
+
+
+def window_basis(windows):
+	"""
+		Basis matrix for one segment where each variable is the allocation during one component's window. Days in more
+		than one window get the average of those components' variables, and days between windows ramp linearly from
+		the variables on the last window day before them to the ones on the first window day after them, wrapping
+		around the end of the water year.
+	:param windows: (components, 365) boolean array of the days each component's window covers
+	:return: (components, 365) array. Components without a window get all zeros. If no component has a window, the
+			first variable is used for every day.
+	"""
+	basis = numpy.asarray(windows, dtype=float)
+	coverage = basis.sum(axis=0)
+	covered_days = numpy.flatnonzero(coverage)
+	if covered_days.size == 0:
+		basis = numpy.zeros_like(basis)
+		basis[0] = 1
+		return basis
+
+	basis[:, covered_days] /= coverage[covered_days]
+	gap_days = numpy.flatnonzero(coverage == 0)
+	if gap_days.size > 0:
+		after = numpy.searchsorted(covered_days, gap_days)
+		next_days = covered_days[after % covered_days.size]
+		previous_days = covered_days[after - 1]  # -1 wraps around to the last window day, like the year does
+		since_previous = (gap_days - previous_days) % 365
+		until_next = (next_days - gap_days) % 365
+		fraction = since_previous / (since_previous + until_next)
+		basis[:, gap_days] = (1 - fraction) * basis[:, previous_days] + fraction * basis[:, next_days]
+	return basis
+
+
+class ComponentWindowEncoding(object):
+	"""
+		Gives each segment one variable per flow component (FA, Wet_BFL, Peak, SP, DS in the CEFF components) - the
+		allocation proportion during that component's window, ramping between windows (see window_basis). The basis
+		differs from segment to segment, so it's a (segments, components, 365) array, built once for the network.
+		Segments with fewer components than the most any segment has just don't use the extra variables.
+	"""
+
+	kind = "components"
+
+	def __init__(self, windows):
+		"""
+			Most code will want from_benefit_table instead
+		:param windows: (segments, components, 365) boolean array of the days each component's window covers
+		"""
+		windows = numpy.asarray(windows, dtype=bool)
+		self.basis = numpy.stack([window_basis(segment_windows) for segment_windows in windows])
+		self.segment_count, self.variables_per_segment, _ = self.basis.shape
+
+	@classmethod
+	def from_benefit_table(cls, benefit_table):
+		"""
+			Uses the days each component can give benefit on as its window - the same days that get scored
+		:param benefit_table: benefit.NetworkBenefitTable for the network
+		"""
+		return cls(benefit_table.day_benefit > 0)
+
+	def __str__(self):
+		return "{}({})".format(self.kind, self.variables_per_segment)
+
+	def decision_variables(self, segment_count):
+		if segment_count != self.segment_count:
+			raise ValueError("Component window encodings have a basis for each of the network's {} segments, so they can't be used with {} - they don't work in simplified mode or with collapsed reaches".format(self.segment_count, segment_count))
+		return segment_count * self.variables_per_segment
+
+	def expand(self, variables):
+		"""
+			Same as TemporalEncoding.expand
+		"""
+		variables = numpy.asarray(variables, dtype=float)
+		encoded = variables.reshape(variables.shape[:-1] + (self.segment_count, 1, self.variables_per_segment))
+		return numpy.matmul(encoded, self.basis).reshape(variables.shape[:-1] + (self.segment_count * 365, ))
+
+
+def sensitive_days(benefit_table, router, margin_days=1):
+	"""
+		Finds the segment days whose allocation can change environmental benefit - days in one of the segment's component
+		windows, or in a window on any segment downstream, since eflows water keeps flowing down. Segments with custom
+		benefit components are sensitive all year, since we can't see their windows.
+	:param benefit_table: benefit.NetworkBenefitTable for the network
+	:param router: routing.NetworkRouter for the network
+	:param margin_days: also counts this many days on each side of every window, since recession benefit compares each
+			day's flow to the day before it
+	:return: (segments, 365) boolean array
+	"""
+	sensitive = numpy.any(benefit_table.day_benefit > 0, axis=1)
+	sensitive[numpy.any(benefit_table.component_types == benefit_table.CUSTOM, axis=1)] = True
+	for shift in range(1, margin_days + 1):
+		sensitive = sensitive | numpy.roll(sensitive, shift, axis=1) | numpy.roll(sensitive, -shift, axis=1)
+	return router.propagate_upstream(sensitive)
+
+
+class SensitiveDayEncoding(object):
+	"""
+		Keeps a decision variable for every segment day that can change environmental benefit (see sensitive_days), and
+		collapses the rest. Only the economic objective sees insensitive days, so by default each run of them on a
+		segment shares one variable, or with fixed_value they aren't variables at all and always get that allocation -
+		the lowest allowed allocation is the obvious policy, since it gives the most economic water.
+	"""
+
+	kind = "masked"
+
+	def __init__(self, sensitive, fixed_value=None):
+		"""
+			Most code will want from_network instead
+		:param sensitive: (segments, 365) boolean array of the segment days that get their own variable
+		:param fixed_value: when set, insensitive days get this allocation instead of sharing a variable per run. It
+				has to be within the problem's bounds - see check_bounds
+		"""
+		sensitive = numpy.asarray(sensitive, dtype=bool)
+		self.segment_count = sensitive.shape[0]
+		self.fixed_value = fixed_value
+		self.check_bounds(0, 1)  # allocations are proportions, whatever the problem's bounds are
+
+		# which variable each day of the flattened (segments * 365) allocations comes from, or -1 for fixed days
+		index = numpy.full(sensitive.shape, -1, dtype=numpy.int64)
+		next_variable = 0
+		for segment, segment_sensitive in enumerate(sensitive):
+			days = numpy.flatnonzero(segment_sensitive)
+			index[segment, days] = numpy.arange(next_variable, next_variable + days.size)
+			next_variable += days.size
+			if fixed_value is None and days.size < 365:
+				runs = self._insensitive_runs(segment_sensitive)
+				index[segment, ~segment_sensitive] = next_variable + runs[~segment_sensitive]
+				next_variable += int(runs.max()) + 1
+
+		self.index = index.reshape(-1)
+		self.variable_count = next_variable
+		self.variables_per_segment = next_variable / float(self.segment_count)  # on average, for reports
+		self._fixed = self.index < 0
+		self._gather = numpy.where(self._fixed, 0, self.index)
+
+		log.info("Masking insensitive days leaves {} of {} decision variables".format(self.variable_count, self.segment_count * 365))
+
+	@staticmethod
+	def _insensitive_runs(segment_sensitive):
+		"""
+			Numbers the runs of insensitive days on a segment from 0, joining a run at the end of the water year with one
+			at the start
+		"""
+		starts = ~segment_sensitive & numpy.roll(segment_sensitive, 1)
+		if not numpy.any(starts):  # the whole year is insensitive
+			return numpy.zeros(365, dtype=numpy.int64)
+		first = int(numpy.argmax(starts))  # count from the first run's start so a run across the new year isn't split
+		runs = numpy.roll(numpy.cumsum(numpy.roll(starts, -first)) - 1, first)
+		return runs
+
+	@classmethod
+	def from_network(cls, benefit_table, router, fixed_value=None, margin_days=1):
+		"""
+		:param benefit_table: benefit.NetworkBenefitTable for the network
+		:param router: routing.NetworkRouter for the network
+		:param fixed_value: see __init__
+		:param margin_days: see sensitive_days
+		"""
+		return cls(sensitive_days(benefit_table, router, margin_days=margin_days), fixed_value=fixed_value)
+
+	def __str__(self):
+		return "{}({})".format(self.kind, self.variable_count)
+
+	def decision_variables(self, segment_count):
+		if segment_count != self.segment_count:
+			raise ValueError("Masked encodings are worked out for each of the network's {} segments, so they can't be used with {} - they don't work in simplified mode or with collapsed reaches".format(self.segment_count, segment_count))
+		return self.variable_count
+
+	def check_bounds(self, lower, upper):
+		"""
+			Makes sure fixed_value is an allocation the problem could have come up with itself
+		:param lower: the problem's lowest allowed allocation, like its min_proportion
+		:param upper: the problem's highest allowed allocation
+		"""
+		if self.fixed_value is not None and not lower <= self.fixed_value <= upper:
+			raise ValueError("Masked encoding's fixed value of {} is outside the problem's bounds of {} to {}".format(self.fixed_value, lower, upper))
+
+	def expand(self, variables):
+		"""
+			Same as TemporalEncoding.expand
+		"""
+		daily = numpy.asarray(variables, dtype=float)[..., self._gather]
+		if self.fixed_value is not None:
+			daily[..., self._fixed] = self.fixed_value
+		return daily
+
+
+def get_encoding(encoding, benefit_table=None, router=None):
+	"""
+		Makes an encoding from a name like "monthly", "weekly", "bspline", "bspline:24" (24 control points), or
+		"components", or "masked" ("masked:0" to fix insensitive days at 0 instead of sharing variables). Encoding
+		objects and None are passed back as is.
+	:param benefit_table: the network's benefit.NetworkBenefitTable - needed for component and masked encodings
+	:param router: the network's routing.NetworkRouter - needed for masked encodings
+	"""
+	if encoding is None or not isinstance(encoding, str):
+		return encoding
+
+	kind, _, parameter = encoding.partition(":")
+	if kind == SensitiveDayEncoding.kind:
+		if benefit_table is None or router is None:
+			raise ValueError("Masked encodings need the network's benefit table and router")
+		return SensitiveDayEncoding.from_network(benefit_table, router, fixed_value=float(parameter) if parameter else None)
+
+	if encoding == ComponentWindowEncoding.kind:
+		if benefit_table is None:
+			raise ValueError("Component window encodings need the network's benefit table")
+		return ComponentWindowEncoding.from_benefit_table(benefit_table)
+
+	return TemporalEncoding(kind, control_points=int(parameter) if parameter else None)
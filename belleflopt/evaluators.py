@@ -0,0 +1,44 @@
+"""
+	Platypus evaluators for our problems. Nothing here should need Django so that they work with compiled networks too.
+"""
+
+import collections
+import logging
+
+from platypus import Evaluator
+
+log = logging.getLogger("belleflopt.evaluators")
+
+
+class BatchEvaluator(Evaluator):
+	"""
+		Platypus evaluator that hands every unevaluated solution in a generation to the problem's evaluate_batch at
+		once instead of evaluating them one at a time, so StreamNetworkProblem can score the whole population as
+		(population, segments, 365) arrays. Pass an instance as the evaluator argument to any platypus algorithm.
+		Problems without an evaluate_batch method are evaluated one solution at a time, as usual.
+	"""
+	def __init__(self, batch_size=None):
+		"""
+		:param batch_size: maximum number of solutions to evaluate together. None evaluates everything Platypus sends
+				at once - set it if memory gets tight with big populations on big networks
+		"""
+		super(BatchEvaluator, self).__init__()
+		self.batch_size = batch_size
+
+	def evaluate_all(self, jobs, **kwargs):
+		jobs = list(jobs)
+
+		batches = collections.OrderedDict()  # the solutions for each problem - there's almost always just one
+		for job in jobs:
+			problem = job.solution.problem
+			if hasattr(problem, "evaluate_batch"):
+				batches.setdefault(problem, []).append(job.solution)
+			else:
+				job.run()
+
+		for problem, solutions in batches.items():
+			batch_size = self.batch_size or len(solutions)
+			for start in range(0, len(solutions), batch_size):
+				problem.evaluate_batch(solutions[start:start + batch_size])
+
+		return jobs
@@ -0,0 +1,164 @@
+"""
+	Incremental evaluation of allocations. Mutation-heavy algorithms mostly make children that only differ from a parent
+	on a few segments, but a full evaluation routes and scores every segment all over again. IncrementalEvaluator keeps
+	the results of recent evaluations, finds the one closest to each new allocation, and only re-routes the segments
+	whose allocations changed plus everything downstream of them, then only re-scores benefit for those segments.
+	Everything else - eflows water, benefit, and economic water - comes straight from the earlier evaluation, so the
+	results match a full evaluation.
+
+	Nothing in this module should import Django.
+"""
+
+import collections
+import logging
+
+import numpy
+
+from belleflopt import caching
+
+log = logging.getLogger("belleflopt.incremental")
+
+_Evaluation = collections.namedtuple("_Evaluation", ["allocations", "fingerprints", "eflows_water", "segment_benefits", "segment_economic_water"])
+
+
+class IncrementalEvaluator(object):
+	"""
+		Evaluates single (segments, 365) allocations against a network, reusing the work from whichever of the recent
+		evaluations it has kept is the closest match. Recent evaluations are kept until they use more than
+		max_cache_bytes, then the least recently used ones get dropped. For algorithms that make children from the
+		current population, the cache needs to be big enough to hold a population's worth of evaluations to do much
+		good - each one takes about 2 * segments * 365 * 8 bytes.
+
+		When more than full_evaluation_fraction of the network would need recalculating anyway, it just evaluates
+		everything, which is faster than picking through the segments.
+	"""
+
+	def __init__(self, router, benefit_table, max_cache_bytes=256 * 1024 ** 2, full_evaluation_fraction=0.5):
+		"""
+		:param router: routing.NetworkRouter for the network
+		:param benefit_table: benefit.NetworkBenefitTable for the network, in the same segment order
+		:param max_cache_bytes: how much memory earlier evaluations can use
+		:param full_evaluation_fraction: when the proportion of segments that would need recalculating is above this,
+				evaluate everything instead
+		"""
+		self.router = router
+		self.benefit_table = benefit_table
+		self.max_cache_bytes = max_cache_bytes
+		self.full_evaluation_fraction = full_evaluation_fraction
+
+		self._evaluations = collections.OrderedDict()  # least recently used first
+		self._next_key = 0
+		self._cache_bytes = 0
+
+		self.full_evaluations = 0
+		self.incremental_evaluations = 0
+		self.segments_rescored = 0
+		self.segments_evaluated = 0
+
+	def evaluate(self, allocations):
+		"""
+			Routes and scores one allocation
+		:param allocations: (segments, 365) array of allocation proportions
+		:return: tuple of (environmental benefit, total economic water)
+		"""
+		allocations = numpy.array(allocations, dtype=float).reshape(self.router.segment_count, 365)
+		fingerprints = caching.fingerprint_rows(allocations)
+		self.segments_evaluated += self.router.segment_count
+
+		key, parent = self._closest_evaluation(fingerprints)
+		affected = None
+		if parent is not None:
+			changed = numpy.any(parent.allocations != allocations, axis=1)  # fingerprints only pick the parent - this is the real comparison
+			affected = self.router.downstream_closure(changed)
+
+		if affected is None or numpy.count_nonzero(affected) > self.full_evaluation_fraction * self.router.segment_count:
+			evaluation = self._evaluate_all(allocations, fingerprints)
+		elif not numpy.any(affected):  # nothing changed, so it's the same as the parent
+			self.incremental_evaluations += 1
+			self._evaluations.move_to_end(key)
+			evaluation = parent
+		else:
+			evaluation = self._evaluate_affected(allocations, fingerprints, parent, affected)
+
+		return float(numpy.sum(evaluation.segment_benefits)), float(numpy.sum(evaluation.segment_economic_water))
+
+	def evaluate_population(self, allocations):
+		"""
+			Evaluates each allocation in turn - later ones can build on earlier ones
+		:param allocations: (population, segments, 365) array of allocation proportions
+		:return: tuple of (environmental benefit, total economic water) arrays, with a value for each population member
+		"""
+		results = [self.evaluate(member) for member in allocations]
+		return numpy.array([result[0] for result in results]), numpy.array([result[1] for result in results])
+
+	def _closest_evaluation(self, fingerprints):
+		if len(self._evaluations) == 0:
+			return None, None
+
+		keys = list(self._evaluations.keys())
+		differences = numpy.count_nonzero(numpy.stack([self._evaluations[key].fingerprints for key in keys]) != fingerprints, axis=1)
+		key = keys[int(numpy.argmin(differences))]
+		return key, self._evaluations[key]
+
+	def _evaluate_all(self, allocations, fingerprints):
+		self.full_evaluations += 1
+		self.segments_rescored += self.router.segment_count
+
+		routed_water = self.router.route(allocations)
+		evaluation = _Evaluation(allocations=allocations,
+									fingerprints=fingerprints,
+									eflows_water=routed_water.eflows_water,
+									segment_benefits=self.benefit_table.get_segment_benefits(routed_water.eflows_water),
+									segment_economic_water=numpy.sum(routed_water.economic_water, axis=1))
+		self._store(evaluation)
+		return evaluation
+
+	def _evaluate_affected(self, allocations, fingerprints, parent, affected):
+		self.incremental_evaluations += 1
+		segments = numpy.flatnonzero(affected)
+		self.segments_rescored += segments.size
+
+		eflows_water, local_available = self.router.reroute(allocations, affected, parent.eflows_water)
+
+		segment_benefits = parent.segment_benefits.copy()
+		segment_benefits[segments] = self.benefit_table.get_segment_benefits(eflows_water[segments], segments=segments)
+		segment_economic_water = parent.segment_economic_water.copy()
+		segment_economic_water[segments] = numpy.sum((1 - allocations[segments]) * local_available[segments], axis=1)
+
+		evaluation = _Evaluation(allocations=allocations,
+									fingerprints=fingerprints,
+									eflows_water=eflows_water,
+									segment_benefits=segment_benefits,
+									segment_economic_water=segment_economic_water)
+		self._store(evaluation)
+		return evaluation
+
+	def _store(self, evaluation):
+		self._evaluations[self._next_key] = evaluation
+		self._next_key += 1
+		self._cache_bytes += self._evaluation_bytes(evaluation)
+
+		while self._cache_bytes > self.max_cache_bytes and len(self._evaluations) > 1:
+			_, dropped = self._evaluations.popitem(last=False)
+			self._cache_bytes -= self._evaluation_bytes(dropped)
+
+	@staticmethod
+	def _evaluation_bytes(evaluation):
+		return sum([array.nbytes for array in evaluation])
+
+	def clear(self):
+		self._evaluations.clear()
+		self._cache_bytes = 0
+
+	def stats(self):
+		"""
+			How much work incremental evaluation has been saving
+		:return: dict of counts, plus the proportion of segments that needed to be scored again
+		"""
+		return {
+			"full_evaluations": self.full_evaluations,
+			"incremental_evaluations": self.incremental_evaluations,
+			"segments_rescored": self.segments_rescored,
+			"segments_evaluated": self.segments_evaluated,
+			"rescored_fraction": self.segments_rescored / self.segments_evaluated if self.segments_evaluated else 0.0,
+		}
@@ -0,0 +1,327 @@
+"""
+	Island-model optimization. Instead of one algorithm instance working through one population in one process, this
+	runs several - each an island with its own population, possibly a different algorithm on each - in separate
+	processes against one compiled copy of the network in shared memory (see parallel.SharedNetworkArrays). Every few
+	generations, each island sends some of its nondominated solutions to the next island around a ring, where they
+	replace dominated members of that island's population, and to the main process, which keeps a global archive of
+	the best solutions any island has found.
+
+	Islands evaluate solutions themselves, so the main process's problem only gets their objective values afterward,
+	for its tracking and convergence plots.
+
+	Nothing in this module should import Django - island processes import it to get started.
+"""
+
+import logging
+import math
+import multiprocessing
+import queue
+import random
+import traceback
+
+import numpy
+from platypus import Generator, NSGAII, nondominated
+from platypus.algorithms import AbstractGeneticAlgorithm
+
+from belleflopt import array_solutions
+from belleflopt import compiled
+from belleflopt import evaluators
+from belleflopt import parallel
+from belleflopt import variation
+
+log = logging.getLogger("belleflopt.islands")
+
+
+class _InitialFlowsGenerator(Generator):
+	"""
+		Same starting populations as optimize.InitialFlowsGenerator, which islands can't import since it needs Django
+	"""
+
+	def generate(self, problem):
+		solution = array_solutions.make_solution(problem)
+		solution.variables[:] = (random.random() * 0.4) + 0.6  # start with almost everything for the environment
+		return solution
+
+
+def _operator_arguments(operators, algorithm, seed):
+	if operators == "hydrograph":
+		return variation.hydrograph_operators(algorithm, seed=seed)
+	if operators == "vectorized":
+		return variation.vectorized_operators(algorithm, seed=seed)
+	return {}
+
+
+def _immigrate(algorithm, variables, objectives):
+	"""
+		Puts migrants into an island's population in place of randomly chosen members that aren't on the island's
+		own front (or of anyone, if the whole population is on it). Migrants were already evaluated on the same
+		network, so they keep their objectives.
+	"""
+	population = algorithm.population
+	migrants = array_solutions.evaluated_solutions(algorithm.problem, variables, objectives)
+
+	front = set(id(solution) for solution in nondominated(population))
+	replaceable = [index for index, solution in enumerate(population) if id(solution) not in front] or list(range(len(population)))
+	for migrant, index in zip(migrants, random.sample(replaceable, min(len(migrants), len(replaceable)))):
+		population[index] = migrant
+
+	if hasattr(algorithm, "_assign_fitness"):  # SPEA2 selects on a fitness value that the migrants don't have yet
+		algorithm._assign_fitness(population)
+
+
+def _solution_arrays(solutions):
+	variables = array_solutions.stack_variables(solutions, dtype=float)
+	objectives = numpy.array([solution.objectives[:] for solution in solutions], dtype=float)
+	return variables, objectives
+
+
+def _run_island(island, config, inbox, neighbors, results):
+	"""
+		Runs in each island's process. Waits for commands on its inbox - ("run", NFE) to run that many more NFE, then
+		report back, or ("stop",) - taking in any migrants that arrive along the way.
+	:param island: index of this island
+	:param config: dict of the network manifest and settings from IslandModel
+	:param inbox: queue this island gets commands and migrants on
+	:param neighbors: queues of the islands this one sends migrants to
+	:param results: queue back to the main process
+	"""
+	try:
+		random.seed(config["seed"])  # platypus draws from the random module
+		network = parallel.SharedNetworkArrays.attach(config["manifest"])
+		if config["collapse_reaches"]:
+			network.collapse_linear_reaches()
+		problem = compiled.CompiledNetworkProblem(network, **config["problem_args"])
+		network.economic_benefit_calculator = config["economic_benefit_calculator"]  # exactly the main process's
+
+		algorithm_class = config["algorithm"]
+		algorithm_args = dict(config["algorithm_args"])
+		algorithm_args.update(_operator_arguments(config["operators"], algorithm_class, config["seed"]))
+		algorithm = algorithm_class(problem,
+									population_size=config["popsize"],
+									generator=_InitialFlowsGenerator(),
+									evaluator=evaluators.BatchEvaluator(),
+									**algorithm_args)
+
+		generation = 0
+		reported = 0  # how many of the problem's tracking values the main process already has
+		early_migrants = []  # migrants that arrive before the first step makes a population to put them in
+		while True:
+			message = inbox.get()
+			if message[0] == "migrants":
+				if generation > 0:
+					_immigrate(algorithm, *message[1:])
+				else:
+					early_migrants.append(message[1:])
+				continue
+			if message[0] == "stop":
+				break
+
+			target = algorithm.nfe + message[1]
+			while algorithm.nfe < target:
+				algorithm.step()
+				generation += 1
+				for migrants in early_migrants:
+					_immigrate(algorithm, *migrants)
+				early_migrants = []
+
+				while True:  # take in whatever migrants have arrived
+					try:
+						message = inbox.get_nowait()
+					except queue.Empty:
+						break
+					_immigrate(algorithm, *message[1:])
+
+				if generation % config["migration_interval"] == 0:
+					front = nondominated(algorithm.result)
+					variables, objectives = _solution_arrays(random.sample(front, min(config["migrants"], len(front))))
+					for neighbor in neighbors:
+						neighbor.put(("migrants", variables, objectives))
+					results.put(("migrants", island, variables, objectives))
+
+			variables, objectives = _solution_arrays(nondominated(algorithm.result))
+			tracking = (problem.objective_1[reported:], problem.objective_2[reported:])
+			reported = len(problem.objective_1)
+			results.put(("done", island, algorithm.nfe, variables, objectives, tracking))
+
+		for neighbor in neighbors:  # anything we sent that nobody's going to read shouldn't hold up exiting
+			neighbor.cancel_join_thread()
+	except Exception:
+		results.put(("error", island, traceback.format_exc()))
+
+
+class IslandModel(object):
+	"""
+		Runs several algorithm instances as islands in separate processes, exchanging nondominated migrants around a
+		ring every few generations and merging them into a global archive (see the module docstring). Use run like
+		a platypus algorithm's - it splits the NFE evenly between the islands - and the global archive ends up in
+		result as solutions of the original problem, so the usual plotting and output code works on it.
+
+		Island processes start on the first run and keep their populations between runs. Call close when done to shut
+		them down.
+	"""
+
+	def __init__(self, problem, islands=4, algorithms=(NSGAII, ), migration_interval=10, migrants=None, popsize=50,
+					algorithm_args=None, operators=None, archive_size=None, seed=None, start_method="spawn"):
+		"""
+		:param problem: StreamNetworkProblem or CompiledNetworkProblem to optimize. Islands optimize a compiled copy
+				with the same decision variables
+		:param islands: number of islands, each in its own process
+		:param algorithms: platypus algorithm classes for the islands, used in turn - (NSGAII, SPEA2) alternates them.
+				They need to be genetic algorithms, since migrants go into their populations
+		:param migration_interval: how many generations islands go between sending migrants
+		:param migrants: how many nondominated solutions an island sends each time. Defaults to a tenth of popsize
+		:param popsize: population size for each island
+		:param algorithm_args: dict of other arguments for every island's algorithm
+		:param operators: None for platypus's default operators, "vectorized" or "hydrograph" for the ones from
+				belleflopt.variation
+		:param archive_size: most solutions to keep in the global archive, spread along the front. Defaults to popsize
+				times the number of islands
+		:param seed: base seed - each island gets its own seed from it
+		:param start_method: multiprocessing start method for the island processes
+		"""
+		for algorithm in algorithms:
+			if not issubclass(algorithm, AbstractGeneticAlgorithm):
+				raise ValueError("{} doesn't keep a population that migrants can join, so it can't run on an island".format(algorithm.__name__))
+
+		self.problem = problem
+		self.islands = islands
+		self.algorithms = [algorithms[island % len(algorithms)] for island in range(islands)]
+		self.migration_interval = migration_interval
+		self.migrants = migrants or max(1, popsize // 10)
+		self.popsize = popsize
+		self.algorithm_args = algorithm_args or {}
+		self.operators = operators
+		self.archive_size = archive_size or popsize * islands
+		self.seed = seed if seed is not None else random.getrandbits(31)
+		self.start_method = start_method
+
+		self.archive_variables = numpy.zeros((0, problem.nvars))
+		self.archive_objectives = numpy.zeros((0, problem.nobjs))
+		self.nfe = 0
+		self.island_nfe = [0, ] * islands
+		self.migrations = 0
+
+		self._processes = []
+		self._inboxes = []
+		self._results = None
+		self._shared_arrays = None
+
+	def _start_islands(self):
+		network = self.problem.stream_network
+		if not isinstance(network, compiled.CompiledStreamNetwork):
+			network = network.compile()
+		self._shared_arrays = parallel.SharedNetworkArrays(network)
+
+		problem_args = {
+			"min_proportion": float(self.problem.types[0].min_value),
+			"simplified": self.problem.simplified,
+			"incremental": getattr(self.problem, "incremental", False),
+			"benefit_memo_bytes": getattr(self.problem, "benefit_memo_bytes", None),
+			"variable_dtype": self.problem.variable_dtype,
+			"encoding": self.problem.encoding,
+		}
+
+		context = multiprocessing.get_context(self.start_method)
+		self._inboxes = [context.Queue() for _ in range(self.islands)]
+		self._results = context.Queue()
+
+		log.info("Starting {} islands: {}".format(self.islands, ", ".join([algorithm.__name__ for algorithm in self.algorithms])))
+		for island in range(self.islands):
+			config = {
+				"manifest": self._shared_arrays.manifest,
+				"economic_benefit_calculator": self.problem.stream_network.economic_benefit_calculator,
+				"collapse_reaches": getattr(self.problem, "reaches", None) is not None,
+				"problem_args": problem_args,
+				"algorithm": self.algorithms[island],
+				"algorithm_args": self.algorithm_args,
+				"operators": self.operators,
+				"popsize": self.popsize,
+				"migration_interval": self.migration_interval,
+				"migrants": self.migrants,
+				"seed": self.seed + island,
+			}
+			neighbors = [self._inboxes[(island + 1) % self.islands]] if self.islands > 1 else []
+			process = context.Process(target=_run_island, args=(island, config, self._inboxes[island], neighbors, self._results), daemon=True)
+			process.start()
+			self._processes.append(process)
+
+	def close(self):
+		"""
+			Stops the island processes and releases their shared memory. Safe to call more than once
+		"""
+		for inbox in self._inboxes:
+			inbox.put(("stop", ))
+		for process in self._processes:
+			process.join(timeout=30)
+			if process.is_alive():
+				process.terminate()
+		self._processes = []
+		self._inboxes = []
+		self._results = None
+
+		if self._shared_arrays is not None:
+			self._shared_arrays.close()
+			self._shared_arrays = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def _update_archive(self, variables, objectives):
+		self.archive_variables, self.archive_objectives = array_solutions.merge_archive(self.archive_variables, self.archive_objectives,
+																					variables, objectives, self.archive_size)
+
+	def _record_tracking(self, tracking):
+		"""
+			Gives the main process's problem the objective values an island found, as if it had evaluated them itself
+		"""
+		for objective_1, objective_2 in zip(*tracking):
+			self.problem.eflows_nfe += 1
+			self.problem.iterations.append(self.problem.eflows_nfe)
+			self.problem.objective_1.append(objective_1)
+			self.problem.objective_2.append(objective_2)
+
+	def run(self, NFE):
+		"""
+			Runs every island for its share of NFE more evaluations, merging migrants into the global archive as they
+			come in, and waits for all of them to finish
+		"""
+		if not self._processes:
+			self._start_islands()
+
+		for inbox in self._inboxes:
+			inbox.put(("run", int(math.ceil(NFE / float(self.islands)))))
+
+		running = set(range(self.islands))
+		while running:
+			try:
+				message = self._results.get(timeout=1)
+			except queue.Empty:
+				for island in running:
+					if not self._processes[island].is_alive():
+						raise RuntimeError("Island {} exited unexpectedly with exit code {}".format(island, self._processes[island].exitcode))
+				continue
+
+			if message[0] == "error":
+				raise RuntimeError("Island {} failed:\n{}".format(message[1], message[2]))
+			if message[0] == "migrants":
+				self.migrations += 1
+				self._update_archive(message[2], message[3])
+			elif message[0] == "done":
+				_, island, island_nfe, variables, objectives, tracking = message
+				self.nfe += island_nfe - self.island_nfe[island]
+				self.island_nfe[island] = island_nfe
+				self._update_archive(variables, objectives)
+				self._record_tracking(tracking)
+				running.discard(island)
+
+		log.info("Islands done at {} NFE - {} migrations, {} solutions in the global archive".format(self.nfe, self.migrations, len(self.archive_variables)))
+
+	@property
+	def result(self):
+		"""
+			The global archive as evaluated solutions of the original problem
+		"""
+		return array_solutions.evaluated_solutions(self.problem, self.archive_variables, self.archive_objectives)
@@ -0,0 +1,64 @@
+"""
+	Compares how many NFE different variation operators need to converge - see support.benchmark_operators
+"""
+
+from belleflopt import support
+
+import logging
+
+import platypus
+
+from django.core.management.base import BaseCommand, CommandError
+
+log = logging.getLogger("belleflopt.commands.benchmark_operators")
+
+
+class Command(BaseCommand):
+	help = 'Runs each set of variation operators on the model runs and reports the NFE each needs to reach a hypervolume target'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--model_names', nargs='+', type=str, dest="model_names")
+		parser.add_argument('--operators', nargs='+', type=str, dest="operators")
+		parser.add_argument('--algorithm', nargs='+', type=str, dest="algorithm")
+		parser.add_argument('--nfe', nargs='+', type=int, dest="nfe")
+		parser.add_argument('--pop_size', nargs='+', type=int, dest="pop_size")
+		parser.add_argument('--seeds', nargs='+', type=int, dest="seeds")
+		parser.add_argument('--checkpoint_interval', nargs='+', type=int, dest="checkpoint_interval")
+		parser.add_argument('--target_fraction', nargs='+', type=float, dest="target_fraction")
+		parser.add_argument('--output', nargs='+', type=str, dest="output")
+
+	def handle(self, *args, **options):
+
+		kwargs = {}
+
+		if options['model_names']:
+			kwargs["model_run_names"] = options['model_names']
+
+		if options['operators']:
+			kwargs["operator_sets"] = options['operators']
+
+		if options['algorithm']:
+			kwargs["algorithm"] = getattr(platypus, options['algorithm'][0])
+
+		if options['nfe']:
+			kwargs["NFE"] = options['nfe'][0]
+
+		if options['pop_size']:
+			kwargs["popsize"] = options['pop_size'][0]
+
+		if options['seeds']:
+			kwargs["seeds"] = options['seeds']
+
+		if options['checkpoint_interval']:
+			kwargs["checkpoint_interval"] = options['checkpoint_interval'][0]
+
+		if options['target_fraction']:
+			kwargs["target_fraction"] = options['target_fraction'][0]
+
+		if options['output']:
+			kwargs["output_path"] = options['output'][0]
+
+		summary = support.benchmark_operators(**kwargs)
+		for model_run_name, results in summary.items():
+			for operators, result in results.items():
+				self.stdout.write("{} {}: {}".format(model_run_name, operators, result))
@@ -0,0 +1,36 @@
+"""
+	Compiles a model run into a Django-free snapshot for fast loading - see belleflopt.compiled
+"""
+
+from belleflopt import support
+
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+log = logging.getLogger("belleflopt.commands.compile_model_run")
+
+
+class Command(BaseCommand):
+	help = 'Compiles a model run\'s network, flows, and benefit components into a single .npz file'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--model_name', nargs='+', type=str, dest="model_name")
+		parser.add_argument('--water_year', nargs='+', type=int, dest="water_year")
+		parser.add_argument('--output', nargs='+', type=str, dest="output")
+
+	def handle(self, *args, **options):
+
+		kwargs = {}
+
+		if options['model_name']:
+			kwargs["model_run_name"] = options['model_name'][0]
+
+		if options['water_year']:
+			kwargs["water_year"] = options['water_year'][0]
+
+		if options['output']:
+			kwargs["output_path"] = options['output'][0]
+
+		output_path = support.compile_model_run(**kwargs)
+		self.stdout.write("Compiled model run written to {}".format(output_path))
@@ -0,0 +1,40 @@
+"""
+	Serves evaluations for runs on other machines - see belleflopt.distributed
+"""
+
+import logging
+
+from belleflopt import distributed
+from belleflopt import support
+
+from django.core.management.base import BaseCommand, CommandError
+
+log = logging.getLogger("belleflopt.commands.evaluation_worker")
+
+
+class Command(BaseCommand):
+	help = 'Serves evaluations of a compiled model run over TCP for runs using --evaluation_servers'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--snapshot', nargs='+', type=str, dest="snapshot")
+		parser.add_argument('--model_name', nargs='+', type=str, dest="model_name")
+		parser.add_argument('--water_year', nargs='+', type=int, dest="water_year")
+		parser.add_argument('--host', nargs='+', type=str, dest="host")
+		parser.add_argument('--port', nargs='+', type=int, dest="port")
+		parser.add_argument('--authkey', nargs='+', type=str, dest="authkey")
+
+	def handle(self, *args, **options):
+
+		if not options['authkey']:
+			raise CommandError("Evaluation workers need an --authkey that brokers connect with")
+
+		if options['snapshot']:
+			snapshot_path = options['snapshot'][0]
+		elif options['model_name'] and options['water_year']:
+			snapshot_path = support.get_compiled_path(options['model_name'][0], options['water_year'][0])
+		else:
+			raise CommandError("Provide a --snapshot, or a --model_name and --water_year that have been compiled with compile_model_run")
+
+		host = options['host'][0] if options['host'] else "0.0.0.0"
+		port = options['port'][0] if options['port'] else 6001
+		distributed.serve(snapshot_path, (host, port), options['authkey'][0].encode("utf-8"))
@@ -18,6 +18,10 @@ class Command(BaseCommand):
 	help = 'Runs models for thesis'
 	def add_arguments(self, parser):
 		parser.add_argument('--algorithms', nargs='+', type=str, dest="algorithms")
+		parser.add_argument('--batched', nargs='+', type=int, dest="batched")
+		parser.add_argument('--jobs', nargs='+', type=int, dest="jobs")
+		parser.add_argument('--resume', nargs='+', type=int, dest="resume")
+		parser.add_argument('--ledger', nargs='+', type=str, dest="ledger")
 
 	def handle(self, *args, **options):
 
@@ -27,4 +31,15 @@ class Command(BaseCommand):
 		else:
 			algorithms = (getattr(platypus, options["algorithms"][0]),)
 
-		support.run_experimenter(algorithms=algorithms)
+		batched = bool(options['batched']) and int(options['batched'][0]) == 1
+		resume = bool(options['resume']) and int(options['resume'][0]) == 1
+
+		kwargs = {}
+		if options['jobs']:
+			kwargs["jobs"] = int(options['jobs'][0])
+
+		if options['ledger']:
+			kwargs["ledger_path"] = options['ledger'][0]
+
+		summary = support.run_experimenter(algorithms=algorithms, batched=batched, resume=resume, **kwargs)
+		self.stdout.write("Jobs: {}".format(summary))
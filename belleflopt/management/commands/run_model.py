@@ -30,6 +30,23 @@ class Command(BaseCommand):
 		parser.add_argument('--plot_all', nargs='+', type=int, dest="plot_all")
 		parser.add_argument('--plot_best', nargs='+', type=int, dest="plot_best")
 		parser.add_argument('--seed', nargs='+', type=int, dest="seed")
+		parser.add_argument('--batched', nargs='+', type=int, dest="batched")
+		parser.add_argument('--workers', nargs='+', type=int, dest="workers")
+		parser.add_argument('--incremental', nargs='+', type=int, dest="incremental")
+		parser.add_argument('--benefit_memo_mb', nargs='+', type=int, dest="benefit_memo_mb")
+		parser.add_argument('--solution_cache_mb', nargs='+', type=int, dest="solution_cache_mb")
+		parser.add_argument('--solution_cache_tolerance', nargs='+', type=float, dest="solution_cache_tolerance")
+		parser.add_argument('--variable_dtype', nargs='+', type=str, dest="variable_dtype")
+		parser.add_argument('--vectorized_operators', nargs='+', type=int, dest="vectorized_operators")
+		parser.add_argument('--hydrograph_operators', nargs='+', type=int, dest="hydrograph_operators")
+		parser.add_argument('--encoding', nargs='+', type=str, dest="encoding")
+		parser.add_argument('--collapse_reaches', nargs='+', type=int, dest="collapse_reaches")
+		parser.add_argument('--subbasins', nargs='+', type=int, dest="subbasins")
+		parser.add_argument('--islands', nargs='+', type=int, dest="islands")
+		parser.add_argument('--migration_interval', '--migration-interval', nargs='+', type=int, dest="migration_interval")
+		parser.add_argument('--island_algorithms', nargs='+', type=str, dest="island_algorithms")
+		parser.add_argument('--evaluation_servers', nargs='+', type=str, dest="evaluation_servers")
+		parser.add_argument('--authkey', nargs='+', type=str, dest="authkey")
 
 	def handle(self, *args, **options):
 
@@ -70,5 +87,56 @@ class Command(BaseCommand):
 			log.info("Seed: {}".format(int(options['seed'][0])))
 			kwargs['seed'] = int(options['seed'][0])
 
+		if options['batched']:
+			kwargs["batched"] = int(options['batched'][0]) == 1
+
+		if options['workers']:
+			kwargs["workers"] = int(options['workers'][0])
+
+		if options['incremental']:
+			kwargs["incremental"] = int(options['incremental'][0]) == 1
+
+		if options['benefit_memo_mb'] is not None:  # 0 turns the memo off
+			kwargs["benefit_memo_bytes"] = int(options['benefit_memo_mb'][0]) * 1024 ** 2
+
+		if options['solution_cache_mb']:
+			kwargs["solution_cache_bytes"] = int(options['solution_cache_mb'][0]) * 1024 ** 2
+
+		if options['solution_cache_tolerance']:
+			kwargs["solution_cache_tolerance"] = float(options['solution_cache_tolerance'][0])
+
+		if options['variable_dtype']:
+			kwargs["variable_dtype"] = options['variable_dtype'][0]
+
+		if options['vectorized_operators']:
+			kwargs["vectorized_operators"] = int(options['vectorized_operators'][0]) == 1
+
+		if options['hydrograph_operators']:
+			kwargs["hydrograph_operators"] = int(options['hydrograph_operators'][0]) == 1
+
+		if options['encoding']:
+			kwargs["encoding"] = options['encoding'][0]
+
+		if options['collapse_reaches']:
+			kwargs["collapse_reaches"] = int(options['collapse_reaches'][0]) == 1
+
+		if options['subbasins']:
+			kwargs["subbasins"] = int(options['subbasins'][0])
+
+		if options['islands']:
+			kwargs["islands"] = int(options['islands'][0])
+
+		if options['migration_interval']:
+			kwargs["migration_interval"] = int(options['migration_interval'][0])
+
+		if options['island_algorithms']:
+			kwargs["island_algorithms"] = [getattr(platypus, algorithm) for algorithm in options['island_algorithms']]
+
+		if options['evaluation_servers']:
+			kwargs["evaluation_servers"] = options['evaluation_servers']
+
+		if options['authkey']:
+			kwargs["authkey"] = options['authkey'][0]
+
 		support.run_optimize_new(**kwargs)
 
@@ -7,18 +7,20 @@ from itertools import chain
 import numpy
 import pandas
 from platypus import Problem, Real
-from platypus.operators import Generator, Solution
+from platypus.operators import Generator
 
 from matplotlib import pyplot as plt
 
 from belleflopt import models
-from belleflopt import economic_components
+from belleflopt import benefit
+from belleflopt import routing
+from belleflopt import compiled
+from belleflopt import caching
+from belleflopt import array_solutions
 from eflows_optimization.local_settings import PREGENERATE_COMPONENTS
 
 log = logging.getLogger("eflows.optimization")
 
-random.seed = 20200224
-
 
 class SimpleInitialFlowsGenerator(Generator):
 	"""
@@ -29,8 +31,8 @@ class SimpleInitialFlowsGenerator(Generator):
 		super(SimpleInitialFlowsGenerator, self).__init__()
 
 	def generate(self, problem):
-		solution = Solution(problem)
-		solution.variables = [self.proportion, ] * problem.decision_variables  # start with almost everything for the environment
+		solution = array_solutions.make_solution(problem)
+		solution.variables[:] = self.proportion  # start with almost everything for the environment
 		return solution
 
 
@@ -42,10 +44,9 @@ class InitialFlowsGenerator(Generator):
 		super(InitialFlowsGenerator, self).__init__()
 
 	def generate(self, problem):
-		solution = Solution(problem)
+		solution = array_solutions.make_solution(problem)  # compact NumPy variables if the problem wants them
 
-		initial_values = [(random.random()*0.4)+0.6, ] * problem.decision_variables  # start with almost everything for the environment
-		solution.variables = initial_values
+		solution.variables[:] = (random.random()*0.4)+0.6  # start with almost everything for the environment
 
 		return solution
 
@@ -103,6 +104,7 @@ class ModelStreamSegment(object):
 		self._upstream_available = None
 		self.stream_segment = stream_segment
 		self.full_network = network
+		self.benefit_cache = None  # benefit by eflows hydrograph, when it's turned on - see use_benefit_cache
 
 		self.get_local_flows()
 
@@ -120,9 +122,25 @@ class ModelStreamSegment(object):
 														.order_by("water_year_day")
 		return numpy.array([float(getattr(day_flow, use_property)) for day_flow in local_flows_objects])
 
+	def use_benefit_cache(self, max_bytes):
+		"""
+			Turns on remembering eflows_benefit for hydrographs this segment has already scored, using up to max_bytes.
+			None or 0 turns it off
+		"""
+		self.benefit_cache = caching.LRUCache(max_bytes, name="{} benefit".format(self.comid)) if max_bytes else None
+
 	@property
 	def eflows_benefit(self):
-		return self.stream_segment.get_benefit_for_timeseries(self.eflows_water, daily=False, collapse_function=numpy.max)
+		eflows_water = self.eflows_water
+		if self.benefit_cache is None:
+			return self.stream_segment.get_benefit_for_timeseries(eflows_water, daily=False, collapse_function=numpy.max)
+
+		key = caching.hydrograph_keys(eflows_water)  # scoring is slow, so skip it for hydrographs we've already seen
+		eflows_benefit = self.benefit_cache.get(key)
+		if eflows_benefit is None:
+			eflows_benefit = self.stream_segment.get_benefit_for_timeseries(eflows_water, daily=False, collapse_function=numpy.max)
+			self.benefit_cache.put(key, eflows_benefit)
+		return eflows_benefit
 
 	@property
 	def eflows_water(self):
@@ -278,18 +296,37 @@ class ModelStreamSegment(object):
 		self.ax.add_patch(rect)
 
 
-class StreamNetwork(object):
-
-	stream_segments = collections.OrderedDict()
+class StreamNetwork(compiled.ArrayStreamNetwork):
+	"""
+		A network built from the database, with a ModelStreamSegment for each segment so results can be plotted.
+		Evaluation itself happens on arrays - see compiled.ArrayStreamNetwork - and segments only get the allocations
+		last passed to set_segment_allocations when allocate_segments is called, like before plotting.
+	"""
 
-	def __init__(self, django_segments, water_year, model_run, economic_benefit_instance=None):
+	def __init__(self, django_segments, water_year, model_run, economic_benefit_instance=None, collapse_reaches=False):
+		"""
+		:param collapse_reaches: when True, chains of segments without confluences between them share decision
+				variables - see collapse_linear_reaches
+		"""
 		self.water_year = water_year
 		self.model_run = model_run  # Django model run object
+		self.stream_segments = collections.OrderedDict()  # per instance, so we can have more than one network loaded
+		self._segment_allocations = None  # (allocations, simplified) that the segment objects don't have yet
 
-		self.economic_benefit_calculator = economic_benefit_instance
-		self.build(django_segments)
+		router, benefit_table = self.build(django_segments)
+		super(StreamNetwork, self).__init__(router, benefit_table, economic_benefit_instance=economic_benefit_instance)
+		if collapse_reaches:
+			self.collapse_linear_reaches()
+
+	@property
+	def model_run_name(self):
+		return self.model_run.name
 
 	def build(self, django_segments):
+		"""
+			Makes the segment objects and connects them up, then compiles their topology and benefit boxes into arrays
+		:return: tuple of (routing.NetworkRouter, benefit.NetworkBenefitTable) for the segments
+		"""
 		log.info("Initiating network and pulling daily flow data")
 
 		if PREGENERATE_COMPONENTS:
@@ -319,35 +356,73 @@ class StreamNetwork(object):
 
 			segment.stream_segment.ready_run()  # attaches the benefit objects so that we can evaluate benefit
 
+		log.info("Compiling network routing")
+		router = routing.NetworkRouter.from_stream_segments(list(self.stream_segments.values()))
+
+		log.info("Building benefit table")
+		# all of the benefit box parameters as arrays so we can score the whole network at once in get_benefits
+		benefit_table = benefit.NetworkBenefitTable.from_stream_segments([segment.stream_segment for segment in self.stream_segments.values()])
+		return router, benefit_table
+
 	def set_segment_allocations(self, allocations, simplified=False):
+		# the benefit calculations use the routed arrays, so the segment objects only get these in allocate_segments
+		super(StreamNetwork, self).set_segment_allocations(allocations, simplified=simplified)
+		self._segment_allocations = (allocations, simplified)
+
+	def allocate_segments(self):
+		"""
+			Sets the allocations last passed to set_segment_allocations on each segment object, for plotting and output.
+			Does nothing if they already have them.
+		"""
+		if self._segment_allocations is None:
+			return
+
+		allocations, simplified = self._segment_allocations
 		# reset happens in segment.set_allocation
 		if not simplified:
-			allocations = numpy.reshape(allocations, (-1, 365))
-
-			allocation_index = 0
-			for segment in self.stream_segments.values():
-				segment.set_allocation(allocations[allocation_index])
-				allocation_index += 1
+			for segment, allocation in zip(self.stream_segments.values(), numpy.reshape(allocations, (-1, 365))):
+				segment.set_allocation(allocation)
 		else:
 			for segment in self.stream_segments.values():
 				segment.set_allocation(numpy.array(allocations))
+		self._segment_allocations = None
 
-	def get_benefits(self):
-		environmental_benefits = [segment.eflows_benefit for segment in self.stream_segments.values()]
-		eflow_benefit = numpy.sum(environmental_benefits)
-		economic_water_total = numpy.sum([segment.economic_water for segment in self.stream_segments.values()])
-		self.economic_benefit_calculator.units_of_water = economic_water_total
-		economic_benefit = self.economic_benefit_calculator.get_benefit()
+	def use_benefit_memo(self, max_bytes):
+		"""
+			Turns memoization of segment benefits on or off for the benefit table (see
+			compiled.ArrayStreamNetwork.use_benefit_memo), and on each segment object for plotting, with an even share
+			of max_bytes each
+		"""
+		super(StreamNetwork, self).use_benefit_memo(max_bytes)
+		for segment in self.stream_segments.values():
+			segment.use_benefit_cache(int(max_bytes / len(self.stream_segments)) if max_bytes else None)
 
-		#print("Available Water: {}".format(numpy.sum([segment._local_available for segment in self.stream_segments.values()])))
-		#print("Env Water, Ben: {}, {}".format(numpy.sum([segment.eflows_water for segment in self.stream_segments.values()]), eflow_benefit))
-		#print("Eco Water, Ben: {}, {}".format(economic_water_total, economic_benefit))
+	def get_total_water_available(self):
+		total_water = 0
+		all_flows = self.model_run.daily_flows.filter(water_year=self.water_year)
+		for flow in all_flows:
+			total_water += flow.estimated_local_flow
 
-		# we could return the individual benefits here, but we'll save that for another time
-		return {
-			"environmental_benefit": eflow_benefit,
-			"economic_benefit": economic_benefit,
-		}
+		return float(total_water)
+
+	def compile(self):
+		"""
+			Makes a Django-free copy of this network that evaluates allocations the same way and can be saved to and
+			loaded from a single file - see belleflopt.compiled
+		:return: compiled.CompiledStreamNetwork
+		"""
+		log.info("Compiling network for model run {}, water year {}".format(self.model_run.name, self.water_year))
+		compiled_network = compiled.CompiledStreamNetwork(comids=list(self.stream_segments.keys()),
+															downstream_indices=self.router.downstream_indices,
+															local_flows=self.router.local_flows,
+															total_flows=numpy.stack([segment.raw_available for segment in self.stream_segments.values()]),
+															benefit_table=self.benefit_table,
+															total_water_available=self.get_total_water_available(),
+															water_year=self.water_year,
+															model_run_name=self.model_run.name)
+		if self.reaches is not None:  # reaches come from the topology, so they aren't saved in snapshots - just redone
+			compiled_network.collapse_linear_reaches()
+		return compiled_network
 
 	def reset(self):
 		for segment in self.stream_segments.values():
@@ -358,6 +433,7 @@ class StreamNetwork(object):
 		log.info("Dumping plots to {}".format(output_folder))
 		os.makedirs(output_folder, exist_ok=True)
 
+		self.allocate_segments()
 		for segment in self.stream_segments.values():
 			segment.plot_results_with_components(screen=show_plots, output_folder=output_folder, name_prefix=base_name)
 
@@ -365,7 +441,7 @@ class StreamNetwork(object):
 			output_file.write(str(nfe))
 
 
-class StreamNetworkProblem(Problem):
+class StreamNetworkProblem(compiled.ArrayNetworkProblem):
 	"""
 		We need to subclass this because:
 			1) We want to save the HUCs so we don't load them every time - originally
@@ -378,6 +454,8 @@ class StreamNetworkProblem(Problem):
 				Thinking that the constraint function will just traverse the network and make sure
 				that flow value in each HUC is less than or equal to the sum of that HUC's initial flow
 				plus everything coming from upstream.
+
+		Evaluation happens in compiled.ArrayNetworkProblem - this adds dumping plots of the best solutions we find.
 	"""
 	def __init__(self,
 	             stream_network,
@@ -387,104 +465,58 @@ class StreamNetworkProblem(Problem):
 	             min_proportion=0,
 	             simplified=False,
 	             plot_output_folder=None,
+	             demand_curve=None,
+	             incremental=False,
+	             benefit_memo_bytes=compiled.DEFAULT_BENEFIT_MEMO_BYTES,
+	             solution_cache_bytes=None,
+	             solution_cache_tolerance=None,
+	             variable_dtype=None,
+	             encoding=None,
 	             *args):
 		"""
-
-		:param decision_variables: when this is set to None, it will use the number of HUCs as the number of decision
-			variables
-		:param objectives:  default is two (total needs met, and min by species)
-		:param min_proportion: What is the minimum proportion of flow that we can allocate to any single segment? Raising
-				this value (min 0, max 0.999999999) prevents the model from extracting all its water in one spot.
-		:param args:
+			Takes the same arguments as compiled.ArrayNetworkProblem, plus:
+		:param plot_output_folder: when set, plots of the network are dumped in here every time we find a new best
+				environmental or economic solution
 		"""
-
-		self.stream_network = stream_network
-		self.stream_network.economic_benefit_calculator = economic_components.EconomicBenefit(starting_water_price,
-		                                                                                      total_units_needed=self.get_needed_water(total_units_needed_factor))
-		if simplified:
-			self.decision_variables = 365
-			self.simplified = True
-		else:
-			self.decision_variables = len(stream_network.stream_segments) * 365  # we need a decision variable for every stream segment and day - we'll reshape them later
-			self.simplified = False
-
-		self.iterations = []
-		self.objective_1 = []
-		self.objective_2 = []
-
 		self.best_obj1 = 0
 		self._best_obj2_for_obj1 = 0
 		self.best_obj2 = 0
 
 		self.plot_output_folder = plot_output_folder
 
-		log.info("Number of Decision Variables: {}".format(self.decision_variables))
-		super(StreamNetworkProblem, self).__init__(self.decision_variables, objectives, *args)  # pass any arguments through
-
-		self.directions[:] = Problem.MAXIMIZE  # we want to maximize all of our objectives
-		self.types[:] = Real(min_proportion, 1)  # we now construe this as a proportion instead of a raw value
-
-		self.eflows_nfe = 0
-
-	def reset(self):
-		self.iterations = []
-		self.objective_1 = []
-		self.objective_2 = []
-		self.eflows_nfe = 0
+		super(StreamNetworkProblem, self).__init__(stream_network, starting_water_price, total_units_needed_factor, objectives,
+													min_proportion, simplified, demand_curve, incremental, benefit_memo_bytes,
+													solution_cache_bytes, solution_cache_tolerance, variable_dtype, encoding, *args)
 
-	def get_needed_water(self, proportion):
+	def _record_benefits(self, solution, environmental_benefit, economic_benefit, allocations_set=True):
 		"""
-			Given a proportion of a basin's total water to extract, calculates the quantity
-		:return:
+			Sets the objectives on the solution and keeps our tracking values, then dumps plots of the network when we
+			find a new best solution if we're set up to.
+		:param allocations_set: whether the stream network currently has this solution's allocations set on it. If it
+				doesn't, they're only set when we need to plot.
 		"""
-
-		log.info("Calculating total water to extract")
-		total_water = 0
-		all_flows = self.stream_network.model_run.daily_flows.filter(water_year=self.stream_network.water_year)
-		for flow in all_flows:
-			total_water += flow.estimated_local_flow
-
-		print("Total Water Available: {}".format(total_water))
-		return float(total_water) * proportion
-
-	def evaluate(self, solution):
-		"""
-			We want to evaluate a full hydrograph of values for an entire year
-		"""
-
-		if self.eflows_nfe % 5 == 0:
-			log.info("NFE (inside): {}".format(self.eflows_nfe))
-		self.eflows_nfe += 1
-
-		# attach allocations to segments here - doesn't matter what order we do it in, so long as it's consistent
-		self.stream_network.set_segment_allocations(allocations=solution.variables, simplified=self.simplified)
-
-		benefits = self.stream_network.get_benefits()
-
-		# set the outputs - platypus looks for these here.
-		solution.objectives[0] = benefits["environmental_benefit"]
-		solution.objectives[1] = benefits["economic_benefit"]
-
-		# tracking values
-		self.iterations.append(self.eflows_nfe)
-		self.objective_1.append(benefits["environmental_benefit"])
-		self.objective_2.append(benefits["economic_benefit"])
+		super(StreamNetworkProblem, self)._record_benefits(solution, environmental_benefit, economic_benefit)
 
 		if self.plot_output_folder:  # if we want to dump the best, then check the values and dump the network if it's better than what we've seen
-			if int(benefits["environmental_benefit"]) >= self.best_obj1: # these nested conditions *could* be simplified. If env benefit is the same, but economic is better, plot. If env is better on its own, plot
+			if int(environmental_benefit) >= self.best_obj1: # these nested conditions *could* be simplified. If env benefit is the same, but economic is better, plot. If env is better on its own, plot
 				# we can dump for an environmental value that's tied for the best we've seen before *if* the economic value of it's better (AKA, it's nondominated)
-				if int(benefits["environmental_benefit"]) > self.best_obj1 or int(benefits["economic_benefit"]) > self._best_obj2_for_obj1:
-					self.stream_network.dump_plots(output_folder=os.path.join(self.plot_output_folder, "best", "env_{}_econ_{}".format(int(benefits["environmental_benefit"]), int(benefits["economic_benefit"]))),
-												base_name="{}_".format(int(benefits["environmental_benefit"])),
+				if int(environmental_benefit) > self.best_obj1 or int(economic_benefit) > self._best_obj2_for_obj1:
+					if not allocations_set:
+						self.stream_network.set_segment_allocations(allocations=self.daily_allocations(array_solutions.variables_array(solution)), simplified=self.simplified)
+					self.stream_network.dump_plots(output_folder=os.path.join(self.plot_output_folder, "best", "env_{}_econ_{}".format(int(environmental_benefit), int(economic_benefit))),
+												base_name="{}_".format(int(environmental_benefit)),
 												nfe=self.eflows_nfe)
-					self.best_obj1 = int(benefits["environmental_benefit"])
-					self.best_obj2_for_obj1 = int(benefits["economic_benefit"])
-
-			elif benefits["economic_benefit"] > (self.best_obj2 * 1.005):  # don't dump every economic output - it changes frequently. It needs to improve a bit before we dump it.
-				self.stream_network.dump_plots(output_folder=os.path.join(self.plot_output_folder, "best", "econ_{}_env{}".format(int(benefits["economic_benefit"]), int(benefits["environmental_benefit"]))),
-				                               base_name="{}_".format(int(benefits["economic_benefit"])),
+					self.best_obj1 = int(environmental_benefit)
+					self.best_obj2_for_obj1 = int(economic_benefit)
+
+			elif economic_benefit > (self.best_obj2 * 1.005):  # don't dump every economic output - it changes frequently. It needs to improve a bit before we dump it.
+				if not allocations_set:
+					self.stream_network.set_segment_allocations(allocations=self.daily_allocations(array_solutions.variables_array(solution)), simplified=self.simplified)
+				self.stream_network.dump_plots(output_folder=os.path.join(self.plot_output_folder, "best", "econ_{}_env{}".format(int(economic_benefit), int(environmental_benefit))),
+				                               base_name="{}_".format(int(economic_benefit)),
 				                               nfe=self.eflows_nfe)
-				self.best_obj2 = benefits["economic_benefit"]
+				self.best_obj2 = economic_benefit
+
 
 class HUCNetworkProblem(Problem):
 	"""
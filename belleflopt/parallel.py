@@ -0,0 +1,261 @@
+"""
+	Parallel evaluation of solutions across worker processes. Workers evaluate against a compiled, database-free copy
+	of the network (see belleflopt.compiled), shared between them in shared memory, so workers never touch SQLite and
+	can't lock each other out. Only decision variables go out to the workers and only objectives come back.
+
+	Nothing in this module should import Django - worker processes import it to get started.
+"""
+
+import atexit
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+from multiprocessing import shared_memory
+
+import numpy
+from platypus import Evaluator
+
+from belleflopt import array_solutions
+from belleflopt import benefit
+from belleflopt import compiled
+
+log = logging.getLogger("belleflopt.parallel")
+
+_worker_network = None  # the network each worker process evaluates against, set up by _initialize_worker
+_worker_shared_blocks = []  # keeps shared memory attached for as long as the worker's network uses it
+
+
+def _attach_shared_memory(name):
+	"""
+		Attaches to a shared memory block that another process created - only that process should clean it up. From
+		Python 3.13, that means not tracking it here at all. Before that, attaching always registers the block with the
+		resource tracker, but processes started through multiprocessing share their parent's tracker, where the block
+		is already registered, so that's harmless. Unregistering it here instead would drop the creator's registration,
+		and its unlink would then fail in the tracker.
+	"""
+	if sys.version_info >= (3, 13):
+		return shared_memory.SharedMemory(name=name, track=False)
+	return shared_memory.SharedMemory(name=name)
+
+
+class SharedNetworkArrays(object):
+	"""
+		Puts the read-only arrays of a CompiledStreamNetwork (flows, topology, and benefit table) in shared memory, so
+		any number of worker processes on the same machine can evaluate against one copy of them instead of each
+		loading their own. Workers rebuild the network with attach, using the small, picklable manifest, and their
+		arrays point straight at the shared memory - nothing gets copied.
+
+		The process that creates this owns the shared memory and must call close when done, which unlinks it. That
+		also happens automatically at interpreter exit, and if the process crashes outright, multiprocessing's
+		resource tracker unlinks anything left behind.
+	"""
+
+	def __init__(self, network):
+		"""
+		:param network: compiled.CompiledStreamNetwork to share
+		"""
+		arrays = dict(network.benefit_table.to_arrays())
+		arrays["downstream_indices"] = network.downstream_indices
+		arrays["local_flows"] = network.local_flows
+		arrays["total_flows"] = network.total_flows
+
+		self._blocks = []
+		self.manifest = {
+			"arrays": {},
+			"comids": list(network.comids),
+			"total_water_available": network.total_water_available,
+			"water_year": network.water_year,
+			"model_run_name": network.model_run_name,
+		}
+
+		atexit.register(self.close)
+		try:
+			for key, array in arrays.items():
+				array = numpy.ascontiguousarray(array)
+				block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+				self._blocks.append(block)
+				numpy.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+				self.manifest["arrays"][key] = (block.name, array.shape, array.dtype.str)
+		except Exception:
+			self.close()
+			raise
+
+		log.info("Shared {} MB of network data".format(round(sum([block.size for block in self._blocks]) / 1e6, 1)))
+
+	@staticmethod
+	def attach(manifest, blocks=None):
+		"""
+			Builds a network from shared memory made by another process
+		:param manifest: the manifest attribute of the SharedNetworkArrays in the process that made the shared memory
+		:param blocks: list to add the attached shared memory blocks to - they need to stay referenced as long as the
+				network is in use. Defaults to a module-level list for worker processes.
+		:return: compiled.CompiledStreamNetwork whose arrays are backed by the shared memory
+		"""
+		if blocks is None:
+			blocks = _worker_shared_blocks
+
+		arrays = {}
+		for key, (name, shape, dtype) in manifest["arrays"].items():
+			block = _attach_shared_memory(name)
+			blocks.append(block)
+			arrays[key] = numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=block.buf)
+			arrays[key].flags.writeable = False  # shared with every other worker, so nobody should change it
+
+		downstream_indices = arrays.pop("downstream_indices")
+		local_flows = arrays.pop("local_flows")
+		total_flows = arrays.pop("total_flows")
+		return compiled.CompiledStreamNetwork(comids=manifest["comids"],
+												downstream_indices=downstream_indices,
+												local_flows=local_flows,
+												total_flows=total_flows,
+												benefit_table=benefit.NetworkBenefitTable.from_arrays(arrays),
+												total_water_available=manifest["total_water_available"],
+												water_year=manifest["water_year"],
+												model_run_name=manifest["model_run_name"])
+
+	def close(self):
+		"""
+			Releases and unlinks the shared memory. Safe to call more than once
+		"""
+		while self._blocks:
+			block = self._blocks.pop()
+			block.close()
+			try:
+				block.unlink()
+			except FileNotFoundError:  # already cleaned up by someone else
+				pass
+		atexit.unregister(self.close)
+
+
+def _initialize_worker(network_source, economic_benefit_calculator, incremental=False, benefit_memo_bytes=None):
+	"""
+		Sets up the network in a worker process
+	:param network_source: path to a compiled snapshot, or the manifest of a SharedNetworkArrays
+	:param economic_benefit_calculator: EconomicBenefit instance from the main process's problem
+	:param incremental: whether the worker should evaluate incrementally against what it's evaluated before
+	:param benefit_memo_bytes: memory for the worker's memo of segment benefits, if it should keep one
+	"""
+	global _worker_network
+	if isinstance(network_source, dict):
+		_worker_network = SharedNetworkArrays.attach(network_source)
+	else:
+		_worker_network = compiled.CompiledStreamNetwork.load(network_source)
+	_worker_network.economic_benefit_calculator = economic_benefit_calculator
+	_worker_network.use_incremental_evaluation(incremental)
+	_worker_network.use_benefit_memo(benefit_memo_bytes)
+
+
+def _evaluate_allocations(allocations, simplified):
+	benefits = _worker_network.get_population_benefits(allocations, simplified=simplified)
+	return benefits["environmental_benefit"], benefits["economic_benefit"]
+
+
+class ParallelNetworkEvaluator(Evaluator):
+	"""
+		Platypus evaluator that splits each generation's unevaluated solutions across a pool of worker processes.
+		The first time it sees a problem, it compiles the problem's stream network and hands it to the workers, then
+		every batch of solutions is split into contiguous chunks, evaluated in the workers as arrays, and put back
+		together in order - so results are the same no matter how the work gets scheduled. The problem in
+		the main process still does all of the tracking and plotting through apply_batch_benefits.
+
+		By default, the network's arrays go in shared memory that all of the workers read from (see
+		SharedNetworkArrays), so memory use doesn't grow with the number of workers. Set use_shared_memory to False to
+		have each worker load its own copy from a snapshot file instead.
+
+		Call close (or use it as a context manager) when done to shut the workers down.
+	"""
+
+	def __init__(self, workers=None, chunks_per_worker=1, start_method="spawn", use_shared_memory=True):
+		"""
+		:param workers: number of worker processes. Defaults to the number of CPUs
+		:param chunks_per_worker: how many pieces to split each batch into per worker. Raising it can balance load
+				better when workers run at different speeds, at the cost of more messages
+		:param start_method: multiprocessing start method for the workers. Spawn is the default so workers don't
+				inherit the main process's Django state and database connections
+		:param use_shared_memory: When True, workers share one copy of the network in shared memory. When False, each
+				worker loads its own copy
+		"""
+		super(ParallelNetworkEvaluator, self).__init__()
+		self.workers = workers or os.cpu_count() or 1
+		self.chunks_per_worker = chunks_per_worker
+		self.start_method = start_method
+		self.use_shared_memory = use_shared_memory
+
+		self._pool = None
+		self._pool_problem = None
+		self._snapshot_folder = None
+		self._shared_arrays = None
+
+	def _start_pool(self, problem):
+		self.close()
+
+		network = problem.stream_network
+		if not isinstance(network, compiled.CompiledStreamNetwork):  # StreamNetworks need compiling, but compiled ones are ready to go
+			network = network.compile()
+
+		if self.use_shared_memory:
+			self._shared_arrays = SharedNetworkArrays(network)
+			network_source = self._shared_arrays.manifest
+		else:
+			self._snapshot_folder = tempfile.mkdtemp(prefix="belleflopt_workers_")
+			network_source = os.path.join(self._snapshot_folder, "network.npz")
+			network.save(network_source)
+
+		log.info("Starting {} evaluation workers".format(self.workers))
+		self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+															mp_context=multiprocessing.get_context(self.start_method),
+															initializer=_initialize_worker,
+															initargs=(network_source, problem.stream_network.economic_benefit_calculator, getattr(problem, "incremental", False),
+																		getattr(problem, "benefit_memo_bytes", None)))
+		self._pool_problem = problem
+
+	def evaluate_all(self, jobs, **kwargs):
+		jobs = list(jobs)
+
+		batches = {}  # the solutions for each problem - there's almost always just one
+		for job in jobs:
+			problem = job.solution.problem
+			if hasattr(problem, "apply_batch_benefits"):
+				batches.setdefault(problem, []).append(job.solution)
+			else:
+				job.run()
+
+		for problem, solutions in batches.items():
+			if hasattr(problem, "skip_cached"):  # repeats don't need to go to the workers at all
+				solutions = problem.skip_cached(solutions)
+			if len(solutions) == 0:
+				continue
+
+			if problem is not self._pool_problem:
+				self._start_pool(problem)
+
+			allocations = array_solutions.stack_variables(solutions, dtype=float)
+			if hasattr(problem, "daily_allocations"):  # workers score daily allocations, so expand any encoding here
+				allocations = problem.daily_allocations(allocations)
+			chunks = numpy.array_split(allocations, min(len(solutions), self.workers * self.chunks_per_worker))
+			results = list(self._pool.map(_evaluate_allocations, chunks, [problem.simplified, ] * len(chunks)))
+
+			problem.apply_batch_benefits(solutions, {
+				"environmental_benefit": numpy.concatenate([result[0] for result in results]),
+				"economic_benefit": numpy.concatenate([result[1] for result in results]),
+			})
+
+		return jobs
+
+	def close(self):
+		if self._pool is not None:
+			self._pool.shutdown(wait=True)
+			self._pool = None
+			self._pool_problem = None
+
+		if self._shared_arrays is not None:  # only once the workers are gone
+			self._shared_arrays.close()
+			self._shared_arrays = None
+
+		if self._snapshot_folder is not None:
+			shutil.rmtree(self._snapshot_folder, ignore_errors=True)
+			self._snapshot_folder = None
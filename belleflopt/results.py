@@ -0,0 +1,165 @@
+"""
+	Stores a run's results as plain arrays instead of pickled platypus Solutions. A result store is a folder with:
+
+		metadata.json - the run's settings, the segments' comids in order, and a list of checkpoints
+		objectives.csv - one row per nondominated solution per checkpoint, with its objective values
+		variables_nfe{NFE}.npy - each checkpoint's nondominated daily allocations, as a float32
+			(solutions, segments, 365) array
+
+	Checkpoints get appended as a run goes. Variables are written as plain .npy files so they can be memory-mapped -
+	looking at a few segments across thousands of solutions only reads those segments from disk. For archiving, a
+	store can be made with compress=True instead, which writes compressed .npz files that have to be read in full.
+
+	Nothing in this module should import Django - results can be read anywhere numpy is installed.
+"""
+
+import csv
+import datetime
+import json
+import logging
+import os
+
+import numpy
+
+log = logging.getLogger("belleflopt.results")
+
+OBJECTIVE_NAMES = ("environmental_benefit", "economic_benefit")
+
+
+class ResultStore(object):
+	"""
+		A run's checkpoints of nondominated solutions - see the module docstring for the layout. Use create to start a
+		new store (or replace an old one) and the constructor to open an existing one.
+	"""
+
+	def __init__(self, path):
+		"""
+			Opens an existing store
+		:param path: the store's folder
+		"""
+		self.path = path
+		with open(os.path.join(path, "metadata.json"), 'r') as metadata_file:
+			self.metadata = json.load(metadata_file)
+
+	@classmethod
+	def create(cls, path, comids, compress=False, **metadata):
+		"""
+			Makes a new, empty store, replacing whatever store was already at path
+		:param path: folder to put the store in
+		:param comids: comids of the segments, in the order their allocations are stored. Use ["all"] for simplified runs
+		:param compress: when True, writes compressed variables that can't be memory-mapped - smaller, but slower to read
+		:param metadata: anything else about the run to keep, like algorithm, seed, and popsize - needs to be
+				JSON-serializable
+		:return: ResultStore
+		"""
+		os.makedirs(path, exist_ok=True)
+		for name in os.listdir(path):  # clear out an old store's files, but nothing else
+			if name.startswith("variables_nfe") or name in ("objectives.csv", "metadata.json"):
+				os.remove(os.path.join(path, name))
+
+		with open(os.path.join(path, "objectives.csv"), 'w', newline='') as objectives_file:
+			csv.writer(objectives_file).writerow(("nfe", "solution") + OBJECTIVE_NAMES)
+
+		store = cls.__new__(cls)
+		store.path = path
+		store.metadata = dict(metadata)
+		store.metadata.update({"created": datetime.datetime.now().isoformat(),
+								"comids": [str(comid) for comid in comids],
+								"compress": compress,
+								"objectives": list(OBJECTIVE_NAMES),
+								"checkpoints": []})
+		store._save_metadata()
+		return store
+
+	def _save_metadata(self):
+		temporary_path = os.path.join(self.path, "metadata.json.tmp")
+		with open(temporary_path, 'w') as metadata_file:
+			json.dump(self.metadata, metadata_file, indent=4)
+		os.replace(temporary_path, os.path.join(self.path, "metadata.json"))  # never left half-written
+
+	@property
+	def comids(self):
+		return self.metadata["comids"]
+
+	@property
+	def checkpoints(self):
+		"""
+			The NFE of each checkpoint, in the order they were added
+		"""
+		return [checkpoint["nfe"] for checkpoint in self.metadata["checkpoints"]]
+
+	def _checkpoint(self, nfe):
+		if not self.metadata["checkpoints"]:
+			raise KeyError("{} doesn't have any checkpoints yet".format(self.path))
+		if nfe is None:
+			return self.metadata["checkpoints"][-1]
+		for checkpoint in self.metadata["checkpoints"]:
+			if checkpoint["nfe"] == nfe:
+				return checkpoint
+		raise KeyError("No checkpoint at {} NFE - the checkpoints are at {}".format(nfe, self.checkpoints))
+
+	def append_checkpoint(self, nfe, allocations, objectives):
+		"""
+			Adds a checkpoint's solutions to the store
+		:param nfe: NFE the run was at
+		:param allocations: (solutions, segments * 365) or (solutions, segments, 365) array of daily allocations
+		:param objectives: (solutions, objectives) array
+		"""
+		allocations = numpy.asarray(allocations, dtype=numpy.float32).reshape(len(objectives), len(self.comids), 365)
+		objectives = numpy.asarray(objectives, dtype=float).reshape(len(objectives), len(OBJECTIVE_NAMES))
+		if nfe in self.checkpoints:
+			raise ValueError("{} already has a checkpoint at {} NFE".format(self.path, nfe))
+
+		if self.metadata["compress"]:
+			file_name = "variables_nfe{}.npz".format(nfe)
+			numpy.savez_compressed(os.path.join(self.path, file_name), variables=allocations)
+		else:
+			file_name = "variables_nfe{}.npy".format(nfe)
+			numpy.save(os.path.join(self.path, file_name), allocations)
+
+		with open(os.path.join(self.path, "objectives.csv"), 'a', newline='') as objectives_file:
+			writer = csv.writer(objectives_file)
+			for index, values in enumerate(objectives):
+				writer.writerow([nfe, index] + [repr(float(value)) for value in values])  # repr keeps every digit
+
+		self.metadata["checkpoints"].append({"nfe": nfe, "solutions": len(objectives), "file": file_name,
+												"written": datetime.datetime.now().isoformat()})
+		self._save_metadata()
+		log.info("Wrote {} solutions at {} NFE to {}".format(len(objectives), nfe, self.path))
+
+	def variables(self, nfe=None, mmap=True):
+		"""
+			A checkpoint's daily allocations
+		:param nfe: which checkpoint - defaults to the latest
+		:param mmap: when True, memory-maps the array instead of reading it in, unless the store is compressed
+		:return: float32 (solutions, segments, 365) array
+		"""
+		path = os.path.join(self.path, self._checkpoint(nfe)["file"])
+		if self.metadata["compress"]:
+			with numpy.load(path) as variables_file:
+				return variables_file["variables"]
+		return numpy.load(path, mmap_mode="r" if mmap else None)
+
+	def segment_variables(self, comid, nfe=None):
+		"""
+			One segment's daily allocations for every solution at a checkpoint
+		:return: (solutions, 365) array
+		"""
+		return numpy.array(self.variables(nfe)[:, self.comids.index(str(comid))])
+
+	def objectives(self, nfe=None):
+		"""
+			A checkpoint's objective values
+		:param nfe: which checkpoint - defaults to the latest. Use "all" to get every checkpoint's, stacked together
+		:return: (solutions, objectives) array, or with nfe="all", a dict of arrays for the nfe, solution, and
+				objective columns
+		"""
+		with open(os.path.join(self.path, "objectives.csv"), 'r', newline='') as objectives_file:
+			rows = list(csv.DictReader(objectives_file))
+
+		if nfe == "all":
+			return {column: numpy.array([float(row[column]) for row in rows]) if column in OBJECTIVE_NAMES else numpy.array([int(row[column]) for row in rows])
+					for column in ("nfe", "solution") + OBJECTIVE_NAMES}
+
+		nfe = self._checkpoint(nfe)["nfe"]
+		return numpy.array([[float(row[name]) for name in OBJECTIVE_NAMES] for row in rows if int(row["nfe"]) == nfe], dtype=float).reshape(-1, len(OBJECTIVE_NAMES))
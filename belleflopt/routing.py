@@ -0,0 +1,276 @@
+"""
+	Array-based routing of water through a stream network. ModelStreamSegment works out how much water is available on
+	each segment by recursing upstream through its properties, which is easy to follow but makes fresh arrays at every
+	hop and needs resetting between evaluations. NetworkRouter compiles the network's topology into levels once - every
+	segment in a level only has upstream segments in earlier levels - so routing an allocation becomes a single forward
+	pass over preallocated buffers, with one array operation per level instead of a Python call per segment.
+"""
+
+import collections
+import logging
+
+import numpy
+
+log = logging.getLogger("belleflopt.routing")
+
+RoutedWater = collections.namedtuple("RoutedWater", ["local_available", "upstream_available", "eflows_water", "economic_water"])
+
+
+class NetworkRouter(object):
+	"""
+		Routes allocations through a network given each segment's downstream segment. Follows the same rules as
+		ModelStreamSegment - water available on a segment is its local flow plus the eflows water of everything directly
+		upstream, the allocation proportion of that stays in the stream as eflows (and flows downstream), and the rest
+		is economic water.
+
+		Segments are always referenced by their index in the order they were provided in, which should match the order
+		of the decision variables.
+	"""
+
+	def __init__(self, downstream_indices, local_flows, comids=None):
+		"""
+		:param downstream_indices: sequence with an item per segment, the index of the segment it flows into, or -1 (or None)
+				for outlets
+		:param local_flows: (segments, 365) array of the flow generated locally on each segment
+		:param comids: optional list of the comids for each segment, just for reference and error messages
+		"""
+		self.downstream_indices = numpy.array([-1 if index is None else index for index in downstream_indices], dtype=numpy.int64)
+		self.local_flows = numpy.asarray(local_flows, dtype=float)
+		self.segment_count = len(self.downstream_indices)
+		self.comids = list(comids) if comids is not None else list(range(self.segment_count))
+
+		if self.local_flows.shape[0] != self.segment_count:
+			raise ValueError("Got local flows for {} segments, but topology for {} segments".format(self.local_flows.shape[0], self.segment_count))
+
+		self.levels = self._make_levels()
+		# for each level, which of its segments have a downstream segment to pass water to, and where it goes
+		self._level_outflows = []
+		for level in self.levels:
+			downstream = self.downstream_indices[level]
+			has_downstream = downstream >= 0
+			self._level_outflows.append((level[has_downstream], downstream[has_downstream]))
+
+	@property
+	def level_outflows(self):
+		"""
+			For each level, from the headwaters down, a tuple of (sources, targets) index arrays - the level's segments
+			that flow into another segment, and the segments they flow into. Going through these in order (or reversed)
+			is how the router moves values down (or up) the network one level at a time.
+		"""
+		return self._level_outflows
+
+	@classmethod
+	def from_stream_segments(cls, stream_segments):
+		"""
+			Builds a router from ModelStreamSegment objects that already have their connectivity set up
+		:param stream_segments: list of ModelStreamSegment objects, in decision variable order
+		:return: NetworkRouter
+		"""
+		positions = {id(segment): index for index, segment in enumerate(stream_segments)}
+		downstream_indices = [positions.get(id(segment.downstream), -1) for segment in stream_segments]
+		local_flows = numpy.stack([segment._local_available for segment in stream_segments])
+		return cls(downstream_indices, local_flows, comids=[segment.comid for segment in stream_segments])
+
+	def _make_levels(self):
+		"""
+			Sorts segments into levels - headwaters are level 0 and every other segment is one level below the deepest
+			segment flowing into it - so that everything upstream of a level has been routed before we reach it.
+		:return: list of integer index arrays, one per level, in routing order
+		"""
+		upstream_counts = numpy.zeros(self.segment_count, dtype=numpy.int64)
+		for downstream in self.downstream_indices:
+			if downstream >= 0:
+				upstream_counts[downstream] += 1
+
+		levels = []
+		current = numpy.flatnonzero(upstream_counts == 0)
+		routed = 0
+		while current.size > 0:
+			levels.append(current)
+			routed += current.size
+			downstream = self.downstream_indices[current]
+			downstream = downstream[downstream >= 0]
+			numpy.subtract.at(upstream_counts, downstream, 1)
+			current = numpy.unique(downstream[upstream_counts[downstream] == 0])
+
+		if routed != self.segment_count:
+			stuck = [self.comids[index] for index in numpy.flatnonzero(upstream_counts > 0)]
+			raise ValueError("Stream network has a loop in it - can't route water through segments {}".format(stuck))
+
+		log.debug("Routing {} segments in {} levels".format(self.segment_count, len(levels)))
+		return levels
+
+	def route(self, allocations):
+		"""
+			Routes allocation proportions through the network. Every call gets its own output arrays, so results can be
+			kept around - like StreamNetwork.routed_water for plotting - without later calls changing them.
+		:param allocations: array of allocation proportions shaped (segments, 365), or (population, segments, 365) to
+				route many allocations at once
+		:return: RoutedWater namedtuple of local_available, upstream_available, eflows_water, and economic_water arrays,
+				each the same shape as allocations
+		"""
+		allocations = numpy.asarray(allocations, dtype=float)
+		output_shape = allocations.shape
+		# we work with segments first internally so each level is a simple index into the first axis
+		proportions = numpy.moveaxis(allocations.reshape(-1, self.segment_count, 365), 1, 0)
+		local_available, upstream_available, eflows_water, economic_water = (numpy.empty((self.segment_count, proportions.shape[1], 365)) for _ in range(4))
+
+		upstream_available.fill(0)
+		for level, (sources, targets) in zip(self.levels, self._level_outflows):
+			level_available = self.local_flows[level, numpy.newaxis] + upstream_available[level]
+			local_available[level] = level_available
+			eflows_water[level] = proportions[level] * level_available
+			if sources.size > 0:
+				numpy.add.at(upstream_available, targets, eflows_water[sources])
+
+		numpy.multiply(1 - proportions, local_available, out=economic_water)
+
+		return RoutedWater(*(numpy.moveaxis(buffer, 0, 1).reshape(output_shape) for buffer in (local_available, upstream_available, eflows_water, economic_water)))
+
+	def downstream_closure(self, segments):
+		"""
+			Finds every segment at or downstream of the given segments - everything whose water could change when the
+			allocations on those segments change
+		:param segments: boolean mask of segments
+		:return: boolean mask of the segments and everything downstream of them
+		"""
+		affected = numpy.array(segments, dtype=bool)
+		for sources, targets in self._level_outflows:
+			if sources.size > 0:
+				affected[targets[affected[sources]]] = True
+		return affected
+
+	def propagate_upstream(self, values):
+		"""
+			Marks each segment wherever anything downstream of it is marked - the opposite direction of
+			downstream_closure. Since eflows water flows downstream, this finds where a segment's allocation could matter
+			to some segment's benefit.
+		:param values: boolean array with segments on the first axis, like (segments, 365) for days
+		:return: boolean array of the same shape
+		"""
+		values = numpy.array(values, dtype=bool)
+		for sources, targets in reversed(self._level_outflows):  # from the outlets up, so marks pass all the way upstream
+			if sources.size > 0:
+				values[sources] |= values[targets]
+		return values
+
+	def reroute(self, allocations, affected, previous_eflows_water):
+		"""
+			Routes a single (segments, 365) allocation, but only recalculates the affected segments, reusing the eflows
+			water from a previous routing for everything else. affected must include everything downstream of any
+			segment whose allocation changed since previous_eflows_water was routed (see downstream_closure), in which
+			case the results are identical to routing everything.
+		:param allocations: (segments, 365) array of allocation proportions
+		:param affected: boolean mask of segments to recalculate
+		:param previous_eflows_water: (segments, 365) eflows water from routing the earlier allocation
+		:return: tuple of (eflows_water, local_available) - new (segments, 365) arrays. local_available is only
+				filled in for affected segments
+		"""
+		eflows_water = numpy.array(previous_eflows_water, dtype=float)
+		local_available = numpy.zeros((self.segment_count, 365))
+		upstream_available = numpy.zeros((self.segment_count, 365))
+
+		for level, (sources, targets) in zip(self.levels, self._level_outflows):
+			level_affected = level[affected[level]]
+			if level_affected.size > 0:
+				level_available = self.local_flows[level_affected] + upstream_available[level_affected]
+				local_available[level_affected] = level_available
+				eflows_water[level_affected] = allocations[level_affected] * level_available
+			if sources.size > 0:
+				# water only needs passing along if it's going somewhere we're recalculating, but it has to come from
+				# every segment flowing there, affected or not, to get the same total as a full routing
+				passing = affected[targets]
+				if numpy.any(passing):
+					numpy.add.at(upstream_available, targets[passing], eflows_water[sources[passing]])
+
+		return eflows_water, local_available
+
+
+class LinearReaches(object):
+	"""
+		Groups chains of segments with nothing joining them in between - NHD splits rivers into lots of short segments
+		between confluences - into reaches that share one set of allocations. A segment joins the reach of the segment
+		it flows into unless that segment has more than one segment flowing into it, so every reach runs from a
+		headwater or a confluence down to the next confluence or an outlet.
+
+		Only the decision variables are shared - water is still routed and benefit still scored on every original
+		segment, so results for a set of reach allocations are exactly those of the expanded segment allocations.
+	"""
+
+	def __init__(self, segment_reaches, comids=None):
+		"""
+			Most code will want from_router instead
+		:param segment_reaches: index of the reach each segment is in - reaches are numbered from 0
+		:param comids: optional list of the comids for each segment, for mapping results back to them
+		"""
+		self.segment_reaches = numpy.asarray(segment_reaches, dtype=numpy.int64)
+		self.segment_count = self.segment_reaches.size
+		self.reach_count = int(self.segment_reaches.max()) + 1 if self.segment_count else 0
+		self.comids = list(comids) if comids is not None else list(range(self.segment_count))
+
+	@classmethod
+	def from_router(cls, router):
+		"""
+			Finds the reaches in a router's network. Reaches are numbered in the order of their first segment.
+		:param router: NetworkRouter
+		:return: LinearReaches
+		"""
+		downstream_indices = router.downstream_indices
+		upstream_counts = numpy.bincount(downstream_indices[downstream_indices >= 0], minlength=router.segment_count)
+
+		reaches = numpy.full(router.segment_count, -1, dtype=numpy.int64)
+		next_reach = 0
+		for level in reversed(router.levels):  # outlets first, so the segment downstream already has its reach
+			downstream = downstream_indices[level]
+			joins = (downstream >= 0) & (upstream_counts[numpy.maximum(downstream, 0)] == 1)
+			reaches[level[joins]] = reaches[downstream[joins]]
+			starting = level[~joins]
+			reaches[starting] = numpy.arange(next_reach, next_reach + starting.size)
+			next_reach += starting.size
+
+		_, first_segments, inverse = numpy.unique(reaches, return_index=True, return_inverse=True)
+		order = numpy.argsort(numpy.argsort(first_segments))
+		return cls(order[inverse], comids=router.comids)
+
+	def expand(self, allocations):
+		"""
+			Gives every segment its reach's allocations
+		:param allocations: (reaches * 365) array for one set of allocations, or (population, reaches * 365)
+		:return: array of segment allocations in decision variable order - (segments * 365) or (population, segments * 365)
+		"""
+		allocations = numpy.asarray(allocations, dtype=float)
+		by_reach = allocations.reshape(allocations.shape[:-1] + (self.reach_count, 365))
+		return by_reach[..., self.segment_reaches, :].reshape(allocations.shape[:-1] + (self.segment_count * 365, ))
+
+	def by_comid(self, allocations):
+		"""
+			Maps one set of reach allocations back to each original segment, for writing out or plotting results
+		:param allocations: (reaches * 365) array
+		:return: OrderedDict of {comid: 365 day allocation array}
+		"""
+		segment_allocations = self.expand(allocations).reshape(self.segment_count, 365)
+		return collections.OrderedDict(zip(self.comids, segment_allocations))
+
+	def reach_comids(self):
+		"""
+			The comids of the segments in each reach
+		:return: list with an item per reach, each a list of comids in segment order
+		"""
+		reaches = [[] for _ in range(self.reach_count)]
+		for comid, reach in zip(self.comids, self.segment_reaches):
+			reaches[reach].append(comid)
+		return reaches
+
+	def report(self):
+		"""
+			How much collapsing reaches shrank the problem
+		:return: dict of counts and the reduction factor in decision variables
+		"""
+		return {
+			"segments": self.segment_count,
+			"reaches": self.reach_count,
+			"decision_variables_before": self.segment_count * 365,
+			"decision_variables_after": self.reach_count * 365,
+			"reduction_factor": self.segment_count / float(self.reach_count) if self.reach_count else 1.0,
+			"longest_reach": int(numpy.max(numpy.bincount(self.segment_reaches))) if self.segment_count else 0,
+		}
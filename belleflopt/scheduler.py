@@ -0,0 +1,186 @@
+"""
+	Runs a grid of independent jobs, like support.run_experimenter's model runs x algorithms x seeds x population
+	sizes, across a pool of processes, keeping track of each job in a small JSON ledger on disk - its state (pending,
+	running, done, or failed), how long it took, and where its results went. Rerunning with resume skips the jobs that
+	are already done, so a crash partway through a long set of runs only loses the jobs that were running at the time.
+
+	Only the main process writes the ledger, and it's replaced in one step each time, so it's never left half-written.
+
+	Nothing in this module should import Django at import time - worker processes import it to get started, and only
+	set up Django if the scheduler asks them to.
+"""
+
+import concurrent.futures
+import datetime
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+import traceback
+
+log = logging.getLogger("belleflopt.scheduler")
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _resolve(function_path):
+	"""
+		Gets a function from its dotted path, like "belleflopt.support.run_experiment_job"
+	"""
+	module_name, function_name = function_path.rsplit(".", 1)
+	return getattr(importlib.import_module(module_name), function_name)
+
+
+def _initialize_worker(django_settings):
+	"""
+		Sets up Django in a worker process, when jobs need the database
+	:param django_settings: settings module to use, or None if jobs don't need Django
+	"""
+	if django_settings is None:
+		return
+	os.environ.setdefault("DJANGO_SETTINGS_MODULE", django_settings)
+	import django
+	django.setup()
+
+
+def _run_job(function_path, job_id, parameters):
+	"""
+		Runs one job, timing it
+	:return: tuple of (job_id, result path or None, elapsed seconds, error traceback or None)
+	"""
+	start = time.monotonic()
+	try:
+		result_path = _resolve(function_path)(**parameters)
+		return job_id, result_path, time.monotonic() - start, None
+	except Exception:
+		return job_id, None, time.monotonic() - start, traceback.format_exc()
+
+
+class JobLedger(object):
+	"""
+		The on-disk record of every job in a grid and where each one stands
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.jobs = {}  # job id: {"parameters", "state", "attempts", "started", "elapsed_seconds", "result_path", "error"}
+		if os.path.exists(path):
+			with open(path, 'r') as ledger_file:
+				self.jobs = json.load(ledger_file)["jobs"]
+
+	def add(self, job_id, parameters, reset=False):
+		"""
+			Adds a job as pending if the ledger doesn't have it yet - or puts it back to pending if reset is True
+		"""
+		if job_id not in self.jobs or reset:
+			self.jobs[job_id] = {"parameters": parameters, "state": PENDING, "attempts": 0, "started": None,
+									"elapsed_seconds": None, "result_path": None, "error": None}
+
+	def set_state(self, job_id, state, **values):
+		self.jobs[job_id]["state"] = state
+		self.jobs[job_id].update(values)
+
+	def with_state(self, *states):
+		return [job_id for job_id, job in self.jobs.items() if job["state"] in states]
+
+	def summary(self):
+		"""
+			How many jobs are in each state
+		"""
+		return {state: len(self.with_state(state)) for state in (PENDING, RUNNING, DONE, FAILED)}
+
+	def save(self):
+		os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+		temporary_path = "{}.tmp".format(self.path)
+		with open(temporary_path, 'w') as ledger_file:
+			json.dump({"updated": datetime.datetime.now().isoformat(), "jobs": self.jobs}, ledger_file, indent=4, default=repr)  # classes and such get written by name
+		os.replace(temporary_path, self.path)
+
+
+class ExperimentScheduler(object):
+	"""
+		Runs jobs across a pool of processes, recording each one in a JobLedger as it starts and finishes. Jobs are
+		calls to one function, by its dotted path so worker processes can import it, with each job's own keyword
+		arguments. The function should return where it wrote its results.
+	"""
+
+	def __init__(self, function_path, ledger_path, jobs=1, resume=False, django_settings=None, start_method="spawn"):
+		"""
+		:param function_path: dotted path of the function each job calls, like "belleflopt.support.run_experiment_job"
+		:param ledger_path: JSON file to keep the ledger in
+		:param jobs: how many jobs to run at once. With 1, jobs run in this process, one after another
+		:param resume: when True, skips jobs the ledger says are done, and reruns ones that were running (the last
+				run must have stopped partway through them) or failed. When False, every job runs again
+		:param django_settings: Django settings module for worker processes to set up, if jobs need the database
+		:param start_method: multiprocessing start method for the worker processes
+		"""
+		self.function_path = function_path
+		self.ledger = JobLedger(ledger_path)
+		self.jobs = jobs
+		self.resume = resume
+		self.django_settings = django_settings
+		self.start_method = start_method
+		self.parameters = {}  # the ledger only has a readable copy of each job's parameters
+
+	def add(self, job_id, parameters):
+		"""
+			Adds a job to the grid
+		:param job_id: a name for the job that stays the same between runs, so it can be found in the ledger on resume
+		:param parameters: dict of keyword arguments for the job's function - they need to be picklable when running
+				more than one job at a time
+		:raises ValueError: if the grid already has a job with this id, since the ledger could only track one of them
+		"""
+		if job_id in self.parameters:
+			raise ValueError("There's already a job called {} - each job needs its own id".format(job_id))
+		self.parameters[job_id] = parameters
+		self.ledger.add(job_id, parameters, reset=not self.resume)
+
+	def _finish(self, job_id, result_path, elapsed, error):
+		if error is None:
+			self.ledger.set_state(job_id, DONE, elapsed_seconds=elapsed, result_path=result_path, error=None)
+			log.info("Finished {} in {} seconds".format(job_id, round(elapsed, 1)))
+		else:
+			self.ledger.set_state(job_id, FAILED, elapsed_seconds=elapsed, error=error)
+			log.error("{} failed:\n{}".format(job_id, error))
+		self.ledger.save()
+
+	def _start(self, job_id):
+		self.ledger.set_state(job_id, RUNNING, started=datetime.datetime.now().isoformat(), attempts=self.ledger.jobs[job_id]["attempts"] + 1)
+		self.ledger.save()
+		return self.parameters[job_id]
+
+	def run(self):
+		"""
+			Runs every job that isn't done yet
+		:return: the ledger's summary of job states once everything has run
+		"""
+		to_run = [job_id for job_id in self.ledger.with_state(PENDING, RUNNING, FAILED) if job_id in self.parameters]  # not old jobs from another grid
+		log.info("Running {} jobs, {} at a time ({} already done)".format(len(to_run), self.jobs, len(self.ledger.with_state(DONE))))
+
+		if self.jobs <= 1:
+			for job_id in to_run:
+				self._finish(*_run_job(self.function_path, job_id, self._start(job_id)))
+		else:
+			with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs,
+														mp_context=multiprocessing.get_context(self.start_method),
+														initializer=_initialize_worker,
+														initargs=(self.django_settings, )) as pool:
+				# only hand the pool as many jobs as it can run at once, so the ledger only says running for ones that are
+				waiting = list(reversed(to_run))
+				running = set()
+				while waiting or running:
+					while waiting and len(running) < self.jobs:
+						job_id = waiting.pop()
+						running.add(pool.submit(_run_job, self.function_path, job_id, self._start(job_id)))
+					finished, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+					for future in finished:
+						self._finish(*future.result())
+
+		summary = self.ledger.summary()
+		log.info("Jobs: {}".format(summary))
+		return summary
@@ -1,8 +1,8 @@
 import csv
+import json
 import os
 import logging
 import random
-import shelve
 
 import numpy
 import arrow
@@ -12,7 +12,17 @@ from platypus import NSGAII, OMOPSO, EpsNSGAII, SMPSO, GDE3, SPEA2, nondominated
 
 from eflows_optimization import settings
 from belleflopt import models
+from belleflopt import compiled
 from belleflopt import optimize
+from belleflopt import evaluators
+from belleflopt import array_solutions
+from belleflopt import variation
+from belleflopt import parallel
+from belleflopt import distributed
+from belleflopt import scheduler
+from belleflopt import results as result_stores  # results is a common variable name here
+from belleflopt import coevolution
+from belleflopt import islands as islands_module  # islands is also an argument to run_optimize_new
 from belleflopt import comet
 
 log = logging.getLogger("eflows.optimization.support")
@@ -63,12 +73,31 @@ def run_optimize_new(algorithm=NSGAII,
                      checkpoint_interval=True,
                      simplified=False,
                      plot_all=False,
-                     plot_best=False):
+                     plot_best=False,
+                     demand_curve=None,
+                     batched=False,
+                     workers=1,
+                     incremental=False,
+                     benefit_memo_bytes=compiled.DEFAULT_BENEFIT_MEMO_BYTES,
+                     solution_cache_bytes=None,
+                     solution_cache_tolerance=None,
+                     variable_dtype=None,
+                     vectorized_operators=False,
+                     hydrograph_operators=False,
+                     encoding=None,
+                     collapse_reaches=False,
+                     subbasins=None,
+                     islands=None,
+                     migration_interval=10,
+                     island_algorithms=None,
+                     evaluation_servers=None,
+                     authkey=None):
 	"""
 		Runs a single optimization run, defaulting to 1000 NFE using NSGAII. Won't output plots to screen
 		by default. Outputs tables and figures to the data/results folder.
 	:param algorithm: a platypus Algorithm object (not the instance, but the actual item imported from platypus)
-						defaults to NSGAII.
+						defaults to NSGAII. Can also be a tuple of (algorithm class, dict of arguments for it), like in
+						run_experimenter, to pass in things like a variator.
 	:param NFE: How many times should the objective function be run?
 	:param popsize: The size of hte population to use
 	:param seed: Random seed to start
@@ -77,15 +106,63 @@ def run_optimize_new(algorithm=NSGAII,
 						set up in many contexts
 	:param min_proportion: What is the minimum proportion of flow that we can allocate to any single segment? Raising
 			this value (min 0, max 0.999999999) prevents the model from extracting all its water in one spot.
-	:param checkpoint_interval: How many NFE should elapse before this writes out plots and shelf results. Then writes
+	:param checkpoint_interval: How many NFE should elapse before this writes out plots and adds a checkpoint to the result store. Then writes
 			those out every NFE interval until more than NFE. If True instead of a number, then defaults to int(NFE/10).
 			If NFE is not evenly divisible by checkpoint_interval, then runs to the largest multiple of checkpoint_interval
 			less than NFE.
 	:param plot_all: Makes a hydrograph/component plot for every segment and population member in the final solution set.
 	:param plot_all: Makes a hydrograph/component plot when improved results are encountered for either objective.
+	:param demand_curve: economic_components.DemandCurve instance or class used to value economic water. Defaults to
+			the linear demand curve.
+	:param batched: When True, evaluates each generation's solutions together as arrays using evaluators.BatchEvaluator
+			instead of one at a time. Same results, less overhead.
+	:param workers: When more than 1, evaluates solutions in this many worker processes, each with a compiled,
+			database-free copy of the network (see parallel.ParallelNetworkEvaluator). Results are the same as running
+			with one process for the same seed. Solutions are always evaluated in batches when this is on.
+	:param incremental: When True, only re-evaluates the segments that changed from a recently evaluated solution (and
+			everything downstream of them) - see incremental.IncrementalEvaluator. Same results, and much faster when
+			mutation only changes a few segments at a time.
+	:param benefit_memo_bytes: Remembers the benefit of each segment for hydrographs it's already scored, using up
+			to this much memory - see benefit.NetworkBenefitTable.use_memo. On by default. None or 0 turns it off
+	:param solution_cache_bytes: When set, remembers the objectives of evaluated solutions, using up to this much
+			memory, and skips evaluating repeats. The hit rate goes in the evaluation stats written with each checkpoint.
+	:param solution_cache_tolerance: Rounds decision variables to multiples of this before looking them up in the
+			solution cache, so near-repeats count as repeats too
+	:param variable_dtype: When set ("float64" or "float32"), keeps each solution's decision variables in a compact
+			NumPy array of this type instead of a list of Python floats - much less memory on big networks
+	:param vectorized_operators: When True, uses the NumPy crossover and mutation operators from belleflopt.variation
+			in place of Platypus's per-variable ones. They're seeded from seed, so runs are still reproducible.
+	:param hydrograph_operators: When True, uses the hydrograph-aware operators from belleflopt.variation instead, which
+			change whole flow component windows and segment hydrographs at once - see benchmark_operators to compare them
+	:param encoding: When set, gives each segment a few decision variables instead of one per day - "weekly", "monthly",
+			"bspline", "bspline:N" for N control points, "components" for one per flow component window, or "masked"
+			to collapse days that can't change environmental benefit. See belleflopt.encodings
+	:param collapse_reaches: When True, chains of segments without confluences between them share decision variables -
+			see optimize.StreamNetwork.collapse_linear_reaches. How much smaller that makes the problem goes in the
+			evaluation stats.
+	:param subbasins: When set, splits the network into about this many sub-basins and optimizes each one's decision
+			variables separately against the best allocations found elsewhere, merging them back into full-network
+			solutions every round - see coevolution.CooperativeCoevolution. Sub-basins run in parallel when workers is
+			more than 1. Can't be combined with simplified, encoding, or collapse_reaches.
+	:param islands: When set, runs this many algorithm instances as islands in separate processes on a shared compiled
+			network, each with its own population of popsize, and merges their best solutions into a global archive -
+			see islands.IslandModel. NFE is split between the islands.
+	:param migration_interval: How many generations islands go between sending nondominated migrants to the next island
+	:param island_algorithms: list of platypus algorithm classes to use for the islands in turn, to mix algorithms.
+			Defaults to algorithm for every island
+	:param evaluation_servers: list of "host:port" addresses of evaluation workers on other machines (started with
+			python manage.py evaluation_worker) to evaluate solutions on instead of this machine - see
+			distributed.BrokerEvaluator. Per-worker throughput gets logged at the end of the run.
+	:param authkey: the key the evaluation workers were started with
 	:return: None
 	"""
 
+	if type(algorithm) == tuple:  # if the algorithm has arguments, then we need to split it out so we can send them in
+		algorithm_args = dict(algorithm[1])
+		algorithm = algorithm[0]
+	else:
+		algorithm_args = {}
+
 	if use_comet and run_problem:
 		experiment = comet.new_experiment()
 		experiment.log_parameters({"algorithm": algorithm,
@@ -100,7 +177,7 @@ def run_optimize_new(algorithm=NSGAII,
 	else:
 		experiment = None
 
-	random.seed = seed
+	random.seed(seed)  # platypus draws all of its random numbers from the random module
 
 	model_run = models.ModelRun.objects.get(name=model_run_name)
 
@@ -113,17 +190,60 @@ def run_optimize_new(algorithm=NSGAII,
 	else:
 		output_folder = None
 
-	stream_network = optimize.StreamNetwork(model_run.segments, model_run.water_year, model_run)
+	stream_network = optimize.StreamNetwork(model_run.segments, model_run.water_year, model_run, collapse_reaches=collapse_reaches)
 	problem = optimize.StreamNetworkProblem(stream_network,
 	                                        starting_water_price=starting_water_price,
 	                                        total_units_needed_factor=economic_water_proportion,
 	                                        min_proportion=min_proportion,
 	                                        simplified=simplified,
-	                                        plot_output_folder=output_folder)
+	                                        plot_output_folder=output_folder,
+	                                        demand_curve=demand_curve,
+	                                        incremental=incremental,
+	                                        benefit_memo_bytes=benefit_memo_bytes,
+	                                        solution_cache_bytes=solution_cache_bytes,
+	                                        solution_cache_tolerance=solution_cache_tolerance,
+	                                        variable_dtype=variable_dtype,
+	                                        encoding=encoding)
 
 	log.info("Looking for {} CFS of water to extract".format(problem.stream_network.economic_benefit_calculator.total_units_needed))
 
-	eflows_opt = algorithm(problem, generator=optimize.InitialFlowsGenerator(), population_size=popsize)
+	if islands:  # islands set up their own operators, seeded for each island
+		if hydrograph_operators:
+			operators = "hydrograph"
+		elif vectorized_operators:
+			operators = "vectorized"
+		else:
+			operators = None
+		eflows_opt = islands_module.IslandModel(problem,
+		                                        islands=islands,
+		                                        algorithms=island_algorithms or (algorithm, ),
+		                                        migration_interval=migration_interval,
+		                                        popsize=popsize,
+		                                        algorithm_args=algorithm_args,
+		                                        operators=operators,
+		                                        seed=seed)
+	elif subbasins:
+		eflows_opt = coevolution.CooperativeCoevolution(problem,
+		                                                subbasins=subbasins,
+		                                                workers=workers,
+		                                                algorithm=algorithm,
+		                                                popsize=popsize,
+		                                                vectorized_operators=vectorized_operators,
+		                                                seed=seed)
+	else:
+		if hydrograph_operators:
+			algorithm_args.update(variation.hydrograph_operators(algorithm))  # after seeding, so the operators get seeded too
+		elif vectorized_operators:
+			algorithm_args.update(variation.vectorized_operators(algorithm))
+
+		if evaluation_servers:
+			algorithm_args["evaluator"] = distributed.BrokerEvaluator(evaluation_servers, authkey=authkey.encode("utf-8") if isinstance(authkey, str) else authkey)
+		elif workers > 1:
+			algorithm_args["evaluator"] = parallel.ParallelNetworkEvaluator(workers=workers)
+		elif batched:
+			algorithm_args["evaluator"] = evaluators.BatchEvaluator()
+
+		eflows_opt = algorithm(problem, generator=optimize.InitialFlowsGenerator(), population_size=popsize, **algorithm_args)
 
 	if run_problem:
 		elapsed_nfe = 0
@@ -135,11 +255,23 @@ def run_optimize_new(algorithm=NSGAII,
 		if checkpoint_interval is False or checkpoint_interval is None:
 			checkpoint_interval = NFE
 
-		# TODO: This construction means the comet.ml metric logging is duplicated, but whatever right now.
-		for total_nfe in range(checkpoint_interval, NFE+1, checkpoint_interval):
-			eflows_opt.run(checkpoint_interval)
+		# every checkpoint goes in one result store, in the final checkpoint's output folder
+		store = create_result_store(os.path.join(get_output_folder(NFE, algorithm, model_run_name, popsize, seed), "results"),
+		                            problem, algorithm, seed, popsize, model_run_name)
 
-			make_plots(eflows_opt, problem, total_nfe, algorithm, seed, popsize, model_run_name, experiment, show_plots, plot_all=plot_all, simplified=simplified)
+		try:
+			# TODO: This construction means the comet.ml metric logging is duplicated, but whatever right now.
+			for total_nfe in range(checkpoint_interval, NFE+1, checkpoint_interval):
+				eflows_opt.run(checkpoint_interval)
+
+				make_plots(eflows_opt, problem, total_nfe, algorithm, seed, popsize, model_run_name, experiment, show_plots, plot_all=plot_all, simplified=simplified, store=store)
+		finally:  # shut down worker processes, shared memory, and connections even if the run fails partway
+			if islands or subbasins:
+				eflows_opt.close()
+			else:
+				if evaluation_servers:
+					log.info("Evaluation server stats: {}".format(eflows_opt.evaluator.stats()))
+				eflows_opt.evaluator.close()
 
 		log.info("Completed at {}".format(arrow.utcnow()))
 		if use_comet:
@@ -149,10 +281,41 @@ def run_optimize_new(algorithm=NSGAII,
 			#experiment.log_asset(file_path, "results.csv")
 			experiment.end()
 
+	if run_problem:
+		log.info("Evaluation stats: {}".format(problem.evaluation_stats()))
+
 	#return file_path
 	return {"problem": problem, "solution": eflows_opt}
 
 
+def get_compiled_path(model_run_name, water_year):
+	return os.path.join(settings.BASE_DIR, "data", "compiled", "{}_{}.npz".format(model_run_name, water_year))
+
+
+def compile_model_run(model_run_name="upper_cosumnes_subset_2010", water_year=None, output_path=None):
+	"""
+		Builds the stream network for a model run and saves it as a Django-free snapshot that
+		compiled.CompiledStreamNetwork.load can read back in.
+	:param model_run_name: name of the ModelRun to compile
+	:param water_year: water year of flows to use. Defaults to the model run's water year
+	:param output_path: where to write the snapshot. Defaults to data/compiled/{model_run_name}_{water_year}.npz
+	:return: path the snapshot was written to
+	"""
+	model_run = models.ModelRun.objects.get(name=model_run_name)
+	if water_year is None:
+		water_year = model_run.water_year
+	if output_path is None:
+		output_path = get_compiled_path(model_run_name, water_year)
+
+	os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
+	stream_network = optimize.StreamNetwork(model_run.segments, water_year, model_run)
+	stream_network.compile().save(output_path)
+
+	log.info("Wrote compiled model run to {}".format(output_path))
+	return output_path
+
+
 def incremental_maximums(values, nfe, seed=1):
 	"""
 		Generator that keeps track of our max value we've seen so we can simplify convergence plots to only the
@@ -173,22 +336,40 @@ def get_best_items_for_convergence(NFE, objective_values):
 
 
 
-def write_variables_as_shelf(model_run, output_folder):
-	log.info("Writing out variables and objectives to shelf")
-	results = nondominated(model_run.result)
-	variables = [s.variables for s in results]
-	objectives = [s.objectives for s in results]
-	with shelve.open(os.path.join(output_folder, "variables.shelf")) as shelf:
-		shelf["variables"] = variables
-		shelf["objectives"] = objectives
-		shelf["result"] = model_run.result
-		shelf.sync()
+def create_result_store(path, problem, algorithm, seed, popsize, model_run_name, compress=False):
+	"""
+		Starts a results.ResultStore for a run, replacing any older one at path
+	"""
+	comids = ["all"] if problem.simplified else problem.stream_network.router.comids  # simplified runs share one hydrograph
+	return result_stores.ResultStore.create(path,
+	                                        comids=comids,
+	                                        compress=compress,
+	                                        model_run_name=model_run_name,
+	                                        algorithm=algorithm.__name__,
+	                                        seed=seed,
+	                                        popsize=popsize,
+	                                        water_year=problem.stream_network.water_year,
+	                                        encoding=getattr(getattr(problem, "encoding", None), "kind", None),
+	                                        collapse_reaches=getattr(problem, "reaches", None) is not None)
+
+
+def write_results(model_run, problem, store, NFE):
+	"""
+		Adds the nondominated solutions' daily allocations and objectives to the result store as a checkpoint
+	"""
+	log.info("Writing out variables and objectives to the result store")
+	front = nondominated(model_run.result)
+	variables = array_solutions.stack_variables(front, dtype=float)
+	if hasattr(problem, "daily_allocations"):  # expand any encoding or reaches so every store has the same layout
+		variables = problem.daily_allocations(variables)
+	store.append_checkpoint(NFE, variables, [solution.objectives[:] for solution in front])
 
 
 def plot_all_solutions(solution, problem, simplified, segment_name, output_folder, show_plots):
 
 	for i, solution in enumerate(nondominated(solution.result)):
-		problem.stream_network.set_segment_allocations(solution.variables, simplified=simplified)
+		problem.stream_network.set_segment_allocations(problem.daily_allocations(array_solutions.variables_array(solution)), simplified=simplified)
+		problem.stream_network.allocate_segments()
 		for segment in problem.stream_network.stream_segments.values():
 			output_segment_name = "{}_sol_{}".format(segment_name, i)
 			segment.plot_results_with_components(screen=show_plots, output_folder=output_folder, name_prefix=output_segment_name)
@@ -198,11 +379,14 @@ def replot_from_shelf():
 	pass
 
 
-def make_plots(model_run, problem, NFE, algorithm, seed, popsize, name, experiment=None, show_plots=False, plot_all=False, simplified=False):
+def make_plots(model_run, problem, NFE, algorithm, seed, popsize, name, experiment=None, show_plots=False, plot_all=False, simplified=False, store=None):
 	output_folder = get_output_folder(NFE, algorithm, name, popsize, seed)
 	os.makedirs(output_folder, exist_ok=True)
 
-	write_variables_as_shelf(model_run, output_folder)
+	if store is None:  # a store of its own for this checkpoint
+		store = create_result_store(os.path.join(output_folder, "results"), problem, algorithm, seed, popsize, name)
+	write_results(model_run, problem, store, NFE)
+	write_evaluation_stats(problem, output_folder, experiment=experiment)
 
 	_plot(model_run, "Pareto Front: {} NFE, PopSize: {}".format(NFE, popsize),
 	      experiment=experiment,
@@ -277,37 +461,137 @@ def make_plots(model_run, problem, NFE, algorithm, seed, popsize, name, experime
 		                   show_plots=show_plots)
 	else:
 		# just plot the last one done - not necessarily the most optimal in *any* sense
+		problem.stream_network.allocate_segments()
 		for segment in problem.stream_network.stream_segments.values():
 			segment.plot_results_with_components(screen=show_plots, output_folder=output_folder, name_prefix=segment_name)
 
 
+def write_evaluation_stats(problem, output_folder, experiment=None):
+	"""
+		Writes the problem's evaluation stats (evaluations run, cache hit rates, etc) to evaluation_stats.json in the
+		output folder, and logs them to comet if we have an experiment
+	"""
+	if not hasattr(problem, "evaluation_stats"):
+		return
+
+	stats = problem.evaluation_stats()
+	log.info("Evaluation stats: {}".format(stats))
+	with open(os.path.join(output_folder, "evaluation_stats.json"), 'w') as output_file:
+		json.dump(stats, output_file, indent=4)
+
+	if experiment is not None:
+		experiment.log_metrics(stats)
+
+
 def get_output_folder(NFE, algorithm, model_run_name, popsize, seed):
 	output_folder = os.path.join(settings.BASE_DIR, "data", "results", model_run_name, str(NFE), algorithm.__name__, str(seed),
 	                             str(popsize))
 	return output_folder
 
 
+_experiment_problems = {}  # problems for each model run, kept between jobs that run in the same process
+
+
+def run_experiment_job(model_run_name,
+                       algorithm,
+                       seed,
+                       popsize,
+                       NFE=50000,
+                       algorithm_args=None,
+                       starting_water_price=800,
+                       economic_water_proportion=0.8,
+                       batched=False,
+                       vectorized_operators=False,
+                       hydrograph_operators=False,
+                       use_comet=True):
+	"""
+		Runs one combination of model run, algorithm, seed, and population size for run_experimenter, writing its
+		results and plots out to the usual output folder. Model runs' problems get reused between jobs in the same process.
+	:return: the output folder
+	"""
+	if model_run_name not in _experiment_problems:
+		_experiment_problems[model_run_name] = run_optimize_new(model_run_name=model_run_name,
+		                                                        starting_water_price=starting_water_price,
+		                                                        economic_water_proportion=economic_water_proportion,
+		                                                        use_comet=False,
+		                                                        run_problem=False)["problem"]
+	problem = _experiment_problems[model_run_name]
+
+	log.info("{}, {}, {}".format(algorithm.__name__, seed, popsize))
+	if use_comet:
+		experiment = comet.new_experiment()
+		experiment.log_parameters({"algorithm": algorithm,
+		                           "NFE": NFE,
+		                           "popsize": popsize,
+		                           "seed": seed,
+		                           "starting_water_price": starting_water_price,
+		                           "economic_water_proportion": economic_water_proportion,
+		                           "model_name": model_run_name
+		                           })
+	else:
+		experiment = None
+
+	random.seed(seed)  # every job gets seeded on its own, so it's the same whenever and wherever it runs
+	problem.reset()
+	run_args = dict(algorithm_args or {})
+	if batched:
+		run_args["evaluator"] = evaluators.BatchEvaluator()
+	if hydrograph_operators:
+		run_args.update(variation.hydrograph_operators(algorithm, seed=seed + popsize))
+	elif vectorized_operators:
+		run_args.update(variation.vectorized_operators(algorithm, seed=seed + popsize))
+	eflows_opt = algorithm(problem, generator=optimize.InitialFlowsGenerator(), population_size=popsize, **run_args)
+	eflows_opt.run(NFE)
+
+	make_plots(eflows_opt, problem, NFE, algorithm, seed, popsize, model_run_name, experiment=experiment, show_plots=False)
+
+	if experiment is not None:
+		experiment.end()
+
+	return get_output_folder(NFE, algorithm, model_run_name, popsize, seed)
+
+
 def run_experimenter(NFE=50000,
                      popsizes=(100, 50),
                      algorithms=(NSGAII, SPEA2, SMPSO, GDE3),
                      seeds=(19991201, 18000408, 31915071, 20200224),
-                     output_shelf=None,
-                     problem_from_shelf=False,
+                     ledger_path=None,
+                     jobs=1,
                      resume=False,
                      model_run_names=("upper_cosumnes_subset_2010", "upper_cosumnes_subset_2011"),
                      starting_water_price=800,
-                     economic_water_proportion=0.8, ):
+                     economic_water_proportion=0.8,
+                     batched=False,
+                     vectorized_operators=False,
+                     hydrograph_operators=False,
+                     use_comet=True,
+                     job_function="belleflopt.support.run_experiment_job"):
+	"""
+		Runs every combination of model run, algorithm, seed, and population size, as separate jobs - see
+		scheduler.ExperimentScheduler. Each job's state goes in a ledger as it starts and finishes.
+	:param algorithms: platypus algorithm classes, or tuples of (algorithm class, dict of arguments for it)
+	:param ledger_path: JSON file to keep track of jobs in. Defaults to data/results/experimenter_ledger.json
+	:param jobs: how many jobs to run at once, each in its own process. With 1, runs them one after another in this process
+	:param resume: When True, skips jobs the ledger says are already done, so a crashed set of runs can pick up
+			where it left off
+	:param batched: When True, evaluates each generation's solutions together with evaluators.BatchEvaluator
+	:param vectorized_operators: When True, uses the NumPy operators from belleflopt.variation, seeded from each seed
+	:param hydrograph_operators: When True, uses the hydrograph-aware operators from belleflopt.variation, seeded the same way
+	:param use_comet: When True, logs each job to comet.ml
+	:param job_function: dotted path of the function that runs each job - run_experiment_job unless you want to do
+			something else with each combination
+	:return: dict of how many jobs ended up in each state
+	"""
+	if ledger_path is None:
+		ledger_path = os.path.join(settings.BASE_DIR, "data", "results", "experimenter_ledger.json")
 
-	# results = {}
+	experiment_scheduler = scheduler.ExperimentScheduler(job_function,
+	                                                     ledger_path,
+	                                                     jobs=jobs,
+	                                                     resume=resume,
+	                                                     django_settings=os.environ.get("DJANGO_SETTINGS_MODULE", "eflows_optimization.settings"))
 
 	for model_run_name in model_run_names:
-
-		problem = run_optimize_new(model_run_name=model_run_name,
-		                           starting_water_price=starting_water_price,
-		                           economic_water_proportion=economic_water_proportion,
-		                           use_comet=False,
-		                           run_problem=False)["problem"]
-
 		for algorithm in algorithms:
 			if type(algorithm) == tuple:  # if the algorithm has arguments, then we need to split it out so we can send them in
 				algorithm_args = algorithm[1]
@@ -315,44 +599,152 @@ def run_experimenter(NFE=50000,
 			else:
 				algorithm_args = {}
 
-			#if algorithm.__name__ not in results:
-				#results[algorithm.__name__] = {}
+			algorithm_name = algorithm.__name__
+			if algorithm_args:  # so the same algorithm with different arguments gets its own jobs
+				algorithm_name += "({})".format(",".join(["{}={}".format(key, getattr(value, "__name__", value)) for key, value in sorted(algorithm_args.items())]))
+
 			for seed in seeds:
-				#if seed not in results[algorithm.__name__]:
-					#results[algorithm.__name__][seed] = {}
-				random.seed = seed
 				for popsize in popsizes:
-					log.info("{}, {}, {}".format(algorithm.__name__, seed, popsize))
-					#if popsize in results[algorithm.__name__][seed]:  # if the key already exists, it means we're resuming and this already ran
-					#	continue
-
-					experiment = comet.new_experiment()
-					experiment.log_parameters({"algorithm": algorithm,
-					                           "NFE": NFE,
-					                           "popsize": popsize,
-					                           "seed": seed,
-					                           "starting_water_price": starting_water_price,
-					                           "economic_water_proportion": economic_water_proportion,
-					                           "model_name": model_run_name
-					                           })
-
-					problem.reset()
-					eflows_opt = algorithm(problem, generator=optimize.InitialFlowsGenerator(), population_size=popsize, **algorithm_args)
-					eflows_opt.run(NFE)
-
-					make_plots(eflows_opt, problem, NFE, algorithm, seed, popsize, model_run_name, experiment=experiment, show_plots=False)
+					experiment_scheduler.add("{}/{}/{}/{}/{}".format(model_run_name, NFE, algorithm_name, seed, popsize), {
+						"model_run_name": model_run_name,
+						"algorithm": algorithm,
+						"algorithm_args": algorithm_args,
+						"seed": seed,
+						"popsize": popsize,
+						"NFE": NFE,
+						"starting_water_price": starting_water_price,
+						"economic_water_proportion": economic_water_proportion,
+						"batched": batched,
+						"vectorized_operators": vectorized_operators,
+						"hydrograph_operators": hydrograph_operators,
+						"use_comet": use_comet,
+					})
+
+	return experiment_scheduler.run()
+
+
+def hypervolume(objectives, minimum, maximum):
+	"""
+		Hypervolume of a set of two objective values we're maximizing, after scaling each objective from minimum (0) to
+		maximum (1), so it's between 0 and 1. Use the same minimum and maximum to compare sets. Platypus has its own
+		Hypervolume indicator, but it needs Solutions and works out the scaling itself.
+	:param objectives: (solutions, 2) array of objective values
+	:param minimum: the reference point - values at or below it in an objective add nothing
+	:param maximum: values that scale to 1
+	:return: float
+	"""
+	points = numpy.asarray(objectives, dtype=float)
+	if points.ndim != 2 or points.shape[1] != 2:
+		raise ValueError("hypervolume only handles two objectives")
+	points = numpy.clip((points - minimum) / (numpy.asarray(maximum, dtype=float) - minimum), 0, 1)
+
+	volume = 0.0
+	best_second = 0.0
+	for first, second in points[numpy.argsort(-points[:, 0], kind="stable")]:  # sweep from the best first objective down
+		if second > best_second:
+			volume += first * (second - best_second)
+			best_second = second
+	return volume
+
+
+def _operator_arguments(operators, algorithm, seed):
+	if operators == "platypus":
+		return {}
+	if operators == "vectorized":
+		return variation.vectorized_operators(algorithm, seed=seed)
+	if operators == "hydrograph":
+		return variation.hydrograph_operators(algorithm, seed=seed)
+	raise ValueError("Unknown operators {} - use platypus, vectorized, or hydrograph".format(operators))
+
+
+def benchmark_operators(model_run_names=("upper_cosumnes_subset_2010", "upper_cosumnes_subset_2011"),
+                        operator_sets=("platypus", "hydrograph"),
+                        algorithm=NSGAII,
+                        NFE=10000,
+                        popsize=50,
+                        seeds=(19991201, 18000408, 31915071),
+                        checkpoint_interval=500,
+                        target_fraction=0.95,
+                        economic_water_proportion=0.8,
+                        output_path=None):
+	"""
+		Compares how quickly sets of variation operators converge. Runs the algorithm with each set of operators and
+		seed, recording the hypervolume of the nondominated results every checkpoint_interval NFE, then works out how many
+		NFE each run took to reach target_fraction of the best hypervolume any run reached on that model run.
+		Hypervolumes use the same scaling for every run on a model run, so they're comparable across operators.
+	:param operator_sets: which operators to compare - "platypus" (the algorithm's own, SBX and PM for NSGAII),
+			"vectorized", or "hydrograph" (see belleflopt.variation)
+	:param checkpoint_interval: NFE between hypervolume measurements
+	:param target_fraction: proportion of the best hypervolume a run needs to reach to count as converged
+	:param output_path: CSV to write the hypervolume at every checkpoint to. A JSON summary goes next to it.
+			Defaults to data/results/operator_benchmark.csv
+	:return: dict of summaries keyed by model run name, then operator set - the mean NFE to reach the target (for the
+			runs that reached it), how many runs reached it, and the mean final hypervolume
+	"""
+	if output_path is None:
+		output_path = os.path.join(settings.BASE_DIR, "data", "results", "operator_benchmark.csv")
+	os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
 
-					#results[algorithm.__name__][seed][popsize] = eflows_opt
-					#with shelve.open(output_shelf) as shelf:  # save the results out to a file after each round
-					#	shelf["results"] = results
+	rows = []
+	summary = {}
+	for model_run_name in model_run_names:
+		problem = run_optimize_new(model_run_name=model_run_name,
+		                           economic_water_proportion=economic_water_proportion,
+		                           use_comet=False,
+		                           run_problem=False,
+		                           variable_dtype=numpy.float64)["problem"]
 
-						# these will save some space in the results
-					#	shelf["results"][algorithm.__name__][seed][popsize].problem.stream_network = None
-					#	shelf["results"][algorithm.__name__][seed][popsize].problem.types = None
-					#	shelf.sync()
+		checkpoints = []  # (operators, seed, nfe, objectives of the nondominated results)
+		for operators in operator_sets:
+			for seed in seeds:
+				log.info("Benchmarking {} operators on {}, seed {}".format(operators, model_run_name, seed))
+				random.seed(seed)
+				problem.reset()
+				algorithm_args = _operator_arguments(operators, algorithm, seed)
+				eflows_opt = algorithm(problem, generator=optimize.InitialFlowsGenerator(), population_size=popsize,
+				                       evaluator=evaluators.BatchEvaluator(), **algorithm_args)
+				while eflows_opt.nfe < NFE:
+					eflows_opt.run(checkpoint_interval)
+					front = numpy.array([solution.objectives[:] for solution in nondominated(eflows_opt.result)], dtype=float)
+					checkpoints.append((operators, seed, eflows_opt.nfe, front))
+
+		all_objectives = numpy.concatenate([checkpoint[3] for checkpoint in checkpoints])
+		minimum = numpy.min(all_objectives, axis=0)
+		maximum = numpy.max(all_objectives, axis=0)
+		maximum = numpy.where(maximum > minimum, maximum, minimum + 1)  # so a flat objective doesn't divide by zero
+
+		volumes = [hypervolume(checkpoint[3], minimum, maximum) for checkpoint in checkpoints]
+		target = target_fraction * max(volumes)
+
+		runs = {}
+		for (operators, seed, nfe, _), volume in zip(checkpoints, volumes):
+			rows.append({"model_run": model_run_name, "operators": operators, "seed": seed, "nfe": nfe, "hypervolume": volume})
+			run = runs.setdefault((operators, seed), {"nfe_to_target": None, "final_hypervolume": 0.0})
+			if volume >= target and run["nfe_to_target"] is None:
+				run["nfe_to_target"] = nfe
+			run["final_hypervolume"] = volume
+
+		summary[model_run_name] = {}
+		for operators in operator_sets:
+			operator_runs = [run for (run_operators, _), run in runs.items() if run_operators == operators]
+			reached = [run["nfe_to_target"] for run in operator_runs if run["nfe_to_target"] is not None]
+			summary[model_run_name][operators] = {
+				"mean_nfe_to_target": float(numpy.mean(reached)) if reached else None,
+				"runs_reaching_target": len(reached),
+				"runs": len(operator_runs),
+				"mean_final_hypervolume": float(numpy.mean([run["final_hypervolume"] for run in operator_runs])),
+			}
+			log.info("{} - {}: {}".format(model_run_name, operators, summary[model_run_name][operators]))
+
+	with open(output_path, 'w', newline="") as output_file:
+		writer = csv.DictWriter(output_file, fieldnames=["model_run", "operators", "seed", "nfe", "hypervolume"])
+		writer.writeheader()
+		writer.writerows(rows)
 
-					experiment.end()
+	with open(os.path.splitext(output_path)[0] + "_summary.json", 'w') as summary_file:
+		json.dump(summary, summary_file, indent=2)
 
+	return summary
 
 
 def validate_flow_methods(model_run_name="upper_cosumnes_subset_2010", show_plot=True):
@@ -0,0 +1,128 @@
+import datetime
+import random
+
+import numpy
+import platypus
+
+from django.test import TestCase
+
+from belleflopt import load, models, optimize
+
+# p10, p25, p50, p75, p90 for each flow metric on the test segments - the peak values are from Goodyear's Bar
+TEST_FLOW_METRICS = {
+	"Peak": {"Peak_2": [2903.04, 4493.50, 5484.66, 6384.78, 14058.51],
+			"Wet_Tim": [46.385, 58.575, 72.425, 95.12, 118.79],
+			"Wet_BFL_Dur": [66.49, 94.09, 137.39, 173.81, 197.04],
+			"Peak_Dur_2": [1, 1, 4, 10, 25],
+			"Peak_Fre_2": [1, 1, 2, 3, 5], },
+	"DS": {"DS_Mag_50": [60, 90, 120, 180, 250],
+			"DS_Tim": [240, 250, 262, 275, 290],
+			"DS_Dur_WS": [90, 100, 110, 125, 140], },
+	"SP": {"SP_Mag": [1500, 2200, 2800, 3300, 4000],
+			"DS_Mag_50": [60, 90, 120, 180, 250],
+			"SP_Tim": [195, 205, 215, 225, 235],
+			"SP_Dur": [40, 50, 60, 70, 80],
+			"SP_ROC": [0.03, 0.05, 0.07, 0.09, 0.11], },
+}
+
+
+class LowFlowFailingBox(object):
+	"""
+		A benefit box that can't score low flows - fails on the zero flow check when a NetworkBenefitTable is built,
+		so the table keeps it as a custom component. Defined here instead of in a test so it can be pickled.
+	"""
+	def __init__(self, threshold=100):
+		self.threshold = threshold
+
+	def get_benefit_for_timeseries(self, timeseries):
+		if numpy.max(timeseries) < self.threshold:
+			raise ValueError("can't score low flows")
+		return numpy.ones(365)
+
+
+def make_test_model_run(name="test_network", water_year=2010, downstream_segments=(None, 0, 0, 1, 1)):
+	"""
+		Loads a small network into the database for tests that need a full StreamNetwork. Looks like:
+
+			4   3
+			 \ /
+			  1   2
+			   \ /
+			    0
+
+		Every segment gets peak, dry season, and spring recession components and a scaled copy of a hydrograph
+		as its local flow.
+	:param downstream_segments: index of the segment each segment flows into, or None for the outlet, to make a
+			different network
+	:return: ModelRun
+	"""
+	load.load_flow_components()
+	load.load_flow_metrics()
+
+	model_run = models.ModelRun(name=name, water_year=water_year)
+	model_run.save()
+
+	# the outlet drains to a segment outside of the model run, like it would in the full dataset
+	outside_segment = models.StreamSegment(com_id="900099", routed_upstream_area=0, total_upstream_area=0)
+	outside_segment.save()
+
+	segments = []
+	for index, downstream in enumerate(downstream_segments):
+		segment = models.StreamSegment(com_id=str(900000 + index), routed_upstream_area=0, total_upstream_area=0,
+										species_presence=1 + index / 10.0,
+										downstream=segments[downstream] if downstream is not None else outside_segment)
+		segment.save()
+		segments.append(segment)
+		model_run.segments.add(segment)
+
+		for ceff_id, metrics in TEST_FLOW_METRICS.items():
+			segment_component = models.SegmentComponent(stream_segment=segment, component=models.FlowComponent.objects.get(ceff_id=ceff_id))
+			segment_component.save()
+			for metric, values in metrics.items():
+				descriptor = models.SegmentComponentDescriptor(flow_metric=models.FlowMetric.objects.get(metric=metric),
+																pct_10=values[0], pct_25=values[1], pct_50=values[2],
+																pct_75=values[3], pct_90=values[4])
+				descriptor.save()
+				descriptor.flow_components.add(segment_component)
+
+		# a hydrograph with a winter peak, a spring recession, and a dry season, scaled for each segment
+		days = numpy.arange(365)
+		flows = 150 + 1800 * numpy.exp(-((days - 150) / 40.0) ** 2) + 300 * numpy.sin(days / 7.0) ** 2
+		flows *= 0.4 + 0.3 * index
+		start_date = datetime.date(water_year - 1, 10, 1)
+		models.DailyFlow.objects.bulk_create([models.DailyFlow(model_run=model_run,
+																stream_segment=segment,
+																flow_date=start_date + datetime.timedelta(days=int(day)),
+																water_year=water_year,
+																water_year_day=int(day) + 1,
+																estimated_total_flow=round(float(flow), 3)) for day, flow in zip(days, flows)])
+
+	load.build_segment_components(simple_test=False)
+	return model_run
+
+
+class StreamNetworkTestCase(TestCase):
+	"""
+		Base for tests that need the network from make_test_model_run - loads it with a problem and some random
+		allocations to evaluate
+	"""
+	def setUp(self):
+		self.model_run = make_test_model_run()
+		self.stream_network = optimize.StreamNetwork(self.model_run.segments, self.model_run.water_year, self.model_run)
+		self.problem = optimize.StreamNetworkProblem(self.stream_network)
+		self.allocations = numpy.random.RandomState(20200315).uniform(0, 1, (6, len(self.stream_network.stream_segments) * 365))
+
+	def _run_seeded(self, evaluator):
+		random.seed(20200320)
+		self.problem.reset()
+		algorithm = platypus.NSGAII(self.problem, generator=optimize.InitialFlowsGenerator(), population_size=6, evaluator=evaluator)
+		algorithm.run(18)
+		evaluator.close()
+		return [list(solution.objectives) for solution in algorithm.population], list(self.problem.objective_1)
+
+	def _evaluate_with(self, evaluator, allocations):
+		solutions = [platypus.Solution(self.problem) for _ in allocations]
+		for solution, allocation in zip(solutions, allocations):
+			solution.variables[:] = list(allocation)
+		evaluator.evaluate_all([platypus.core.EvaluateSolution(solution) for solution in solutions])
+		return [solution.objectives[:] for solution in solutions]
@@ -0,0 +1,74 @@
+import copy
+import pickle
+import random
+import unittest
+
+import numpy
+import platypus
+
+from belleflopt import array_solutions
+
+
+class _ArrayProblem(platypus.Problem):
+	def __init__(self, variable_dtype=None):
+		super(_ArrayProblem, self).__init__(730, 2)
+		self.types[:] = platypus.Real(0, 1)
+		self.variable_dtype = variable_dtype
+
+	def evaluate(self, solution):
+		variables = array_solutions.variables_array(solution)
+		solution.objectives[:] = [float(numpy.sum(variables)), float(numpy.sum(variables ** 2))]
+
+
+class TestArraySolutions(unittest.TestCase):
+
+	def test_behaves_like_a_solution(self):
+		problem = _ArrayProblem(variable_dtype=numpy.float32)
+		solution = array_solutions.make_solution(problem)
+		self.assertIsInstance(solution, array_solutions.ArraySolution)
+		self.assertEqual(solution.variables.array.dtype, numpy.float32)
+
+		solution.variables[:] = 0.25
+		solution.variables[3] = 0.5
+		self.assertEqual(len(solution.variables), 730)
+		self.assertEqual(float(solution.variables[3]), 0.5)
+		self.assertIs(numpy.asarray(solution.variables), solution.variables.array)  # no copy
+
+		child = copy.deepcopy(solution)
+		self.assertIsInstance(child, array_solutions.ArraySolution)
+		self.assertIs(child.problem, problem)
+		child.variables[0] = 1
+		self.assertEqual(float(solution.variables[0]), 0.25)  # the child has its own variables
+
+		unpickled = pickle.loads(pickle.dumps(solution))
+		numpy.testing.assert_array_equal(unpickled.variables.array, solution.variables.array)
+		self.assertLess(len(pickle.dumps(solution.variables)), 730 * 4 + 1000)  # raw buffer, not a float per variable
+
+		self.assertIsInstance(array_solutions.make_solution(_ArrayProblem()), platypus.Solution)
+		self.assertNotIsInstance(array_solutions.make_solution(_ArrayProblem()), array_solutions.ArraySolution)
+
+	def test_same_results_as_lists(self):
+		"""
+			Platypus's operators should do exactly the same thing to float64 arrays as they do to lists of floats
+		"""
+		results = []
+		for variable_dtype in (None, numpy.float64):
+			random.seed(20200401)
+			algorithm = platypus.NSGAII(_ArrayProblem(variable_dtype=variable_dtype),
+										generator=_CompactRandomGenerator(), population_size=10)
+			algorithm.run(40)
+			results.append(array_solutions.stack_variables(algorithm.population, dtype=float))
+			self.assertEqual(isinstance(algorithm.population[0], array_solutions.ArraySolution), variable_dtype is not None)
+
+		numpy.testing.assert_array_equal(results[0], results[1])
+
+
+class _CompactRandomGenerator(platypus.Generator):
+	def generate(self, problem):
+		solution = array_solutions.make_solution(problem)
+		solution.variables[:] = [random.random() for _ in range(problem.nvars)]
+		return solution
+
+
+if __name__ == '__main__':
+	unittest.main()
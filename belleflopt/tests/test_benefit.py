@@ -1,9 +1,13 @@
 import logging
 import decimal
+from unittest import mock
+
+import numpy
 
 from django.test import TestCase
 
 from belleflopt import benefit
+from belleflopt.tests.network_fixtures import LowFlowFailingBox
 
 log = logging.getLogger("belleflopt.tests")
 
@@ -156,4 +160,136 @@ class TestCrossYearComponent(TestCase):
         self.assertGreater(edge_value, 0)
         self.assertGreater(edge_value2, 0)
         self.assertGreater(edge_value3, 0)
-        # self.assertEqual()
\ No newline at end of file
+        # self.assertEqual()
+
+class TestTimeseriesBenefit(TestCase):
+    """
+        The array kernel used for timeseries needs to give exactly what the day by day single_flow_benefit
+        calculation would, including for windows that wrap around the end of the water year
+    """
+
+    def _check_box(self, bb):
+        flows = numpy.random.RandomState(20200224).uniform(0, 500, (6, 365))
+        for timeseries in flows:
+            expected = [bb.single_flow_benefit(flow, day_of_year=day) for flow, day in zip(timeseries, range(1, 366))]
+            numpy.testing.assert_array_equal(bb.get_benefit_for_timeseries(timeseries), expected)
+
+        # a 2D block of timeseries should give the same results as evaluating each row separately
+        numpy.testing.assert_array_equal(bb.get_benefit_for_timeseries(flows)[3], bb.get_benefit_for_timeseries(flows[3]))
+
+    def test_full_year_component(self):
+        self._check_box(benefit.BenefitBox(low_flow=200, high_flow=400, start_day_of_water_year=0, end_day_of_water_year=365))
+
+    def test_cross_year_component(self):
+        self._check_box(benefit.BenefitBox(low_flow=200, high_flow=400, start_day_of_water_year=200, end_day_of_water_year=50))
+
+    def test_cross_year_component_defined_with_data(self):
+        bb = benefit.BenefitBox(component_name="Dry-season base flow", segment_id="14992951")
+        bb.set_flow_values(decimal.Decimal('48.41'), decimal.Decimal('67.27'), decimal.Decimal('137.94'), decimal.Decimal('177.50'))
+        bb.set_day_values(273, 282, 457, 477)
+        self._check_box(bb)
+
+    def test_square_flow_edges(self):
+        bb = benefit.BenefitBox()
+        bb.set_flow_values(100, 100, 300, 450)
+        bb.set_day_values(40.5, 60.2, 100.7, 130.1)
+        self._check_box(bb)
+
+
+class TestNetworkBenefitTable(TestCase):
+    """
+        Scoring a whole network from the benefit table should match calling each box separately and taking the max
+        across a segment's components, then multiplying by species presence
+    """
+
+    def setUp(self):
+        base_box = benefit.BenefitBox(low_flow=50, high_flow=300, start_day_of_water_year=200, end_day_of_water_year=50)
+        peak_box = benefit.PeakBenefitBox(low_flow=200, high_flow=450, start_day_of_water_year=120, end_day_of_water_year=240)
+        peak_box.setup_peak_flows(peak_frequency=2, median_duration=4, max_benefit=3)
+        recession_box = benefit.RecessionBenefitBox(low_flow=40, high_flow=400, start_day_of_water_year=180, end_day_of_water_year=270)
+        recession_box.setup_recession_benefit(normal_rates=(0.01, 0.05), steep_rates=(0.005, 0.07), fail_rate_of_change=0.3,
+                                              steep_reduction=0.75, very_steep_reduction=0.5, min_time_before_fail=5,
+                                              max_time_before_fail=60)
+
+        self.segment_boxes = [[base_box, peak_box, recession_box], [peak_box], [], [recession_box, base_box]]
+        self.species_presence = [1, 0.5, 1, 0]
+        self.table = benefit.NetworkBenefitTable.from_benefit_boxes(self.segment_boxes, self.species_presence)
+
+    def _expected(self, eflows):
+        totals = []
+        for boxes, flows, presence in zip(self.segment_boxes, eflows, self.species_presence):
+            daily = numpy.zeros((max(len(boxes), 1), 365))
+            for index, box in enumerate(boxes):
+                daily[index] = box.get_benefit_for_timeseries(flows)
+            totals.append(numpy.sum(numpy.max(daily, axis=0)) * presence)
+        return numpy.array(totals)
+
+    def test_matches_individual_boxes(self):
+        eflows = numpy.random.RandomState(20200301).uniform(0, 500, (3, 4, 365))
+        segment_benefits = self.table.get_segment_benefits(eflows)
+        self.assertEqual(segment_benefits.shape, (3, 4))
+        for member in range(3):
+            numpy.testing.assert_allclose(segment_benefits[member], self._expected(eflows[member]), rtol=1e-12)
+            numpy.testing.assert_allclose(self.table.get_benefit(eflows[member]), numpy.sum(self._expected(eflows[member])), rtol=1e-12)
+
+    def test_memo(self):
+        eflows = numpy.random.RandomState(20200303).uniform(0, 500, (4, 4, 365))
+        eflows[2] = eflows[0]  # a survivor that gets evaluated again
+        eflows[3, 1] = eflows[1, 1]  # a segment whose hydrograph didn't change
+        expected = self.table.get_segment_benefits(eflows)
+
+        self.table.use_memo(1024 ** 2)
+        numpy.testing.assert_allclose(self.table.get_segment_benefits(eflows), expected, rtol=1e-12)
+        self.assertEqual(self.table.memo_stats()["entries"], 11)
+        numpy.testing.assert_allclose(self.table.get_segment_benefits(eflows[1:3]), expected[1:3], rtol=1e-12)
+        self.assertEqual(self.table.memo_stats()["hits"], 8)
+
+        # scoring just some of the segments uses the right segments' memos
+        numpy.testing.assert_allclose(self.table.get_segment_benefits(eflows[0, [3, 1]], segments=[3, 1]), expected[0, [3, 1]], rtol=1e-12)
+        self.table.use_memo(None)
+        numpy.testing.assert_allclose(self.table.get_segment_benefits(eflows[0, [3, 1]], segments=[3, 1]), expected[0, [3, 1]], rtol=1e-12)
+
+    def test_chunked_population(self):
+        eflows = numpy.random.RandomState(20200302).uniform(0, 500, (5, 4, 365))
+        unchunked = self.table.get_segment_benefits(eflows)
+        self.table.max_cells_per_chunk = 1  # forces one population member per chunk
+        numpy.testing.assert_array_equal(self.table.get_segment_benefits(eflows), unchunked)
+
+    def test_boxes_that_fail(self):
+        """
+            A box that fails when the table is built still gets a try every evaluation, and only gets skipped when it fails
+        """
+        table = benefit.NetworkBenefitTable.from_benefit_boxes([[LowFlowFailingBox()]], [1])
+        self.assertEqual(table.component_types[0, 0], benefit.NetworkBenefitTable.CUSTOM)
+        numpy.testing.assert_array_equal(table.get_segment_benefits(numpy.stack([numpy.full((1, 365), 200), numpy.full((1, 365), 50)])), [[365], [0]])
+
+    def test_arrays_with_custom_components(self):
+        """
+            Custom components survive to_arrays and from_arrays, and tables without any don't pickle anything
+        """
+        boxes = [list(self.segment_boxes[0]) + [LowFlowFailingBox()]] + self.segment_boxes[1:]
+        table = benefit.NetworkBenefitTable.from_benefit_boxes(boxes, self.species_presence)
+        arrays = table.to_arrays()
+        self.assertTrue(all(isinstance(array, numpy.ndarray) for array in arrays.values()))
+
+        rebuilt = benefit.NetworkBenefitTable.from_arrays(arrays)
+        self.assertEqual(list(rebuilt.custom_components.keys()), [(0, len(self.segment_boxes[0]))])
+        flows = numpy.random.RandomState(20200501).uniform(0, 400, (3, 4, 365))
+        flows[1] *= 0.2  # low enough that the failing box gets skipped for this one
+        numpy.testing.assert_array_equal(rebuilt.get_segment_benefits(flows), table.get_segment_benefits(flows))
+
+        self.assertEqual(benefit.NetworkBenefitTable.from_benefit_boxes(self.segment_boxes, self.species_presence).to_arrays()["custom_components"].size, 0)
+
+    def test_pregenerated_components(self):
+        """
+            With PREGENERATE_COMPONENTS on, boxes with pregenerated surfaces get called directly so they use them
+        """
+        base_box = self.segment_boxes[0][0]
+        base_box._annual_benefit = numpy.zeros((1, 365))  # stands in for the real surface
+        try:
+            with mock.patch.object(benefit, "PREGENERATE_COMPONENTS", True):
+                table = benefit.NetworkBenefitTable.from_benefit_boxes(self.segment_boxes, self.species_presence)
+            self.assertEqual(table.component_types[0, 0], benefit.NetworkBenefitTable.CUSTOM)
+            self.assertEqual(table.component_types[0, 1], benefit.NetworkBenefitTable.PEAK)
+        finally:
+            del base_box._annual_benefit  # back to the class default
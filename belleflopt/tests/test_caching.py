@@ -0,0 +1,111 @@
+import sys
+import unittest
+
+import numpy
+
+from belleflopt import caching
+
+
+class TestHydrographKeys(unittest.TestCase):
+
+	def test_keys(self):
+		hydrographs = numpy.random.RandomState(20200320).uniform(0, 100, (3, 4, 365))
+		keys = caching.hydrograph_keys(hydrographs)
+		self.assertEqual((len(keys), len(keys[0])), (3, 4))
+		self.assertEqual(len(set([key for member in keys for key in member])), 12)
+
+		# the same values always give the same key, no matter where they came from
+		self.assertEqual(caching.hydrograph_keys(hydrographs[1, 2].copy()), keys[1][2])
+
+		changed = hydrographs[1, 2].copy()
+		changed[200] = numpy.nextafter(changed[200], 1000)  # the smallest change we can make
+		self.assertNotEqual(caching.hydrograph_keys(changed), keys[1][2])
+
+
+class TestLRUCache(unittest.TestCase):
+
+	def test_hits_and_misses(self):
+		cache = caching.LRUCache(max_bytes=1024 ** 2)
+		self.assertIsNone(cache.get("a"))
+		cache.put("a", 1.5)
+		self.assertEqual(cache.get("a"), 1.5)
+		self.assertEqual(cache.get("b", 7), 7)
+		self.assertEqual((cache.hits, cache.misses), (1, 2))
+		self.assertAlmostEqual(cache.hit_rate, 1 / 3)
+
+	def test_evicts_least_recently_used(self):
+		entry_size = sys.getsizeof("a") + sys.getsizeof(1.5) + caching._ENTRY_OVERHEAD
+		cache = caching.LRUCache(max_bytes=entry_size * 2)
+		cache.put("a", 1.5)
+		cache.put("b", 2.5)
+		cache.get("a")  # now b is the oldest
+		cache.put("c", 3.5)
+
+		self.assertIn("a", cache)
+		self.assertNotIn("b", cache)
+		self.assertIn("c", cache)
+		self.assertEqual(cache.evictions, 1)
+		self.assertLessEqual(cache.nbytes, cache.max_bytes)
+
+		cache.put("d", numpy.zeros(1000))  # bigger than the whole cache, so it's skipped
+		self.assertNotIn("d", cache)
+		self.assertEqual(len(cache), 2)
+
+
+class TestArrayMemo(unittest.TestCase):
+
+	def test_batch_lookups(self):
+		rows = numpy.random.RandomState(20200321).uniform(0, 100, (3, 365))
+		memo = caching.ArrayMemo(max_bytes=1024 ** 2)
+		high, low = memo.keys_for(rows[[0, 1, 0]], groups=[0, 0, 1])
+		self.assertEqual(len(set(zip(high, low))), 3)  # the same row in another group is a different key
+
+		memo.put(high[:2], low[:2], [1.5, 2.5])
+		values, found = memo.get(*memo.keys_for(rows, groups=0))
+		numpy.testing.assert_array_equal(found, [True, True, False])
+		numpy.testing.assert_array_equal(values[:2], [1.5, 2.5])
+		self.assertTrue(numpy.isnan(values[2]))
+		self.assertEqual((memo.hits, memo.misses), (2, 1))
+
+	def test_evicts_least_recently_used(self):
+		rows = numpy.random.RandomState(20200322).uniform(0, 100, (3, 365))
+		high, low = caching.ArrayMemo.keys_for(rows, groups=0)
+		memo = caching.ArrayMemo(max_bytes=caching.ArrayMemo.entry_bytes * 2)
+		memo.put(high[:2], low[:2], [1.5, 2.5])
+		memo.get(high[:1], low[:1])  # now the second row is the oldest
+		memo.put(high[2:], low[2:], [3.5])
+
+		values, found = memo.get(high, low)
+		numpy.testing.assert_array_equal(found, [True, False, True])
+		numpy.testing.assert_array_equal(values[[0, 2]], [1.5, 3.5])
+		self.assertEqual((len(memo), memo.evictions), (2, 1))
+		self.assertLessEqual(memo.nbytes, memo.max_bytes)
+
+	def test_buffered_puts(self):
+		"""
+			Entries in the buffer should be found before it's merged in, and merging in a full buffer shouldn't lose or
+			mix up any of them
+		"""
+		rows = numpy.random.RandomState(20200323).uniform(0, 100, (3000, 365))
+		high, low = caching.ArrayMemo.keys_for(rows, groups=numpy.arange(3000) % 7)
+		memo = caching.ArrayMemo(max_bytes=caching.ArrayMemo.entry_bytes * 20000)
+		self.assertEqual(memo.buffer_entries, 2500)
+
+		memo.put(high[:1000], low[:1000], numpy.arange(1000.0))
+		self.assertEqual((len(memo._entries[2]), len(memo._buffer[2])), (0, 1000))  # still in the buffer
+		values, found = memo.get(high[:1000], low[:1000])
+		self.assertTrue(found.all())
+		numpy.testing.assert_array_equal(values, numpy.arange(1000.0))
+
+		for start in range(1000, 3000, 500):
+			memo.put(high[start:start + 500], low[start:start + 500], numpy.arange(start, start + 500.0))
+		self.assertEqual(len(memo._buffer[2]), 500)  # merged in once the buffer hit 2500 entries
+		values, found = memo.get(high, low)
+		self.assertTrue(found.all())
+		numpy.testing.assert_array_equal(values, numpy.arange(3000.0))
+		self.assertTrue(numpy.all(numpy.diff(memo._entries[0].astype(float)) >= 0))
+		self.assertEqual((len(memo), memo.evictions), (3000, 0))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,41 @@
+import numpy
+import platypus
+
+from belleflopt import coevolution, optimize
+from belleflopt.tests.network_fixtures import StreamNetworkTestCase
+
+
+class TestCooperativeCoevolution(StreamNetworkTestCase):
+
+	def test_partition_subbasins(self):
+		# 3 and 4 join 2 at 1, and everything joins at 0 - tributaries small enough become sub-basins, the mainstem is left
+		partition = coevolution.partition_subbasins(self.stream_network.router, max_segments=2)
+		self.assertEqual([subbasin.tolist() for subbasin in partition], [[2], [3], [4], [0, 1]])
+		partition = coevolution.partition_subbasins(self.stream_network.router, max_segments=3)
+		self.assertEqual([subbasin.tolist() for subbasin in partition], [[1, 3, 4], [2], [0]])
+		partition = coevolution.partition_subbasins(self.stream_network.router, max_segments=5)
+		self.assertEqual([subbasin.tolist() for subbasin in partition], [[0, 1, 2, 3, 4]])
+
+	def test_cooperative_coevolution(self):
+		"""
+			Sub-basin results get merged into full-network solutions whose objectives are what the problem gives them
+		"""
+		for workers in (1, 2):
+			self.problem.reset()
+			with coevolution.CooperativeCoevolution(self.problem, max_segments=2, workers=workers, popsize=6, subbasin_nfe=12, seed=21) as optimizer:
+				optimizer.run(60)
+				self.assertGreaterEqual(optimizer.nfe, 60)
+				self.assertEqual(self.problem.eflows_nfe, 6 + 6 * optimizer.rounds)  # initial archive, then recombinations
+				result = optimizer.result
+
+			self.assertLessEqual(len(result), 6)
+			self.assertEqual(len(platypus.nondominated(result)), len(result))
+			for solution in result:
+				self.assertTrue(solution.evaluated)
+				check = platypus.Solution(self.problem)
+				check.variables[:] = list(solution.variables)
+				check.evaluate()
+				numpy.testing.assert_allclose(check.objectives[:], solution.objectives[:], rtol=1e-9)
+				self.assertTrue(numpy.all((numpy.array(solution.variables[:]) >= 0) & (numpy.array(solution.variables[:]) <= 1)))
+
+		self.assertRaises(ValueError, coevolution.CooperativeCoevolution, optimize.StreamNetworkProblem(self.stream_network, simplified=True))
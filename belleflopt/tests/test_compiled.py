@@ -0,0 +1,83 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy
+import platypus
+
+from belleflopt import benefit
+from belleflopt import compiled
+from belleflopt import parallel
+from belleflopt.tests.network_fixtures import LowFlowFailingBox, StreamNetworkTestCase
+
+
+class TestCompiledNetwork(StreamNetworkTestCase):
+
+	def test_compiled_network(self):
+		"""
+			A network loaded back from a snapshot should score allocations exactly like the one it was compiled from
+		"""
+		with tempfile.TemporaryDirectory() as folder:
+			snapshot_path = os.path.join(folder, "network.npz")
+			self.stream_network.compile().save(snapshot_path)
+			compiled_network = compiled.CompiledStreamNetwork.load(snapshot_path)
+
+			# and loading it shouldn't need Django at all
+			check = "import sys; from belleflopt import compiled; compiled.load_network({!r}); assert 'django' not in sys.modules".format(snapshot_path)
+			environment = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+			subprocess.run([sys.executable, "-c", check], check=True, env=environment)
+
+		self.assertEqual(compiled_network.comids, list(self.stream_network.stream_segments.keys()))
+		self.assertEqual(compiled_network.water_year, self.model_run.water_year)
+
+		compiled_problem = compiled.CompiledNetworkProblem(compiled_network)
+		self.assertEqual(compiled_problem.nvars, self.problem.nvars)
+		self.assertEqual(compiled_network.economic_benefit_calculator.total_units_needed,
+						self.stream_network.economic_benefit_calculator.total_units_needed)
+
+		for allocation in self.allocations[:2]:
+			self.stream_network.set_segment_allocations(allocation)
+			compiled_network.set_segment_allocations(allocation)
+			self.assertEqual(compiled_network.get_benefits(), self.stream_network.get_benefits())
+
+		solutions = [platypus.Solution(compiled_problem) for _ in self.allocations]
+		for solution, allocation in zip(solutions, self.allocations):
+			solution.variables[:] = list(allocation)
+		compiled_problem.evaluate_batch(solutions)
+		expected = self.stream_network.get_population_benefits(self.allocations)
+		numpy.testing.assert_array_equal([solution.objectives[0] for solution in solutions], expected["environmental_benefit"])
+		numpy.testing.assert_array_equal([solution.objectives[1] for solution in solutions], expected["economic_benefit"])
+
+	def test_snapshot_with_failing_box(self):
+		"""
+			A box that fails when the benefit table is built becomes a custom component, which snapshots and shared
+			memory should carry along so compiled networks still score it like the network they came from
+		"""
+		component_boxes = [[getattr(component, "benefit", None) for component in segment.stream_segment._runtime_components] + [LowFlowFailingBox(threshold=1000)]
+							for segment in self.stream_network.stream_segments.values()]
+		self.stream_network.benefit_table = benefit.NetworkBenefitTable.from_benefit_boxes(component_boxes, self.stream_network.benefit_table.species_presence)
+		self.assertEqual(len(self.stream_network.benefit_table.custom_components), self.stream_network.segment_count)
+		expected = self.stream_network.get_population_benefits(self.allocations)
+
+		with tempfile.TemporaryDirectory() as folder:
+			snapshot_path = os.path.join(folder, "network.npz")
+			self.stream_network.compile().save(snapshot_path)
+			compiled_network = compiled.CompiledStreamNetwork.load(snapshot_path)
+		compiled_network.economic_benefit_calculator = self.stream_network.economic_benefit_calculator
+		self.assertEqual(sorted(compiled_network.benefit_table.custom_components.keys()), sorted(self.stream_network.benefit_table.custom_components.keys()))
+		benefits = compiled_network.get_population_benefits(self.allocations)
+		numpy.testing.assert_array_equal(benefits["environmental_benefit"], expected["environmental_benefit"])
+		numpy.testing.assert_array_equal(benefits["economic_benefit"], expected["economic_benefit"])
+
+		shared_arrays = parallel.SharedNetworkArrays(compiled_network)
+		blocks = []
+		attached_network = parallel.SharedNetworkArrays.attach(shared_arrays.manifest, blocks=blocks)
+		attached_network.economic_benefit_calculator = self.stream_network.economic_benefit_calculator
+		benefits = attached_network.get_population_benefits(self.allocations)
+		numpy.testing.assert_array_equal(benefits["environmental_benefit"], expected["environmental_benefit"])
+
+		del attached_network
+		for block in blocks:
+			block.close()
+		shared_arrays.close()
@@ -0,0 +1,102 @@
+import multiprocessing.connection
+import os
+import tempfile
+import threading
+
+import numpy
+
+from belleflopt import distributed, evaluators
+from belleflopt.tests.network_fixtures import StreamNetworkTestCase
+
+
+class TestDistributedEvaluation(StreamNetworkTestCase):
+
+	def test_distributed_evaluation(self):
+		"""
+			Workers serving over TCP should give exactly what evaluating here does, and the broker should keep going
+			when a worker dies or hangs
+		"""
+		authkey = b"test"
+		expected = self._evaluate_with(evaluators.BatchEvaluator(), self.allocations)
+
+		with tempfile.TemporaryDirectory() as folder:
+			snapshot_path = os.path.join(folder, "network.npz")
+			self.stream_network.compile().save(snapshot_path)
+			processes, addresses = distributed.start_local_workers(snapshot_path, 3, authkey)
+			try:
+				serial_population, serial_objective_1 = self._run_seeded(evaluators.BatchEvaluator())
+				distributed_population, distributed_objective_1 = self._run_seeded(distributed.BrokerEvaluator(addresses, authkey))
+				numpy.testing.assert_allclose(distributed_population, serial_population, rtol=1e-12)
+				numpy.testing.assert_allclose(distributed_objective_1, serial_objective_1, rtol=1e-12)
+
+				# a worker that dies between batches has its work picked up by the others
+				with distributed.BrokerEvaluator(addresses, authkey, chunks_per_worker=1) as broker:
+					numpy.testing.assert_allclose(self._evaluate_with(broker, self.allocations), expected, rtol=1e-12)
+					processes[0].terminate()
+					processes[0].join()
+					numpy.testing.assert_allclose(self._evaluate_with(broker, self.allocations), expected, rtol=1e-12)
+					stats = broker.stats()
+				self.assertEqual(stats["{}:{}".format(*addresses[0])]["failures"], 1)
+				self.assertEqual(stats["resubmitted_chunks"], 1)
+				self.assertEqual(sum([stats["{}:{}".format(*address)]["solutions"] for address in addresses]), 2 * len(self.allocations))
+
+				# and so does one that stops responding
+				hung_listener = multiprocessing.connection.Listener(("localhost", 0), authkey=authkey)
+
+				def hang():
+					connection = hung_listener.accept()
+					try:
+						while True:
+							if connection.recv()[0] == "setup":
+								connection.send(("ready", ))
+					except (EOFError, OSError):
+						pass
+
+				threading.Thread(target=hang, daemon=True).start()
+				with distributed.BrokerEvaluator([hung_listener.address, addresses[1]], authkey, chunks_per_worker=1, heartbeat_interval=0.05, heartbeat_timeout=0.5) as broker:
+					numpy.testing.assert_allclose(self._evaluate_with(broker, self.allocations), expected, rtol=1e-12)
+					stats = broker.stats()
+				self.assertEqual(stats["{}:{}".format(*hung_listener.address)]["failures"], 1)
+				self.assertEqual(stats["{}:{}".format(*addresses[1])]["solutions"], len(self.allocations))
+
+				# a worker that fails a chunk stops the batch, and workers still on other chunks get disconnected
+				failing_listener = multiprocessing.connection.Listener(("localhost", 0), authkey=authkey)
+
+				def fail():
+					connection = failing_listener.accept()
+					try:
+						while True:
+							message = connection.recv()
+							connection.send(("ready", ) if message[0] == "setup" else ("error", message[1], "broken"))
+					except (EOFError, OSError):
+						pass
+
+				threading.Thread(target=fail, daemon=True).start()
+				threading.Thread(target=hang, daemon=True).start()  # the last broker's connection to it is gone
+				with distributed.BrokerEvaluator([hung_listener.address, failing_listener.address], authkey, chunks_per_worker=1) as broker:
+					self.assertRaises(RuntimeError, self._evaluate_with, broker, self.allocations)
+					self.assertEqual([(worker.connection, worker.chunk) for worker in broker.workers], [(None, None), (broker.workers[1].connection, None)])
+					self.assertIsNotNone(broker.workers[1].connection)
+					self.assertEqual(broker.resubmitted_chunks, 0)
+				hung_listener.close()
+				failing_listener.close()
+			finally:
+				for process in processes:
+					process.terminate()
+
+	def test_distributed_snapshot_mismatch(self):
+		"""
+			Workers shouldn't evaluate for a broker whose network isn't the one in their snapshot
+		"""
+		authkey = b"test"
+		with tempfile.TemporaryDirectory() as folder:
+			snapshot_path = os.path.join(folder, "network.npz")
+			other_run = self.stream_network.compile()
+			other_run.model_run_name = "another model run"
+			other_run.save(snapshot_path)
+
+			worker = distributed.EvaluationWorker(snapshot_path, authkey=authkey)
+			threading.Thread(target=worker.serve_forever, daemon=True).start()
+			with distributed.BrokerEvaluator([worker.address], authkey) as broker:
+				with self.assertRaisesRegex(RuntimeError, "model_run_name"):
+					self._evaluate_with(broker, self.allocations)
@@ -0,0 +1,53 @@
+import numpy
+
+from django.test import TestCase
+
+from belleflopt import economic_components
+
+
+def _summed_cost(demand_curve, units):
+	"""
+		The original way of getting cumulative cost - price every whole unit and add them up
+	"""
+	return sum([float(demand_curve.price(unit)) for unit in range(1, int(units) + 1)])
+
+
+class TestDemandCurves(TestCase):
+	totals = (0, -5, 0.7, 1, 99.9, 100, 101, 1999.2, 2000, 4500.5, 5000, 6000, 12345)
+
+	def _check_curve(self, demand_curve):
+		for units in self.totals:
+			self.assertAlmostEqual(float(demand_curve.cumulative_cost(units)), _summed_cost(demand_curve, units), delta=1e-9 * max(1, abs(_summed_cost(demand_curve, units))))
+
+		# a whole population's worth of totals at once
+		expected = [_summed_cost(demand_curve, units) for units in self.totals]
+		numpy.testing.assert_allclose(demand_curve.cumulative_cost(numpy.array(self.totals)), expected, rtol=1e-9)
+
+	def test_linear(self):
+		self._check_curve(economic_components.LinearDemandCurve(800, 5000))
+		self._check_curve(economic_components.LinearDemandCurve(800, 1234.5))
+
+	def test_piecewise(self):
+		self._check_curve(economic_components.PiecewiseLinearDemandCurve([0, 100.5, 2000, 5000], [900, 700, 100, 0]))
+		self._check_curve(economic_components.PiecewiseLinearDemandCurve([300, 2000], [500, 50]))  # flat on both ends
+		self.assertRaises(ValueError, economic_components.PiecewiseLinearDemandCurve, [0, 100, 50], [3, 2, 1])
+
+	def test_exponential(self):
+		self._check_curve(economic_components.ExponentialDemandCurve(800, 3000))
+
+	def test_economic_benefit_matches_original_sum(self):
+		economic_benefit = economic_components.EconomicBenefit(800, 1000)
+		economic_benefit.units_of_water = 1500.4
+		original = sum([max(-(800 / 1000) * unit + 800, 0) for unit in range(1, 1501)])
+		self.assertEqual(economic_benefit.get_benefit(), original)
+		numpy.testing.assert_allclose(economic_benefit.get_benefits([1500.4, 10]), [original, _summed_cost(economic_benefit.demand_curve, 10)])
+
+		economic_benefit = economic_components.EconomicBenefit(800, 1000, demand_curve=economic_components.ExponentialDemandCurve)
+		self.assertIsInstance(economic_benefit.demand_curve, economic_components.ExponentialDemandCurve)
+
+	def test_demand_curves_need_price_and_cost(self):
+		class PriceOnly(economic_components.DemandCurve):
+			def price(self, nth_unit):
+				return numpy.zeros_like(nth_unit)
+
+		self.assertRaises(TypeError, PriceOnly)
@@ -0,0 +1,212 @@
+import unittest
+
+import numpy
+import platypus
+
+from belleflopt import encodings, evaluators, optimize
+from belleflopt.tests.network_fixtures import StreamNetworkTestCase
+
+
+class TestTemporalEncoding(unittest.TestCase):
+
+	def test_bases(self):
+		"""
+			Every day should be a weighted average of its segment's variables, so allocations stay in bounds
+		"""
+		for name, variables in (("weekly", 52), ("monthly", 12), ("bspline", 12), ("bspline:24", 24), ("bspline:2", 2)):
+			encoding = encodings.get_encoding(name)
+			self.assertEqual(encoding.basis.shape, (variables, 365))
+			self.assertTrue(numpy.all(encoding.basis >= 0))
+			numpy.testing.assert_allclose(encoding.basis.sum(axis=0), 1)
+
+		self.assertRaises(ValueError, encodings.get_encoding, "fortnightly")
+		self.assertRaises(ValueError, encodings.get_encoding, "monthly:6")
+
+	def test_monthly(self):
+		encoding = encodings.TemporalEncoding("monthly")
+		daily = encoding.expand(numpy.arange(24, dtype=float)).reshape(2, 365)
+		self.assertEqual(daily[0, 0], 0)
+		self.assertEqual(daily[0, 30], 0)
+		self.assertEqual(daily[0, 31], 1)  # November 1st
+		self.assertEqual(daily[0, 364], 11)
+		self.assertEqual(daily[1, 0], 12)  # the second segment's variables
+
+	def test_expand_batch(self):
+		encoding = encodings.TemporalEncoding("bspline", control_points=8)
+		variables = numpy.random.RandomState(3).uniform(0.2, 1, (4, 3 * 8))
+		daily = encoding.expand(variables)
+		self.assertEqual(daily.shape, (4, 3 * 365))
+		for solution_variables, solution_daily in zip(variables, daily):
+			numpy.testing.assert_allclose(encoding.expand(solution_variables), solution_daily)
+		self.assertTrue(numpy.all((daily >= 0.2) & (daily <= 1)))
+
+		# constant control points make a constant curve, and it's smooth in between
+		numpy.testing.assert_allclose(encoding.expand(numpy.full(8, 0.7)), 0.7)
+		self.assertLess(numpy.max(numpy.abs(numpy.diff(daily[0].reshape(3, 365), axis=1))), 0.05)
+
+
+
+class TestComponentWindowEncoding(unittest.TestCase):
+
+	def test_window_basis(self):
+		windows = numpy.zeros((3, 365), dtype=bool)
+		windows[0, 10:20] = True
+		windows[1, 15:30] = True
+		windows[2, 299:360] = True
+		basis = encodings.window_basis(windows)
+		numpy.testing.assert_allclose(basis.sum(axis=0), 1)
+
+		numpy.testing.assert_array_equal(basis[:, 12], [1, 0, 0])  # inside one window
+		numpy.testing.assert_array_equal(basis[:, 17], [0.5, 0.5, 0])  # overlapping windows share the day
+		numpy.testing.assert_allclose(basis[:, 164], [0, 0.5, 0.5])  # halfway between day 29 and day 299
+		self.assertGreater(basis[2, 362], basis[0, 362])  # the ramp wraps around the end of the year to day 10
+		self.assertGreater(basis[0, 5], basis[2, 5])
+
+		# no windows at all falls back to one variable for the whole year
+		numpy.testing.assert_array_equal(encodings.window_basis(numpy.zeros((2, 365), dtype=bool))[0], 1)
+
+	def test_expand(self):
+		windows = numpy.zeros((2, 2, 365), dtype=bool)
+		windows[0, 0, :100] = windows[0, 1, 100:] = True
+		windows[1, 0, 50:60] = True  # only one window on the second segment
+		encoding = encodings.ComponentWindowEncoding(windows)
+		self.assertEqual(encoding.decision_variables(2), 4)
+		self.assertRaises(ValueError, encoding.decision_variables, 1)
+
+		daily = encoding.expand(numpy.array([[0.2, 0.8, 0.5, 0.9], [1, 1, 1, 1]])).reshape(2, 2, 365)
+		numpy.testing.assert_allclose(daily[0, 0, :100], 0.2)
+		numpy.testing.assert_allclose(daily[0, 0, 100:], 0.8)
+		numpy.testing.assert_allclose(daily[0, 1], 0.5)  # the unused variable doesn't matter
+		numpy.testing.assert_allclose(daily[1], 1)
+
+
+
+class TestSensitiveDayEncoding(unittest.TestCase):
+
+	def test_runs(self):
+		sensitive = numpy.zeros((2, 365), dtype=bool)
+		sensitive[0, 10:20] = True
+		sensitive[0, 100:200] = True  # so insensitive runs are 0-9 with 200-364 across the new year, and 20-99
+		encoding = encodings.SensitiveDayEncoding(sensitive)
+		self.assertEqual(encoding.decision_variables(2), 110 + 2 + 1)  # the second segment is one run
+		self.assertRaises(ValueError, encoding.decision_variables, 1)
+
+		variables = numpy.arange(encoding.variable_count, dtype=float)
+		daily = encoding.expand(variables).reshape(2, 365)
+		numpy.testing.assert_array_equal(daily[0, 10:20], numpy.arange(10))
+		numpy.testing.assert_array_equal(daily[0, 100:200], numpy.arange(10, 110))
+		self.assertEqual(daily[0, 0], daily[0, 364])
+		self.assertEqual(len(set(daily[0, 20:100])), 1)
+		self.assertNotEqual(daily[0, 0], daily[0, 50])
+		numpy.testing.assert_array_equal(daily[1], encoding.variable_count - 1)
+
+		batch = encoding.expand(numpy.stack([variables, variables + 1]))
+		numpy.testing.assert_array_equal(batch[1] - batch[0], 1)
+
+	def test_fixed(self):
+		sensitive = numpy.zeros((1, 365), dtype=bool)
+		sensitive[0, 50:60] = True
+		encoding = encodings.SensitiveDayEncoding(sensitive, fixed_value=0.25)
+		self.assertEqual(encoding.variable_count, 10)
+		daily = encoding.expand(numpy.ones((3, 10)))
+		self.assertEqual(daily.shape, (3, 365))
+		numpy.testing.assert_array_equal(daily[:, 50:60], 1)
+		numpy.testing.assert_array_equal(daily[:, :50], 0.25)
+
+		with self.assertRaises(ValueError):  # not a proportion
+			encodings.SensitiveDayEncoding(sensitive, fixed_value=1.5)
+		with self.assertRaises(ValueError):  # below the problem's min_proportion
+			encoding.check_bounds(0.5, 1)
+
+
+class TestNetworkEncodings(StreamNetworkTestCase):
+
+	def test_encoding(self):
+		"""
+			Encoded solutions should score the same as the daily allocations they expand to
+		"""
+		encoded_problem = optimize.StreamNetworkProblem(self.stream_network, encoding="monthly")
+		self.assertEqual(encoded_problem.nvars, 5 * 12)
+		variables = numpy.random.RandomState(4).uniform(0, 1, (3, encoded_problem.nvars))
+		daily = encoded_problem.daily_allocations(variables)
+
+		encoded = [platypus.Solution(encoded_problem) for _ in variables]
+		expanded = [platypus.Solution(self.problem) for _ in variables]
+		for solution, encoded_variables in zip(encoded, variables):
+			solution.variables[:] = encoded_variables.tolist()
+		evaluators.BatchEvaluator().evaluate_all([platypus.core.EvaluateSolution(solution) for solution in encoded])
+		for solution, daily_variables in zip(expanded, daily):
+			solution.variables[:] = daily_variables.tolist()
+			solution.evaluate()
+		for encoded_solution, expanded_solution in zip(encoded, expanded):
+			numpy.testing.assert_allclose(encoded_solution.objectives[:], expanded_solution.objectives[:], rtol=1e-9)
+
+		simplified = optimize.StreamNetworkProblem(self.stream_network, simplified=True, encoding="bspline:6")
+		self.assertEqual(simplified.nvars, 6)
+		algorithm = platypus.NSGAII(simplified, generator=optimize.InitialFlowsGenerator(), population_size=6)
+		algorithm.run(12)
+		self.assertTrue(all([solution.evaluated for solution in algorithm.result]))
+
+	def test_component_encoding(self):
+		problem = optimize.StreamNetworkProblem(self.stream_network, encoding="components")
+		table = self.stream_network.benefit_table
+		self.assertEqual(problem.nvars, 5 * table.component_count)
+
+		# each component's variable sets the allocation on the days it's scored on, when it's the only one there
+		variables = numpy.random.RandomState(5).uniform(0, 1, problem.nvars)
+		daily = problem.daily_allocations(variables).reshape(5, 365)
+		windows = table.day_benefit > 0
+		only_window = windows & (windows.sum(axis=1, keepdims=True) == 1)
+		segments, components, days = numpy.nonzero(only_window)
+		self.assertGreater(segments.size, 0)
+		numpy.testing.assert_allclose(daily[segments, days], variables.reshape(5, -1)[segments, components])
+
+		algorithm = platypus.NSGAII(problem, generator=optimize.InitialFlowsGenerator(), population_size=6,
+									evaluator=evaluators.BatchEvaluator())
+		algorithm.run(12)
+		self.assertTrue(all([solution.evaluated for solution in algorithm.result]))
+
+		self.assertRaises(ValueError, optimize.StreamNetworkProblem, self.stream_network, simplified=True, encoding="components")
+
+	def test_masked_encoding(self):
+		"""
+			Days the masked encoding collapses really shouldn't change environmental benefit, and masked solutions
+			should score the same as the daily allocations they expand to
+		"""
+		sensitive = encodings.sensitive_days(self.stream_network.benefit_table, self.stream_network.router)
+		self.assertTrue(numpy.any(sensitive))
+		self.assertFalse(numpy.all(sensitive))
+		numpy.testing.assert_array_equal(self.stream_network.router.propagate_upstream(sensitive), sensitive)
+
+		self.stream_network.set_segment_allocations(self.allocations[0])
+		environmental_benefit = self.stream_network.get_benefits()["environmental_benefit"]
+		changed = self.allocations[0].reshape(5, 365).copy()
+		changed[~sensitive] = numpy.random.RandomState(6).uniform(0, 1, numpy.count_nonzero(~sensitive))
+		self.stream_network.set_segment_allocations(changed.reshape(-1))
+		self.assertAlmostEqual(self.stream_network.get_benefits()["environmental_benefit"], environmental_benefit, places=9)
+
+		problem = optimize.StreamNetworkProblem(self.stream_network, encoding="masked")
+		self.assertLess(problem.nvars, self.problem.nvars)
+		self.assertGreater(problem.nvars, numpy.count_nonzero(sensitive))  # plus a shared variable per insensitive run
+		variables = numpy.random.RandomState(7).uniform(0, 1, problem.nvars)
+		daily = problem.daily_allocations(variables).reshape(5, 365)
+		self.assertEqual(len(set(daily[sensitive].tolist())), numpy.count_nonzero(sensitive))  # each sensitive day has its own variable
+
+		solution = platypus.Solution(problem)
+		solution.variables[:] = variables.tolist()
+		solution.evaluate()
+		self.problem.reset()
+		expanded = platypus.Solution(self.problem)
+		expanded.variables[:] = daily.reshape(-1).tolist()
+		expanded.evaluate()
+		numpy.testing.assert_allclose(solution.objectives[:], expanded.objectives[:], rtol=1e-12)
+
+		fixed = optimize.StreamNetworkProblem(self.stream_network, encoding="masked:0")
+		self.assertEqual(fixed.nvars, numpy.count_nonzero(sensitive))
+		numpy.testing.assert_array_equal(fixed.daily_allocations(numpy.ones(fixed.nvars)).reshape(5, 365), sensitive)
+		with self.assertRaises(ValueError):
+			optimize.StreamNetworkProblem(self.stream_network, encoding="masked:0", min_proportion=0.1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,62 @@
+import queue
+import threading
+
+import numpy
+import platypus
+
+from belleflopt import islands, parallel
+from belleflopt.tests.network_fixtures import StreamNetworkTestCase
+
+
+class TestIslandModel(StreamNetworkTestCase):
+
+	def test_island_model(self):
+		"""
+			Mixed islands should exchange migrants, keep their populations between runs, and leave a global archive of
+			solutions whose objectives are what the problem gives them
+		"""
+		with islands.IslandModel(self.problem, islands=3, algorithms=(platypus.NSGAII, platypus.SPEA2, platypus.GDE3),
+									migration_interval=1, migrants=2, popsize=6, seed=22) as island_model:
+			island_model.run(36)
+			first_nfe = island_model.nfe
+			island_model.run(36)
+			result = island_model.result
+
+		self.assertGreaterEqual(first_nfe, 36)
+		self.assertGreaterEqual(island_model.nfe, first_nfe + 36)
+		self.assertEqual(self.problem.eflows_nfe, island_model.nfe)  # the islands' evaluations end up in our tracking
+		self.assertEqual(len(self.problem.objective_1), island_model.nfe)
+		self.assertGreater(island_model.migrations, 0)
+
+		self.assertEqual(len(platypus.nondominated(result)), len(result))
+		for solution in result:
+			check = platypus.Solution(self.problem)
+			check.variables[:] = list(solution.variables)
+			check.evaluate()
+			numpy.testing.assert_allclose(check.objectives[:], solution.objectives[:], rtol=1e-9)
+
+		self.assertRaises(ValueError, islands.IslandModel, self.problem, algorithms=(platypus.OMOPSO, ))
+
+	def test_migrants_before_first_step(self):
+		"""
+			Migrants that reach an island before it has a population should still get taken in once it has one
+		"""
+		shared_arrays = parallel.SharedNetworkArrays(self.stream_network.compile())
+		config = {"manifest": shared_arrays.manifest, "economic_benefit_calculator": self.stream_network.economic_benefit_calculator,
+					"collapse_reaches": False, "problem_args": {}, "algorithm": platypus.NSGAII, "algorithm_args": {},
+					"operators": None, "popsize": 6, "migration_interval": 100, "migrants": 2, "seed": 23}
+		inbox, results = queue.Queue(), queue.Queue()
+		migrant = self.allocations[:1]
+		inbox.put(("migrants", migrant, numpy.array([[1e12, 1e12]])))  # better than anything the island can find
+		inbox.put(("run", 12))
+		island = threading.Thread(target=islands._run_island, args=(0, config, inbox, [], results))
+		island.start()
+		try:
+			message = results.get(timeout=60)
+		finally:
+			inbox.put(("stop", ))
+			island.join(timeout=60)
+			shared_arrays.close()
+
+		self.assertEqual(message[0], "done", msg=message[-1])
+		numpy.testing.assert_array_equal(message[3], migrant)  # it took over the island's whole front
@@ -0,0 +1,43 @@
+import numpy
+
+from belleflopt import evaluators, parallel
+from belleflopt.tests.network_fixtures import StreamNetworkTestCase
+
+
+class TestParallelEvaluation(StreamNetworkTestCase):
+
+	def test_parallel_evaluation(self):
+		"""
+			Running with worker processes should give exactly what running in this process does for the same seed
+		"""
+		serial_population, serial_objective_1 = self._run_seeded(evaluators.BatchEvaluator())
+		for use_shared_memory in (True, False):
+			with parallel.ParallelNetworkEvaluator(workers=2, use_shared_memory=use_shared_memory) as evaluator:
+				parallel_population, parallel_objective_1 = self._run_seeded(evaluator)
+
+			numpy.testing.assert_allclose(parallel_population, serial_population, rtol=1e-12)
+			numpy.testing.assert_allclose(parallel_objective_1, serial_objective_1, rtol=1e-12)
+			self.assertEqual(self.problem.eflows_nfe, 18)
+
+	def test_shared_network_arrays(self):
+		compiled_network = self.stream_network.compile()
+		compiled_network.economic_benefit_calculator = self.stream_network.economic_benefit_calculator
+		shared_arrays = parallel.SharedNetworkArrays(compiled_network)
+
+		blocks = []
+		attached_network = parallel.SharedNetworkArrays.attach(shared_arrays.manifest, blocks=blocks)
+		attached_network.economic_benefit_calculator = self.stream_network.economic_benefit_calculator
+		self.assertFalse(attached_network.local_flows.flags.writeable)
+
+		expected = compiled_network.get_population_benefits(self.allocations)
+		benefits = attached_network.get_population_benefits(self.allocations)
+		numpy.testing.assert_array_equal(benefits["environmental_benefit"], expected["environmental_benefit"])
+		numpy.testing.assert_array_equal(benefits["economic_benefit"], expected["economic_benefit"])
+
+		# once the owner closes it, the shared memory is gone
+		del attached_network, benefits
+		for block in blocks:
+			block.close()
+		shared_arrays.close()
+		shared_arrays.close()  # and closing again is fine
+		self.assertRaises(FileNotFoundError, parallel.SharedNetworkArrays.attach, shared_arrays.manifest, [])
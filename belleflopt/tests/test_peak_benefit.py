@@ -1,5 +1,6 @@
 from django.test import TestCase
 
+import numpy
 import seaborn
 import pandas
 from matplotlib import pyplot as plt
@@ -7,6 +8,32 @@ from matplotlib import pyplot as plt
 from belleflopt import benefit, models, load
 
 
+def _daily_peak_benefit(peak_box, original_base_benefit):
+	"""
+		The original day by day implementation of peak benefit - kept here so we can confirm the batched version
+		tracks events the same way
+	"""
+	days_in_peak = 0
+	current_max_benefit = float(peak_box.max_benefit)
+	max_event_base_benefit = 0
+	base_daily_benefit = [0, ] * 365
+	for day, benefit in enumerate(original_base_benefit):
+		if benefit > 0:
+			if current_max_benefit <= 1:
+				base_daily_benefit[day] = peak_box.minimum_max_benefit
+			else:
+				base_daily_benefit[day] = peak_box._get_peak_benefit(benefit, days_in_peak, current_max_benefit)
+			days_in_peak += 1
+			max_event_base_benefit = max(max_event_base_benefit, benefit)
+		elif days_in_peak > 0:
+			current_max_benefit -= float(peak_box.peak_interevent_decay_factor) * max_event_base_benefit
+			current_max_benefit = max(peak_box.minimum_max_benefit, current_max_benefit)
+			max_event_base_benefit = 0
+			days_in_peak = 0
+
+	return base_daily_benefit
+
+
 class TestPeakBenefit(TestCase):
 	def setUp(self):
 		self.goodyears_bar = 8058513
@@ -110,6 +137,34 @@ class TestPeakBenefit(TestCase):
 			plt.savefig(save_path)
 		plt.show()
 
+	def _check_against_daily(self, peak_box):
+		original_benefit, peak_benefit = peak_box.get_benefit_for_timeseries(self.goodyears_bar_flows, testing=True)
+		numpy.testing.assert_allclose(peak_benefit, _daily_peak_benefit(peak_box, original_benefit), rtol=1e-12)
+
+		# many hydrographs at once, one per row, should match evaluating them one at a time
+		hydrographs = numpy.array([self.goodyears_bar_flows, ]) * numpy.array([[0.25], [0.5], [1], [1.5], [3]])
+		batch_benefit = peak_box.get_benefit_for_timeseries(hydrographs)
+		for row, hydrograph in enumerate(hydrographs):
+			numpy.testing.assert_allclose(batch_benefit[row], _daily_peak_benefit(peak_box, peak_box.base_benefit_for_timeseries(hydrograph)), rtol=1e-12)
+
+	def test_batched_events_match_daily(self):
+		peak_box = benefit.PeakBenefitBox(low_flow=2000,
+											high_flow=6000,
+											start_day_of_water_year=120,
+											end_day_of_water_year=240,
+											flow_margin=0.1)
+		peak_box.setup_peak_flows(peak_frequency=15, median_duration=50, max_benefit=10)
+		self._check_against_daily(peak_box)
+
+		# frequent events that decay max benefit to the minimum partway through the season
+		peak_box.setup_peak_flows(peak_frequency=2, median_duration=4, max_benefit=3, minimum_max_benefit=0.5)
+		self._check_against_daily(peak_box)
+
+		segment_component = models.SegmentComponent.objects.get(component__ceff_id="Peak",
+																stream_segment__com_id=self.goodyears_bar)
+		segment_component.make_benefit()
+		self._check_against_daily(segment_component.benefit)
+
 	def test_segment_data(self):
 		segment_component = models.SegmentComponent.objects.get(component__ceff_id="Peak",
 		                                                        stream_segment__com_id=self.goodyears_bar)
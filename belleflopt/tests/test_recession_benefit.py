@@ -2,6 +2,7 @@ import logging
 
 from django.test import TestCase
 
+import numpy
 import seaborn
 import pandas
 from matplotlib import pyplot as plt
@@ -10,6 +11,38 @@ from belleflopt import benefit, models, load
 
 log = logging.getLogger('belleflopt.tests.recession')
 
+
+def _daily_recession_benefit(recession_box, timeseries, original_base_benefit):
+	"""
+		The original day by day implementation of recession benefit - kept here so we can confirm the batched version
+		counts time in recession and fails recessions the same way
+	"""
+	final_benefit = [0, ] * 365
+	final_benefit[0] = original_base_benefit[0]
+	time_in_recession = 0
+	for day, benefit in enumerate(original_base_benefit[1:]):
+		if benefit == 0:
+			continue
+
+		rate_of_drop = float(timeseries[day] - timeseries[day + 1]) / timeseries[day]
+		if rate_of_drop > recession_box.fail_rate_of_change:
+			if recession_box.min_time_before_fail < time_in_recession < recession_box.max_time_before_fail:
+				return [0, ] * 365, time_in_recession
+			time_in_recession = 0
+			continue
+		elif rate_of_drop < recession_box.very_steep_reduction:
+			final_benefit[day + 1] = benefit
+		elif rate_of_drop < recession_box.steep_rates[1]:
+			final_benefit[day + 1] = benefit * recession_box.steep_reduction
+		elif rate_of_drop < 0:
+			time_in_recession = 0
+			continue
+
+		time_in_recession += 1
+
+	return final_benefit, time_in_recession
+
+
 class TestRecessionBenefit(TestCase):
 	def setUp(self):
 		self.goodyears_bar = 8058513
@@ -91,6 +124,36 @@ class TestRecessionBenefit(TestCase):
 			plt.savefig(save_path)
 		plt.show()
 
+	def test_batched_recession_matches_daily(self):
+		segment_component = models.SegmentComponent.objects.get(component__ceff_id="SP",
+		                                                        stream_segment__com_id=self.goodyears_bar)
+		segment_component.make_benefit()
+		recession_box = segment_component.benefit
+
+		# a smooth recession through the window, then copies that drop too fast at different points in the recession -
+		# early drops just reset the counter, drops between the min and max time zero out the whole year
+		days = numpy.arange(365)
+		smooth = 6000 * 0.97 ** numpy.clip(days - 200, 0, None)
+		hydrographs = [self.goodyears_bar_flows, smooth]
+		for drop_day in (205, 220, 235, 260):
+			dropped = smooth.copy()
+			dropped[drop_day:] *= 0.5
+			hydrographs.append(dropped)
+		hydrographs = numpy.array(hydrographs, dtype=float)
+
+		base_benefit, batch_benefit, batch_time = recession_box.get_benefit_for_timeseries(hydrographs, testing=True)
+		for row, hydrograph in enumerate(hydrographs):
+			expected_benefit, expected_time = _daily_recession_benefit(recession_box, hydrograph, base_benefit[row])
+			numpy.testing.assert_array_equal(batch_benefit[row], expected_benefit)
+			self.assertEqual(batch_time[row], expected_time)
+
+			# and one at a time still works the same way
+			single_benefit = recession_box.get_benefit_for_timeseries(hydrograph)
+			numpy.testing.assert_array_equal(single_benefit, expected_benefit)
+
+		self.assertTrue(batch_benefit[3].any())  # dropping early in the recession doesn't fail it
+		self.assertFalse(batch_benefit[4].any())  # but dropping in the middle does
+
 	def test_segment_data(self):
 		segment_component = models.SegmentComponent.objects.get(component__ceff_id="SP",
 		                                                        stream_segment__com_id=self.goodyears_bar)
@@ -0,0 +1,96 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+
+import numpy
+import platypus
+
+from belleflopt import array_solutions, evaluators, optimize, results, support
+from belleflopt.tests.network_fixtures import StreamNetworkTestCase
+
+
+class TestResultStore(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.folder.name, "store")
+		random_state = numpy.random.RandomState(25)
+		self.checkpoints = [(100, random_state.uniform(0, 1, (4, 3 * 365)), random_state.uniform(0, 1000, (4, 2))),
+							(200, random_state.uniform(0, 1, (6, 3 * 365)), random_state.uniform(0, 1000, (6, 2)))]
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def _write(self, compress=False):
+		store = results.ResultStore.create(self.path, comids=[900000, 900001, 900002], compress=compress, algorithm="NSGAII", seed=1)
+		for nfe, allocations, objectives in self.checkpoints:
+			store.append_checkpoint(nfe, allocations, objectives)
+		return store
+
+	def test_append_and_read(self):
+		self._write()
+		store = results.ResultStore(self.path)  # reopened, like in a later analysis session
+		self.assertEqual(store.checkpoints, [100, 200])
+		self.assertEqual(store.metadata["algorithm"], "NSGAII")
+		self.assertEqual(store.comids, ["900000", "900001", "900002"])
+
+		for nfe, allocations, objectives in self.checkpoints:
+			variables = store.variables(nfe)
+			self.assertIsInstance(variables, numpy.memmap)
+			self.assertEqual(variables.dtype, numpy.float32)
+			numpy.testing.assert_array_equal(variables, allocations.astype(numpy.float32).reshape(-1, 3, 365))
+			numpy.testing.assert_array_equal(store.objectives(nfe), objectives)  # exactly, not just to float32
+
+		numpy.testing.assert_array_equal(store.segment_variables("900001"), self.checkpoints[1][1].astype(numpy.float32)[:, 365:730])
+		numpy.testing.assert_array_equal(store.objectives(), self.checkpoints[1][2])  # the latest by default
+		every_checkpoint = store.objectives("all")
+		numpy.testing.assert_array_equal(every_checkpoint["nfe"], [100] * 4 + [200] * 6)
+		numpy.testing.assert_array_equal(every_checkpoint["environmental_benefit"], numpy.concatenate([self.checkpoints[0][2][:, 0], self.checkpoints[1][2][:, 0]]))
+
+		self.assertRaises(ValueError, store.append_checkpoint, 200, *self.checkpoints[1][1:])
+		self.assertRaises(KeyError, store.variables, 300)
+
+		# creating a new store in the same place starts over
+		store = results.ResultStore.create(self.path, comids=["all"])
+		self.assertEqual(store.checkpoints, [])
+		self.assertEqual(sorted(os.listdir(self.path)), ["metadata.json", "objectives.csv"])
+		self.assertRaises(KeyError, store.objectives)
+
+	def test_compressed(self):
+		self._write(compress=True)
+		store = results.ResultStore(self.path)
+		variables = store.variables(100)
+		self.assertNotIsInstance(variables, numpy.memmap)
+		numpy.testing.assert_array_equal(variables, self.checkpoints[0][1].astype(numpy.float32).reshape(-1, 3, 365))
+		with open(os.path.join(self.path, "metadata.json"), 'r') as metadata_file:
+			self.assertEqual(json.load(metadata_file)["checkpoints"][1]["file"], "variables_nfe200.npz")
+
+
+class TestWriteResults(StreamNetworkTestCase):
+
+	def test_write_results(self):
+		"""
+			Checkpoints in the result store should hold the nondominated solutions' daily allocations, even for
+			encoded problems
+		"""
+		problem = optimize.StreamNetworkProblem(self.stream_network, encoding="monthly")
+		random.seed(20200325)
+		algorithm = platypus.NSGAII(problem, generator=optimize.InitialFlowsGenerator(), population_size=6, evaluator=evaluators.BatchEvaluator())
+
+		with tempfile.TemporaryDirectory() as folder:
+			store = support.create_result_store(os.path.join(folder, "results"), problem, platypus.NSGAII, 20200325, 6, self.model_run.name)
+			for nfe in (12, 24):
+				algorithm.run(12)
+				support.write_results(algorithm, problem, store, nfe)
+
+			store = results.ResultStore(os.path.join(folder, "results"))
+			self.assertEqual(store.checkpoints, [12, 24])
+			self.assertEqual(store.metadata["encoding"], "monthly")
+			self.assertEqual(store.comids, list(self.stream_network.stream_segments.keys()))
+
+			front = platypus.nondominated(algorithm.result)
+			self.assertEqual(store.variables().shape, (len(front), 5, 365))
+			numpy.testing.assert_allclose(store.variables(), problem.daily_allocations(array_solutions.stack_variables(front, dtype=float)).reshape(-1, 5, 365), rtol=1e-6)
+			numpy.testing.assert_array_equal(store.objectives(), [solution.objectives[:] for solution in front])
@@ -0,0 +1,93 @@
+import numpy
+
+from django.test import TestCase
+
+from belleflopt import routing
+
+
+class TestNetworkRouter(TestCase):
+	"""
+		Small network, listed out of order on purpose so that routing can't just go by index:
+
+			3   4
+			 \\ /
+			  1   2
+			   \\ /
+			    0
+	"""
+
+	def setUp(self):
+		self.downstream = [-1, 0, 0, 1, 1]
+		self.local_flows = numpy.random.RandomState(20200310).uniform(0, 100, (5, 365))
+		self.router = routing.NetworkRouter(self.downstream, self.local_flows)
+
+	def _route_by_hand(self, allocations):
+		eflows = numpy.zeros((5, 365))
+		available = numpy.zeros((5, 365))
+		for segment in (3, 4, 2, 1, 0):  # headwaters first
+			upstream = [index for index, downstream in enumerate(self.downstream) if downstream == segment]
+			available[segment] = self.local_flows[segment] + numpy.sum(eflows[upstream], axis=0)
+			eflows[segment] = allocations[segment] * available[segment]
+		return available, eflows, (1 - allocations) * available
+
+	def test_levels(self):
+		self.assertEqual([sorted(level.tolist()) for level in self.router.levels], [[2, 3, 4], [1], [0]])
+		self.assertEqual([(sorted(sources.tolist()), sorted(targets.tolist())) for sources, targets in self.router.level_outflows],
+							[([2, 3, 4], [0, 1, 1]), ([1], [0]), ([], [])])
+
+	def test_route_matches_recursion(self):
+		allocations = numpy.random.RandomState(20200311).uniform(0, 1, (5, 365))
+		available, eflows, economic = self._route_by_hand(allocations)
+
+		routed = self.router.route(allocations)
+		numpy.testing.assert_allclose(routed.local_available, available, rtol=1e-12)
+		numpy.testing.assert_allclose(routed.eflows_water, eflows, rtol=1e-12)
+		numpy.testing.assert_allclose(routed.economic_water, economic, rtol=1e-12)
+		numpy.testing.assert_allclose(routed.upstream_available, available - self.local_flows, rtol=1e-12, atol=1e-9)
+
+		# with everything left in the stream, the outlet gets all of the water in the network
+		everything = self.router.route(numpy.ones((5, 365)))
+		numpy.testing.assert_allclose(everything.eflows_water[0], numpy.sum(self.local_flows, axis=0), rtol=1e-12)
+		self.assertEqual(numpy.sum(everything.economic_water), 0)
+		numpy.testing.assert_allclose(routed.eflows_water, eflows, rtol=1e-12)  # routing again didn't change earlier results
+
+	def test_route_population(self):
+		allocations = numpy.random.RandomState(20200312).uniform(0, 1, (4, 5, 365))
+		routed = self.router.route(allocations)
+		self.assertEqual(routed.eflows_water.shape, (4, 5, 365))
+		for member in range(4):
+			available, eflows, economic = self._route_by_hand(allocations[member])
+			numpy.testing.assert_allclose(routed.eflows_water[member], eflows, rtol=1e-12)
+			numpy.testing.assert_allclose(routed.economic_water[member], economic, rtol=1e-12)
+
+	def test_reroute_matches_route(self):
+		allocations = numpy.random.RandomState(20200313).uniform(0, 1, (5, 365))
+		previous_eflows = self.router.route(allocations).eflows_water.copy()
+
+		changed = allocations.copy()
+		changed[3, 50:60] = 1
+		affected = self.router.downstream_closure(numpy.arange(5) == 3)
+		self.assertEqual(numpy.flatnonzero(affected).tolist(), [0, 1, 3])
+
+		eflows_water, local_available = self.router.reroute(changed, affected, previous_eflows)
+		routed = self.router.route(changed)
+		numpy.testing.assert_array_equal(eflows_water, routed.eflows_water)
+		numpy.testing.assert_array_equal(local_available[affected], routed.local_available[affected])
+
+	def test_propagate_upstream(self):
+		marks = numpy.zeros((5, 365), dtype=bool)
+		marks[1, 10] = True
+		marks[0, 20] = True
+		propagated = self.router.propagate_upstream(marks)
+		self.assertEqual(numpy.flatnonzero(propagated[:, 10]).tolist(), [1, 3, 4])
+		self.assertEqual(numpy.flatnonzero(propagated[:, 20]).tolist(), [0, 1, 2, 3, 4])
+		self.assertEqual(numpy.count_nonzero(propagated), 8)
+
+	def test_linear_reaches(self):
+		reaches = routing.LinearReaches.from_router(routing.NetworkRouter([-1, 0, 0, 1, 1, 3, 5], numpy.ones((7, 365))))
+		self.assertEqual(reaches.segment_reaches.tolist(), [0, 1, 2, 3, 4, 3, 3])  # 6 into 5 into 3 is one chain
+		self.assertEqual(reaches.report()["longest_reach"], 3)
+		self.assertEqual(reaches.reach_count, routing.LinearReaches.from_router(self.router).reach_count)  # no chains here
+
+	def test_loop_fails(self):
+		self.assertRaises(ValueError, routing.NetworkRouter, [1, 2, 1], numpy.zeros((3, 365)))
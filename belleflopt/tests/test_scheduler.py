@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import unittest
+
+from platypus import NSGAII, SBX, SPEA2
+
+from belleflopt import scheduler, support
+
+
+def record_job(output_folder, name, fail=False, **kwargs):
+	"""
+		A stand-in job - leaves a file behind for each time it runs, so tests can count runs, even in other processes
+	"""
+	with open(os.path.join(output_folder, name), 'a') as marker:
+		marker.write("ran\n")
+	if fail:
+		raise ValueError("Failing on purpose")
+	return os.path.join(output_folder, name)
+
+
+def record_experiment(model_run_name, algorithm, seed, popsize, **kwargs):
+	"""
+		Stands in for support.run_experiment_job - the folder comes from the environment, which workers inherit
+	"""
+	return record_job(os.environ["BELLEFLOPT_TEST_FOLDER"], "{}_{}_{}_{}".format(model_run_name, algorithm.__name__, seed, popsize))
+
+
+class TestExperimentScheduler(unittest.TestCase):
+
+	def setUp(self):
+		self.folder = tempfile.TemporaryDirectory()
+		self.ledger_path = os.path.join(self.folder.name, "ledger.json")
+
+	def tearDown(self):
+		self.folder.cleanup()
+
+	def _runs(self, name):
+		path = os.path.join(self.folder.name, name)
+		if not os.path.exists(path):
+			return 0
+		with open(path, 'r') as marker:
+			return len(marker.readlines())
+
+	def _schedule(self, jobs, resume, names, failing=()):
+		experiment_scheduler = scheduler.ExperimentScheduler("belleflopt.tests.test_scheduler.record_job", self.ledger_path, jobs=jobs,
+																resume=resume, django_settings="eflows_optimization.settings")
+		for name in names:
+			experiment_scheduler.add(name, {"output_folder": self.folder.name, "name": name, "fail": name in failing})
+		return experiment_scheduler.run()
+
+	def test_resume(self):
+		names = ["a", "b", "c", "d"]
+		summary = self._schedule(jobs=2, resume=False, names=names, failing=("c", ))
+		self.assertEqual(summary, {"pending": 0, "running": 0, "done": 3, "failed": 1})
+
+		with open(self.ledger_path, 'r') as ledger_file:
+			ledger = json.load(ledger_file)["jobs"]
+		self.assertEqual(ledger["a"]["result_path"], os.path.join(self.folder.name, "a"))
+		self.assertGreaterEqual(ledger["a"]["elapsed_seconds"], 0)
+		self.assertIn("Failing on purpose", ledger["c"]["error"])
+
+		# pretend we crashed while d was running - resuming reruns it and the failed job, but not the others
+		ledger_file = scheduler.JobLedger(self.ledger_path)
+		ledger_file.set_state("d", scheduler.RUNNING)
+		ledger_file.save()
+		summary = self._schedule(jobs=1, resume=True, names=names)
+		self.assertEqual(summary["done"], 4)
+		self.assertEqual([self._runs(name) for name in names], [1, 1, 2, 2])
+		self.assertEqual(scheduler.JobLedger(self.ledger_path).jobs["d"]["attempts"], 2)
+
+		# and without resume, everything runs again
+		self._schedule(jobs=1, resume=False, names=names)
+		self.assertEqual([self._runs(name) for name in names], [2, 2, 3, 3])
+
+		# two jobs can't share an id, or the ledger would mix them up
+		self.assertRaises(ValueError, self._schedule, jobs=1, resume=False, names=["a", "a"])
+
+	def test_run_experimenter(self):
+		"""
+			The experimenter should make a job for every combination, and skip all of them when resumed after finishing
+		"""
+		kwargs = {"NFE": 10,
+					"popsizes": (4, 8),
+					"algorithms": (NSGAII, (SPEA2, {}), (NSGAII, {"variator": SBX})),
+					"seeds": (1, ),
+					"model_run_names": ("first", "second"),
+					"ledger_path": self.ledger_path,
+					"use_comet": False,
+					"job_function": "belleflopt.tests.test_scheduler.record_experiment"}
+
+		os.environ["BELLEFLOPT_TEST_FOLDER"] = self.folder.name
+		try:
+			summary = support.run_experimenter(jobs=2, **kwargs)
+			self.assertEqual(summary["done"], 12)
+			self.assertEqual(self._runs("second_SPEA2_1_8"), 1)
+			self.assertEqual(self._runs("second_NSGAII_1_8"), 2)  # with and without arguments
+			self.assertIn("first/10/NSGAII/1/4", scheduler.JobLedger(self.ledger_path).jobs)
+			self.assertIn("first/10/NSGAII(variator=SBX)/1/4", scheduler.JobLedger(self.ledger_path).jobs)
+
+			summary = support.run_experimenter(jobs=2, resume=True, **kwargs)
+			self.assertEqual(summary["done"], 12)
+			self.assertEqual(self._runs("second_SPEA2_1_8"), 1)
+		finally:
+			del os.environ["BELLEFLOPT_TEST_FOLDER"]
@@ -1,6 +1,211 @@
+import numpy
+import platypus
+
 from django.test import TestCase
 
-class TestStreamNetwork(TestCase):
+from belleflopt import evaluators, optimize, variation
+from belleflopt.tests.network_fixtures import StreamNetworkTestCase, make_test_model_run
+
+
+class TestStreamNetwork(StreamNetworkTestCase):
 
 	def test_network_load(self):
-		pass
\ No newline at end of file
+		self.assertEqual(len(self.stream_network.stream_segments), 5)
+		self.assertEqual(len(self.stream_network.router.levels), 3)
+		self.assertGreater(numpy.sum(self.stream_network.benefit_table.component_types != 0), 0)
+
+	def test_benefits_match_segments(self):
+		"""
+			The array-based routing and benefit table should give what the segment objects would on their own
+		"""
+		self.stream_network.set_segment_allocations(self.allocations[0])
+		benefits = self.stream_network.get_benefits()
+		self.assertIsNotNone(self.stream_network._segment_allocations)  # segment objects don't get them until they're needed
+
+		self.stream_network.allocate_segments()
+		self.assertIsNone(self.stream_network._segment_allocations)
+		segments = list(self.stream_network.stream_segments.values())
+		self.assertAlmostEqual(benefits["environmental_benefit"], sum([segment.eflows_benefit for segment in segments]), places=6)
+		self.assertNotIn(None, [segment.benefit_cache for segment in segments])  # problems turn memoization on by default
+
+		self.stream_network.use_benefit_memo(None)
+		self.assertEqual([segment.benefit_cache for segment in segments], [None, ] * len(segments))
+		self.assertIsNone(self.stream_network.benefit_table.segment_memo)
+		self.assertAlmostEqual(benefits["environmental_benefit"], sum([segment.eflows_benefit for segment in segments]), places=6)
+
+		self.stream_network.use_benefit_memo(1024 ** 2)
+		self.assertAlmostEqual(benefits["environmental_benefit"], sum([segment.eflows_benefit for segment in segments]), places=6)
+		self.assertAlmostEqual(benefits["environmental_benefit"], sum([segment.eflows_benefit for segment in segments]), places=6)
+		self.assertEqual([segment.benefit_cache.hits for segment in segments], [1, ] * len(segments))  # scored once, then remembered
+		self.assertIsNotNone(self.stream_network.benefit_table.segment_memo)
+		economic_water = numpy.sum([segment.economic_water for segment in segments])
+		self.assertAlmostEqual(numpy.sum(self.stream_network.routed_water.economic_water), economic_water, places=3)
+
+	def test_batch_evaluation(self):
+		single = [platypus.Solution(self.problem) for _ in self.allocations]
+		batch = [platypus.Solution(self.problem) for _ in self.allocations]
+		for solution_single, solution_batch, allocation in zip(single, batch, self.allocations):
+			solution_single.variables[:] = list(allocation)
+			solution_batch.variables[:] = list(allocation)
+			solution_single.evaluate()
+
+		evaluators.BatchEvaluator(batch_size=4).evaluate_all([platypus.core.EvaluateSolution(solution) for solution in batch])
+		for solution_single, solution_batch in zip(single, batch):
+			self.assertTrue(solution_batch.evaluated)
+			numpy.testing.assert_allclose(solution_batch.objectives[:], solution_single.objectives[:], rtol=1e-9)
+
+		self.assertEqual(self.problem.eflows_nfe, 12)
+		self.assertEqual(len(self.problem.objective_1), 12)
+
+	def test_incremental_evaluation(self):
+		"""
+			Evaluating incrementally should give the same benefits as evaluating everything, while only rescoring what
+			changed and what's downstream of it
+		"""
+		base = self.allocations[0].reshape(5, 365)
+		headwater = int(numpy.flatnonzero(~numpy.isin(numpy.arange(5), self.stream_network.router.downstream_indices))[0])
+		outlet = int(numpy.flatnonzero(self.stream_network.router.downstream_indices < 0)[0])
+		changed_headwater = base.copy()
+		changed_headwater[headwater, 100:200] = 0.9
+		changed_outlet = changed_headwater.copy()
+		changed_outlet[outlet] = 0.1
+		sequence = [base, changed_headwater, changed_outlet, base, self.allocations[1].reshape(5, 365), changed_headwater]
+
+		expected = []
+		for allocation in sequence:
+			self.stream_network.set_segment_allocations(allocation.ravel())
+			expected.append(self.stream_network.get_benefits())
+
+		self.stream_network.use_incremental_evaluation()
+		for allocation, benefits in zip(sequence, expected):
+			self.stream_network.set_segment_allocations(allocation.ravel())
+			incremental_benefits = self.stream_network.get_benefits()
+			self.assertAlmostEqual(incremental_benefits["environmental_benefit"], benefits["environmental_benefit"], places=6)
+			self.assertAlmostEqual(incremental_benefits["economic_benefit"], benefits["economic_benefit"], delta=1e-9 * abs(benefits["economic_benefit"]))
+
+		stats = self.stream_network.incremental_evaluator.stats()
+		self.assertEqual(stats["full_evaluations"], 2)  # the first one, and the unrelated allocation
+		self.assertEqual(stats["incremental_evaluations"], 4)
+		self.assertLess(stats["segments_rescored"], stats["segments_evaluated"])
+
+		# the problem option turns it on, and population evaluation goes through it too
+		problem = optimize.StreamNetworkProblem(self.stream_network, incremental=True)
+		benefits = self.stream_network.get_population_benefits(numpy.stack([allocation.ravel() for allocation in sequence]))
+		numpy.testing.assert_allclose(benefits["environmental_benefit"], [values["environmental_benefit"] for values in expected], rtol=1e-9)
+		numpy.testing.assert_allclose(benefits["economic_benefit"], [values["economic_benefit"] for values in expected], rtol=1e-9)
+		self.assertTrue(problem.incremental)
+
+	def test_solution_cache(self):
+		problem = optimize.StreamNetworkProblem(self.stream_network, solution_cache_bytes=1024 ** 2, solution_cache_tolerance=1e-6)
+		allocation = numpy.round(self.allocations[0], 3)
+		solutions = [platypus.Solution(problem) for _ in range(4)]
+		solutions[0].variables[:] = list(allocation)
+		solutions[1].variables[:] = list(allocation)
+		solutions[2].variables[:] = list(allocation + 1e-9)  # within the tolerance, so it's a repeat too
+		solutions[3].variables[:] = list(self.allocations[1])
+
+		solutions[0].evaluate()
+		solutions[1].evaluate()
+		self.assertEqual(solutions[1].objectives[:], solutions[0].objectives[:])
+		self.assertEqual((problem.eflows_nfe, len(problem.objective_1)), (1, 1))
+
+		evaluators.BatchEvaluator().evaluate_all([platypus.core.EvaluateSolution(solution) for solution in solutions[2:]])
+		self.assertTrue(solutions[2].evaluated)
+		self.assertEqual(solutions[2].objectives[:], solutions[0].objectives[:])
+		self.assertEqual(problem.eflows_nfe, 2)
+
+		stats = problem.evaluation_stats()
+		self.assertEqual((stats["evaluations"], stats["solution_cache_hits"], stats["solution_cache_misses"]), (2, 2, 2))
+		self.assertEqual(stats["solution_cache_hit_rate"], 0.5)
+
+		problem.reset()
+		self.assertEqual(len(problem.solution_cache), 0)
+
+	def test_repeats_in_one_batch(self):
+		"""
+			Identical solutions in the same batch should only get evaluated once
+		"""
+		problem = optimize.StreamNetworkProblem(self.stream_network, solution_cache_bytes=1024 ** 2)
+		solutions = [platypus.Solution(problem) for _ in range(3)]
+		solutions[0].variables[:] = list(self.allocations[0])
+		solutions[1].variables[:] = list(self.allocations[1])
+		solutions[2].variables[:] = list(self.allocations[0])
+
+		evaluators.BatchEvaluator().evaluate_all([platypus.core.EvaluateSolution(solution) for solution in solutions])
+		self.assertTrue(all([solution.evaluated for solution in solutions]))
+		self.assertEqual(solutions[2].objectives[:], solutions[0].objectives[:])
+		self.assertNotEqual(solutions[1].objectives[:], solutions[0].objectives[:])
+		self.assertEqual((problem.eflows_nfe, len(problem.objective_1), problem.batch_repeats), (2, 2, 1))
+		self.assertEqual(problem.evaluation_stats()["batch_repeats"], 1)
+
+	def test_array_solutions(self):
+		"""
+			Compact NumPy variables shouldn't change the results for float64, and should still run for float32
+		"""
+		list_population, list_objective_1 = self._run_seeded(evaluators.BatchEvaluator())
+		self.problem = optimize.StreamNetworkProblem(self.stream_network, variable_dtype=numpy.float64)
+		array_population, array_objective_1 = self._run_seeded(evaluators.BatchEvaluator())
+		numpy.testing.assert_allclose(array_population, list_population, rtol=1e-12)
+		numpy.testing.assert_allclose(array_objective_1, list_objective_1, rtol=1e-12)
+
+		self.problem = optimize.StreamNetworkProblem(self.stream_network, variable_dtype="float32")
+		solution = optimize.InitialFlowsGenerator().generate(self.problem)
+		self.assertEqual(solution.variables.array.nbytes, 5 * 365 * 4)
+		solution.evaluate()
+		self.assertGreater(solution.objectives[0], 0)
+
+	def test_batched_algorithm(self):
+		algorithm = platypus.NSGAII(self.problem, generator=optimize.InitialFlowsGenerator(), population_size=6,
+									evaluator=evaluators.BatchEvaluator())
+		algorithm.run(12)
+		self.assertEqual(self.problem.eflows_nfe, algorithm.nfe)
+		self.assertTrue(all([solution.evaluated for solution in algorithm.population]))
+
+
+class TestCollapsedReaches(TestCase):
+
+	def test_collapse_reaches(self):
+		"""
+			Reaches should share variables without changing any results. This network has a chain - 1 is the only
+			segment flowing into 0 - and a confluence at 1:
+
+			2   3
+			 \ /
+			  1
+			  |
+			  0
+		"""
+		model_run = make_test_model_run(name="test_chain", downstream_segments=(None, 0, 1, 1))
+		full_network = optimize.StreamNetwork(model_run.segments, model_run.water_year, model_run)
+		self.assertEqual(full_network.reaches, None)
+		collapsed_network = optimize.StreamNetwork(model_run.segments, model_run.water_year, model_run, collapse_reaches=True)
+		self.assertEqual(collapsed_network.reaches.reach_comids(), [["900000", "900001"], ["900002"], ["900003"]])
+		self.assertEqual(collapsed_network.reach_report["decision_variables_after"], 3 * 365)
+		self.assertAlmostEqual(collapsed_network.reach_report["reduction_factor"], 4 / 3.0)
+		self.assertEqual(collapsed_network.reaches.segment_reaches.tolist(), [0, 0, 1, 2])
+
+		full_problem = optimize.StreamNetworkProblem(full_network)
+		collapsed_problem = optimize.StreamNetworkProblem(collapsed_network)
+		self.assertEqual(collapsed_problem.nvars, 3 * 365)
+		self.assertEqual(collapsed_problem.evaluation_stats()["reach_reaches"], 3)
+
+		variables = numpy.random.RandomState(8).uniform(0, 1, (2, collapsed_problem.nvars))
+		expanded = collapsed_problem.daily_allocations(variables)
+		numpy.testing.assert_array_equal(expanded[:, :365], expanded[:, 365:730])  # segments 0 and 1 share a reach
+		by_comid = collapsed_network.reaches.by_comid(variables[0])
+		numpy.testing.assert_array_equal(by_comid["900003"], variables[0, 730:])
+
+		for reach_variables, segment_variables in zip(variables, expanded):
+			collapsed_solution = platypus.Solution(collapsed_problem)
+			collapsed_solution.variables[:] = reach_variables.tolist()
+			collapsed_solution.evaluate()
+			full_solution = platypus.Solution(full_problem)
+			full_solution.variables[:] = segment_variables.tolist()
+			full_solution.evaluate()
+			self.assertEqual(collapsed_solution.objectives[:], full_solution.objectives[:])
+
+		# compiled networks keep the reaches, and encodings apply to reaches instead of segments
+		self.assertEqual(collapsed_network.compile().reaches.reach_count, 3)
+		self.assertEqual(optimize.StreamNetworkProblem(collapsed_network, encoding="monthly").nvars, 3 * 12)
+		window_segments = variation.WindowBlockMutation().get_windows(collapsed_problem)[0]
+		self.assertEqual(set(window_segments.tolist()), {0, 1, 2})  # windows on segments 0 and 1 apply to their reach
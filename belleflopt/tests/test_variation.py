@@ -0,0 +1,215 @@
+import os
+import random
+import tempfile
+import unittest
+
+import numpy
+import platypus
+
+from belleflopt import array_solutions, optimize, support, variation
+from belleflopt.tests.network_fixtures import StreamNetworkTestCase
+
+
+class _BoundedProblem(platypus.Problem):
+	def __init__(self, nvars=365 * 4, min_proportion=0.2, variable_dtype=numpy.float64):
+		super(_BoundedProblem, self).__init__(nvars, 2)
+		self.types[:] = platypus.Real(min_proportion, 1)
+		self.directions[:] = platypus.Problem.MAXIMIZE
+		self.variable_dtype = variable_dtype
+
+	def evaluate(self, solution):
+		variables = array_solutions.variables_array(solution)
+		solution.objectives[:] = [float(numpy.sum(variables)), float(numpy.sum(1 - variables))]
+
+
+def _solution(problem, values):
+	solution = array_solutions.make_solution(problem)
+	array_solutions.set_variables(solution, values)
+	solution.evaluated = True
+	return solution
+
+
+class TestVectorizedOperators(unittest.TestCase):
+
+	def setUp(self):
+		self.problem = _BoundedProblem()
+		state = numpy.random.RandomState(20200405)
+		self.parents = [_solution(self.problem, state.uniform(0.2, 1, self.problem.nvars)) for _ in range(4)]
+
+	def test_seeded(self):
+		for make_operator in (lambda: variation.ArrayGAOperator(seed=5), lambda: variation.ArrayDifferentialEvolution(seed=5)):
+			first = make_operator().evolve(self.parents[:make_operator().arity])
+			second = make_operator().evolve(self.parents[:make_operator().arity])
+			for child_1, child_2 in zip(first, second):
+				numpy.testing.assert_array_equal(child_1.variables.array, child_2.variables.array)
+
+		# without a seed, they take one from the random module
+		random.seed(1)
+		first = variation.ArraySBX().evolve(self.parents[:2])
+		random.seed(1)
+		second = variation.ArraySBX().evolve(self.parents[:2])
+		numpy.testing.assert_array_equal(first[0].variables.array, second[0].variables.array)
+
+	def test_bounds_and_parents(self):
+		parent_values = [parent.variables.array.copy() for parent in self.parents]
+		children = variation.ArraySBX(seed=1).evolve(self.parents[:2])
+		children += [variation.ArrayPM(probability=1.0, seed=2).mutate(self.parents[0])]
+		children += variation.ArrayDifferentialEvolution(crossover_rate=1.0, step_size=5, seed=3).evolve(self.parents)
+
+		for child in children:
+			self.assertIsInstance(child, array_solutions.ArraySolution)
+			self.assertFalse(child.evaluated)
+			self.assertGreaterEqual(child.variables.array.min(), 0.2)
+			self.assertLessEqual(child.variables.array.max(), 1)
+
+		for parent, values in zip(self.parents, parent_values):  # the parents are left alone
+			numpy.testing.assert_array_equal(parent.variables.array, values)
+
+		# with every variable crossing over, DE is just the differential step
+		values = [parent.variables.array for parent in self.parents]
+		numpy.testing.assert_allclose(children[-1].variables.array, numpy.clip(values[3] + 5 * (values[1] - values[2]), 0.2, 1))
+
+	def test_pm_matches_platypus(self):
+		"""
+			The mutations should have the same distribution as Platypus's PM
+		"""
+		problem = _BoundedProblem(nvars=20000, variable_dtype=None)
+		parent = _solution(problem, numpy.full(problem.nvars, 0.7))
+		random.seed(2)
+		platypus_changes = numpy.array(list(platypus.PM(probability=1.0).mutate(parent).variables)) - 0.7
+		array_changes = variation.ArrayPM(probability=1.0, seed=2).mutate(parent)
+		array_changes = array_solutions.variables_array(array_changes) - 0.7
+
+		self.assertAlmostEqual(numpy.mean(array_changes), numpy.mean(platypus_changes), delta=0.002)
+		self.assertAlmostEqual(numpy.std(array_changes), numpy.std(platypus_changes), delta=0.003)
+
+	def test_algorithms(self):
+		self.assertIsInstance(variation.vectorized_operators(platypus.GDE3)["variator"], variation.ArrayDifferentialEvolution)
+		self.assertIsInstance(variation.vectorized_operators(platypus.SMPSO)["mutate"], variation.ArrayPM)
+		self.assertRaises(ValueError, variation.vectorized_operators, platypus.OMOPSO)
+
+		for algorithm in (platypus.NSGAII, platypus.GDE3, platypus.SPEA2):
+			problem = _BoundedProblem(nvars=100, variable_dtype=None)  # regular solutions work too
+			runner = algorithm(problem, population_size=8, **variation.vectorized_operators(algorithm, seed=3))
+			runner.run(40)
+			values = numpy.array([list(solution.variables) for solution in runner.result])
+			self.assertTrue(numpy.all((values >= 0.2) & (values <= 1)))
+
+
+class TestHydrographOperators(unittest.TestCase):
+
+	def setUp(self):
+		self.problem = _BoundedProblem()  # four segments
+		state = numpy.random.RandomState(20200406)
+		self.parents = [_solution(self.problem, state.uniform(0.2, 1, self.problem.nvars)) for _ in range(2)]
+		self.windows = (numpy.array([1, 3]), numpy.array([350, 100]), numpy.array([30, 60]))  # the first wraps around the end of the year
+
+	def test_window_block_mutation(self):
+		mutation = variation.WindowBlockMutation(blocks=0, magnitude=0.5, windows=self.windows, seed=4)  # always exactly one window
+		allowed = numpy.zeros((4, 365), dtype=bool)
+		allowed[1, 350:] = allowed[1, :15] = True
+		allowed[3, 100:160] = True
+
+		for _ in range(20):
+			child = mutation.mutate(self.parents[0])
+			changed = (child.variables.array != self.parents[0].variables.array).reshape(4, 365)
+			self.assertTrue(numpy.any(changed))
+			self.assertFalse(numpy.any(changed & ~allowed))
+			self.assertEqual(numpy.count_nonzero(numpy.any(changed, axis=1)), 1)
+			self.assertGreaterEqual(child.variables.array.min(), 0.2)
+			self.assertLessEqual(child.variables.array.max(), 1)
+
+	def test_smooth_shift_mutation(self):
+		parent = _solution(self.problem, numpy.full(self.problem.nvars, 0.5))
+		child = variation.SmoothShiftMutation(min_days=40, max_days=40, ramp_days=10, seed=6).mutate(parent)
+		changes = (child.variables.array - 0.5).reshape(4, 365)
+		changed = numpy.flatnonzero(numpy.any(changes != 0, axis=1))
+		self.assertEqual(changed.size, 1)
+
+		ratios = changes[changed[0]][changes[changed[0]] != 0]
+		self.assertEqual(ratios.size, 40)
+		self.assertTrue(numpy.all(numpy.sign(ratios) == numpy.sign(ratios[0])))  # one factor for the whole block
+		self.assertLess(abs(ratios[0]), abs(ratios[20]))  # faded in at the edges
+
+	def test_segment_pattern_crossover(self):
+		children = variation.SegmentPatternCrossover(seed=7).evolve(self.parents)
+		parent_rows = [parent.variables.array.reshape(4, 365) for parent in self.parents]
+		for child in children:
+			self.assertFalse(child.evaluated)
+			for segment, row in enumerate(child.variables.array.reshape(4, 365)):
+				self.assertTrue(any([numpy.array_equal(row, parent[segment]) for parent in parent_rows]))
+
+		# between them, the children keep every segment of both parents
+		total = children[0].variables.array + children[1].variables.array
+		numpy.testing.assert_allclose(total, self.parents[0].variables.array + self.parents[1].variables.array)
+
+	def test_operator_crossover_probability(self):
+		operator = variation.HydrographOperator(crossover=variation.SegmentPatternCrossover(probability=0, swap_probability=1, seed=9), mutations=[])
+		children = operator.evolve(self.parents)
+		for child, parent in zip(children, self.parents):
+			numpy.testing.assert_array_equal(child.variables.array, parent.variables.array)
+
+		operator.crossover.probability = 1
+		children = operator.evolve(self.parents)
+		numpy.testing.assert_array_equal(children[0].variables.array, self.parents[1].variables.array)
+
+	def test_algorithms(self):
+		self.assertIsInstance(variation.hydrograph_operators(platypus.NSGAII)["variator"], variation.HydrographOperator)
+		self.assertIsInstance(variation.hydrograph_operators(platypus.SMPSO)["mutate"], variation.WindowBlockMutation)
+		self.assertRaises(ValueError, variation.hydrograph_operators, platypus.GDE3)
+		self.assertRaises(ValueError, variation.hydrograph_operators, platypus.OMOPSO)
+
+		random.seed(8)
+		runner = platypus.NSGAII(self.problem, population_size=8, **variation.hydrograph_operators(platypus.NSGAII, seed=8))
+		runner.run(40)  # no windows on this problem, so the block mutation picks random blocks
+		values = array_solutions.stack_variables(runner.result)
+		self.assertTrue(numpy.all((values >= 0.2) & (values <= 1)))
+
+
+class TestNetworkOperators(StreamNetworkTestCase):
+
+	def test_component_windows(self):
+		"""
+			Windows should cover exactly the days where components give benefit, and the block mutation should only
+			change allocations inside them
+		"""
+		table = self.stream_network.benefit_table
+		segments, starts, lengths = table.component_windows()
+		self.assertGreater(segments.size, 0)
+
+		covered = numpy.zeros((5, 365), dtype=bool)
+		for segment, start, length in zip(segments, starts, lengths):
+			covered[segment, (start + numpy.arange(length)) % 365] = True
+		expected = numpy.zeros((5, 365), dtype=bool)
+		for segment, component in zip(*table._components):
+			expected[segment] |= table.day_benefit[segment, component] > 0
+		numpy.testing.assert_array_equal(covered, expected)
+
+		self.problem = optimize.StreamNetworkProblem(self.stream_network, variable_dtype=numpy.float64)
+		parent = optimize.InitialFlowsGenerator().generate(self.problem)
+		child = variation.WindowBlockMutation(seed=3).mutate(parent)
+		changed = (child.variables.array != parent.variables.array).reshape(5, 365)
+		self.assertTrue(numpy.any(changed))
+		self.assertFalse(numpy.any(changed & ~covered))
+
+	def test_benchmark_operators(self):
+		self.assertAlmostEqual(support.hypervolume([[1, 0], [0, 1], [0.5, 0.5]], minimum=0, maximum=1), 0.25)
+		self.assertAlmostEqual(support.hypervolume([[30, 30]], minimum=[10, 10], maximum=[50, 30]), 0.5)
+
+		with tempfile.TemporaryDirectory() as folder:
+			output_path = os.path.join(folder, "benchmark.csv")
+			summary = support.benchmark_operators(model_run_names=("test_network", ), NFE=24, popsize=6, seeds=(1, ),
+			                                      checkpoint_interval=12, output_path=output_path)
+			self.assertTrue(os.path.exists(os.path.join(folder, "benchmark_summary.json")))
+			with open(output_path) as output_file:
+				self.assertEqual(len(output_file.readlines()), 5)  # a header plus two checkpoints for each operator set
+
+		for operators in ("platypus", "hydrograph"):
+			result = summary["test_network"][operators]
+			self.assertEqual(result["runs"], 1)
+			self.assertGreater(result["mean_final_hypervolume"], 0)
+		self.assertGreaterEqual(sum([result["runs_reaching_target"] for result in summary["test_network"].values()]), 1)  # at least the best run
+
+
+if __name__ == '__main__':
+	unittest.main()
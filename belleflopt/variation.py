@@ -0,0 +1,526 @@
+"""
+	Vectorized variation operators. Platypus's SBX, PM, and DifferentialEvolution loop over every decision variable in
+	Python and draw a random number for each one, which dominates generation time once a network has hundreds of
+	thousands of variables. These do the same math on whole variable arrays at once, with NumPy random draws, and are
+	drop-in replacements - pass them as the variator (or SMPSO's mutate) when making an algorithm, or use
+	vectorized_operators to get the right ones for an algorithm. They work on regular Solutions too, but are fastest
+	with the ArraySolutions from belleflopt.array_solutions.
+
+	Each operator has its own NumPy random generator. Give it a seed to make runs reproducible on their own - without
+	one, it seeds itself from Python's random module when it's made, so seeding that (as run_optimize_new does) before
+	making the operators also makes runs reproducible. Bounds come from the problem's Real types - min_proportion to 1
+	for the network problems.
+
+	There are also hydrograph-aware operators, which treat the variables as a year of daily allocations for each
+	segment: WindowBlockMutation changes whole flow component windows at once, SmoothShiftMutation scales a season up
+	or down, and SegmentPatternCrossover passes whole segment hydrographs between parents. HydrographOperator combines
+	them, and hydrograph_operators gets the arguments to use them with an algorithm.
+
+	Nothing in this module should import Django.
+"""
+
+import copy
+import logging
+import random
+
+import numpy
+from platypus import Real, Variator, Mutation
+
+from belleflopt import array_solutions
+
+log = logging.getLogger("belleflopt.variation")
+
+EPSILON = 1.0e-14  # same cutoff Platypus uses for parents being too close together to cross over
+
+
+def _make_random_generator(seed):
+	if seed is None:
+		seed = random.getrandbits(64)
+	return numpy.random.default_rng(seed)
+
+
+class _ArrayOperatorMixin(object):
+	"""
+		Random generator and cached variable bounds shared by the operators
+	"""
+
+	def _setup(self, seed):
+		self.random_generator = _make_random_generator(seed)
+		self._bounds = {}
+
+	def reseed(self, seed):
+		"""
+			Restarts the operator's random numbers from a new seed
+		"""
+		self.random_generator = _make_random_generator(seed)
+
+	def get_bounds(self, problem):
+		"""
+			Lower and upper bounds of every variable as arrays, worked out once per problem
+		"""
+		if problem not in self._bounds:
+			types = problem.types
+			if all([variable_type is types[0] for variable_type in types]):  # our problems share one Real for every variable
+				if not isinstance(types[0], Real):
+					raise ValueError("Vectorized operators only work with Real variables")
+				lower = numpy.full(problem.nvars, float(types[0].min_value))
+				upper = numpy.full(problem.nvars, float(types[0].max_value))
+			else:
+				if not all([isinstance(variable_type, Real) for variable_type in types]):
+					raise ValueError("Vectorized operators only work with Real variables")
+				lower = numpy.array([variable_type.min_value for variable_type in types], dtype=float)
+				upper = numpy.array([variable_type.max_value for variable_type in types], dtype=float)
+			self._bounds[problem] = (lower, upper)
+		return self._bounds[problem]
+
+	@staticmethod
+	def _child(parent, values):
+		child = copy.deepcopy(parent)
+		array_solutions.set_variables(child, values)
+		child.evaluated = False
+		return child
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state["_bounds"] = {}  # keyed by problem, which doesn't need to travel with the operator
+		return state
+
+
+class ArraySBX(_ArrayOperatorMixin, Variator):
+	"""
+		Simulated binary crossover on whole variable arrays - the same distribution as Platypus's SBX, except that
+		variables cross over whenever the parents differ on them. Platypus only crosses them over when the second
+		parent's value is the larger one.
+	"""
+
+	def __init__(self, probability=1.0, distribution_index=15.0, seed=None):
+		"""
+		:param probability: probability of crossing a pair of parents over at all. Each variable then crosses over with
+				probability 0.5, as in Platypus
+		:param distribution_index: larger values keep children closer to their parents
+		:param seed: seed for this operator's random numbers
+		"""
+		super(ArraySBX, self).__init__(2)
+		self.probability = probability
+		self.distribution_index = distribution_index
+		self._setup(seed)
+
+	def evolve(self, parents):
+		x1 = array_solutions.variables_array(parents[0]).astype(float)
+		x2 = array_solutions.variables_array(parents[1]).astype(float)
+		if self.random_generator.uniform() > self.probability:
+			return [copy.deepcopy(parents[0]), copy.deepcopy(parents[1])]
+
+		lower, upper = self.get_bounds(parents[0].problem)
+		child1, child2 = self.crossover(x1, x2, lower, upper)
+		return [self._child(parents[0], child1), self._child(parents[1], child2)]
+
+	def crossover(self, x1, x2, lower, upper):
+		"""
+			Crosses two variable arrays over
+		:return: tuple of the two children's variable arrays
+		"""
+		size = x1.shape[0]
+		crossing = (self.random_generator.uniform(size=size) <= 0.5) & (numpy.abs(x2 - x1) > EPSILON)
+		rand = self.random_generator.uniform(size=size)
+		swap = self.random_generator.uniform(size=size) < 0.5
+
+		y1 = numpy.minimum(x1, x2)
+		y2 = numpy.maximum(x1, x2)
+		spread = numpy.where(crossing, y2 - y1, 1)  # avoids dividing by zero where we aren't crossing anyway
+		exponent = 1.0 / (self.distribution_index + 1.0)
+
+		with numpy.errstate(divide="ignore", over="ignore", invalid="ignore"):
+			def betaq(bound_distance):
+				beta = 1.0 / (1.0 + (2.0 * bound_distance / spread))
+				alpha = 2.0 - numpy.power(beta, self.distribution_index + 1.0)
+				return numpy.where(rand <= 1.0 / alpha,
+									numpy.power(alpha * rand, exponent),
+									numpy.power(1.0 / (2.0 - alpha * rand), exponent))
+
+			child1 = 0.5 * ((y1 + y2) - betaq(y1 - lower) * spread)
+			child2 = 0.5 * ((y1 + y2) + betaq(upper - y2) * spread)
+
+		child1, child2 = numpy.where(swap, child2, child1), numpy.where(swap, child1, child2)
+		child1 = numpy.where(crossing, numpy.clip(child1, lower, upper), x1)
+		child2 = numpy.where(crossing, numpy.clip(child2, lower, upper), x2)
+		return child1, child2
+
+
+class ArrayPM(_ArrayOperatorMixin, Mutation):
+	"""
+		Polynomial mutation on whole variable arrays - same distribution as Platypus's PM
+	"""
+
+	def __init__(self, probability=1, distribution_index=20.0, seed=None):
+		"""
+		:param probability: probability of mutating each variable. As in Platypus, an integer is divided by the number
+				of variables, so the default of 1 mutates one variable per solution on average
+		:param distribution_index: larger values make smaller mutations
+		:param seed: seed for this operator's random numbers
+		"""
+		super(ArrayPM, self).__init__()
+		self.probability = probability
+		self.distribution_index = distribution_index
+		self._setup(seed)
+
+	def mutate(self, parent):
+		problem = parent.problem
+		probability = self.probability
+		if isinstance(probability, int):
+			probability /= float(problem.nvars)
+
+		lower, upper = self.get_bounds(problem)
+		values = self.mutate_array(array_solutions.variables_array(parent).astype(float), lower, upper, probability)
+		if values is None:  # nothing got mutated
+			return copy.deepcopy(parent)
+		return self._child(parent, values)
+
+	def mutate_array(self, x, lower, upper, probability):
+		"""
+			Mutates a variable array
+		:return: the mutated array, or None if no variables were picked for mutation
+		"""
+		mutating = numpy.flatnonzero(self.random_generator.uniform(size=x.shape[0]) <= probability)
+		if mutating.size == 0:
+			return None
+
+		u = self.random_generator.uniform(size=mutating.size)
+		values = x[mutating]
+		lb = lower[mutating]
+		ub = upper[mutating]
+		dx = ub - lb
+		exponent = 1.0 / (self.distribution_index + 1.0)
+
+		with numpy.errstate(divide="ignore", invalid="ignore"):
+			low_side = u < 0.5
+			bl = (values - lb) / dx
+			bu = (ub - values) / dx
+			b_low = 2.0 * u + (1.0 - 2.0 * u) * numpy.power(1.0 - bl, self.distribution_index + 1.0)
+			b_high = 2.0 * (1.0 - u) + 2.0 * (u - 0.5) * numpy.power(1.0 - bu, self.distribution_index + 1.0)
+			delta = numpy.where(low_side, numpy.power(b_low, exponent) - 1.0, 1.0 - numpy.power(b_high, exponent))
+
+		x = x.copy()
+		x[mutating] = numpy.clip(values + delta * dx, lb, ub)
+		return x
+
+
+class ArrayDifferentialEvolution(_ArrayOperatorMixin, Variator):
+	"""
+		Differential evolution on whole variable arrays - same as Platypus's DifferentialEvolution, for GDE3
+	"""
+
+	def __init__(self, crossover_rate=0.1, step_size=0.5, seed=None):
+		"""
+		:param crossover_rate: probability of each variable taking the differential value
+		:param step_size: how far along the difference between two parents to step
+		:param seed: seed for this operator's random numbers
+		"""
+		super(ArrayDifferentialEvolution, self).__init__(4)
+		self.crossover_rate = crossover_rate
+		self.step_size = step_size
+		self._setup(seed)
+
+	def evolve(self, parents):
+		problem = parents[0].problem
+		lower, upper = self.get_bounds(problem)
+		v1, v2, v3 = (array_solutions.variables_array(parent).astype(float) for parent in parents[1:4])
+
+		crossing = self.random_generator.uniform(size=problem.nvars) <= self.crossover_rate
+		crossing[self.random_generator.integers(problem.nvars)] = True  # always at least one
+		values = array_solutions.variables_array(parents[0]).astype(float)
+		values[crossing] = numpy.clip(v3[crossing] + self.step_size * (v1[crossing] - v2[crossing]), lower[crossing], upper[crossing])
+		return [self._child(parents[0], values)]
+
+
+class ArrayGAOperator(Variator):
+	"""
+		Crossover followed by mutation, like Platypus's GAOperator - defaults to ArraySBX and ArrayPM
+	"""
+
+	def __init__(self, variation=None, mutation=None, seed=None):
+		"""
+		:param variation: crossover operator. Defaults to ArraySBX()
+		:param mutation: mutation operator. Defaults to ArrayPM()
+		:param seed: seeds the default operators - the mutation gets seed + 1 so they don't draw the same numbers
+		"""
+		variation = variation or ArraySBX(seed=seed)
+		mutation = mutation or ArrayPM(seed=None if seed is None else seed + 1)
+		super(ArrayGAOperator, self).__init__(variation.arity)
+		self.variation = variation
+		self.mutation = mutation
+
+	def evolve(self, parents):
+		return [self.mutation.evolve(child) for child in self.variation.evolve(parents)]
+
+
+def _taper(length, ramp):
+	"""
+		Weights that rise from near zero to one over ramp days with a half cosine, stay at one, then fall back the same
+		way, so a change fades in and out instead of putting steps into the hydrograph
+	"""
+	weights = numpy.ones(length)
+	ramp = min(int(ramp), length // 2)
+	if ramp > 0:
+		edge = 0.5 - 0.5 * numpy.cos(numpy.pi * (numpy.arange(ramp) + 0.5) / ramp)
+		weights[:ramp] = edge
+		weights[length - ramp:] = edge[::-1]
+	return weights
+
+
+class _HydrographOperatorMixin(_ArrayOperatorMixin):
+	"""
+		Shared pieces for operators that treat the decision variables as a 365 day hydrograph per segment
+	"""
+
+	def _setup(self, seed, windows=None):
+		super(_HydrographOperatorMixin, self)._setup(seed)
+		self.windows = windows
+		self._windows = {}
+
+	@staticmethod
+	def segment_count(problem):
+		if getattr(problem, "encoding", None) is not None or problem.nvars % 365 != 0:
+			raise ValueError("Hydrograph operators need 365 daily decision variables per segment, so they don't work with encodings")
+		return problem.nvars // 365
+
+	def get_windows(self, problem):
+		"""
+			The component windows to line changes up with, as (segments, starts, lengths) arrays - the ones passed in
+			when making the operator, or otherwise the problem's stream network's, from
+			NetworkBenefitTable.component_windows. In simplified problems every segment shares one hydrograph, so all
+			of the windows apply to it, and with collapsed reaches, each segment's windows apply to its reach.
+		"""
+		if problem not in self._windows:
+			if self.windows is not None:
+				segments, starts, lengths = (numpy.asarray(values, dtype=numpy.int64) for values in self.windows)
+			elif hasattr(problem, "stream_network"):
+				segments, starts, lengths = problem.stream_network.benefit_table.component_windows()
+			else:
+				segments = starts = lengths = numpy.zeros(0, dtype=numpy.int64)
+
+			if getattr(problem, "simplified", False) or self.segment_count(problem) == 1:
+				segments = numpy.zeros_like(segments)
+			elif getattr(problem, "reaches", None) is not None:  # segments in a collapsed reach share its variables
+				segments = problem.reaches.segment_reaches[segments]
+			self._windows[problem] = (segments, starts, lengths)
+		return self._windows[problem]
+
+	@staticmethod
+	def _block_indices(segment, start, length):
+		return segment * 365 + (start + numpy.arange(length)) % 365
+
+	def __getstate__(self):
+		state = super(_HydrographOperatorMixin, self).__getstate__()
+		state["_windows"] = {}
+		return state
+
+
+class WindowBlockMutation(_HydrographOperatorMixin, Mutation):
+	"""
+		Raises or lowers a segment's allocations across one of its flow components' windows (like the days between a
+		component's start_day_ramp and end_day_ramp) by an amount that fades in and out at the window's edges. Platypus's
+		PM changes single days independently, which almost never changes a component's benefit on its own - this
+		changes the blocks of days that components actually score. Segments without any windows get a block of random
+		days instead.
+	"""
+
+	def __init__(self, probability=1.0, blocks=1, magnitude=0.2, windows=None, seed=None):
+		"""
+		:param probability: probability of mutating a solution at all
+		:param blocks: average number of windows to change per mutation - at least one always changes
+		:param magnitude: standard deviation of the change at the middle of the window, in allocation proportion
+		:param windows: optional (segments, starts, lengths) arrays of windows to use instead of the problem's
+		:param seed: seed for this operator's random numbers
+		"""
+		super(WindowBlockMutation, self).__init__()
+		self.probability = probability
+		self.blocks = blocks
+		self.magnitude = magnitude
+		self._setup(seed, windows)
+
+	def mutate(self, parent):
+		if self.random_generator.uniform() > self.probability:
+			return copy.deepcopy(parent)
+		values = self.mutate_array(array_solutions.variables_array(parent).astype(float), parent.problem)
+		return self._child(parent, values)
+
+	def mutate_array(self, x, problem):
+		"""
+			Mutates a variable array
+		:return: the mutated array
+		"""
+		lower, upper = self.get_bounds(problem)
+		segments, starts, lengths = self.get_windows(problem)
+		x = x.copy()
+		for _ in range(max(1, self.random_generator.poisson(self.blocks))):
+			if segments.size > 0:
+				window = self.random_generator.integers(segments.size)
+				segment, start, length = segments[window], starts[window], lengths[window]
+			else:
+				segment = self.random_generator.integers(self.segment_count(problem))
+				start = self.random_generator.integers(365)
+				length = self.random_generator.integers(7, 92)
+
+			indices = self._block_indices(segment, start, length)
+			change = self.random_generator.normal(0, self.magnitude) * _taper(length, length // 2)
+			x[indices] = numpy.clip(x[indices] + change, lower[indices], upper[indices])
+		return x
+
+
+class SmoothShiftMutation(_HydrographOperatorMixin, Mutation):
+	"""
+		Scales a contiguous block of one segment's allocations by a single factor, with a smooth ramp in and out, which
+		shifts a whole season of the hydrograph up or down while keeping its shape.
+	"""
+
+	def __init__(self, probability=1.0, sigma=0.25, min_days=14, max_days=365, ramp_days=7, seed=None):
+		"""
+		:param probability: probability of mutating a solution at all
+		:param sigma: the scaling factor is exp(N(0, sigma)), so it's as likely to halve as to double things
+		:param min_days: shortest block to scale
+		:param max_days: longest block to scale
+		:param ramp_days: days over which the scaling fades in and out at each end of the block
+		:param seed: seed for this operator's random numbers
+		"""
+		super(SmoothShiftMutation, self).__init__()
+		self.probability = probability
+		self.sigma = sigma
+		self.min_days = min_days
+		self.max_days = max_days
+		self.ramp_days = ramp_days
+		self._setup(seed)
+
+	def mutate(self, parent):
+		if self.random_generator.uniform() > self.probability:
+			return copy.deepcopy(parent)
+		values = self.mutate_array(array_solutions.variables_array(parent).astype(float), parent.problem)
+		return self._child(parent, values)
+
+	def mutate_array(self, x, problem):
+		"""
+			Mutates a variable array
+		:return: the mutated array
+		"""
+		lower, upper = self.get_bounds(problem)
+		segment = self.random_generator.integers(self.segment_count(problem))
+		length = self.random_generator.integers(self.min_days, self.max_days + 1)
+		indices = self._block_indices(segment, self.random_generator.integers(365), length)
+
+		factor = numpy.exp(self.random_generator.normal(0, self.sigma))
+		x = x.copy()
+		x[indices] = numpy.clip(x[indices] * (1 + (factor - 1) * _taper(length, self.ramp_days)), lower[indices], upper[indices])
+		return x
+
+
+class SegmentPatternCrossover(_HydrographOperatorMixin, Variator):
+	"""
+		Uniform crossover of whole segments - each child gets every segment's entire annual pattern from one parent or
+		the other, so hydrographs that work for a segment get passed on intact instead of being mixed day by day.
+	"""
+
+	def __init__(self, probability=1.0, swap_probability=0.5, seed=None):
+		"""
+		:param probability: probability of crossing a pair of parents over at all
+		:param swap_probability: probability of each segment's pattern being swapped between the children
+		:param seed: seed for this operator's random numbers
+		"""
+		super(SegmentPatternCrossover, self).__init__(2)
+		self.probability = probability
+		self.swap_probability = swap_probability
+		self._setup(seed)
+
+	def evolve(self, parents):
+		if self.random_generator.uniform() > self.probability:
+			return [copy.deepcopy(parents[0]), copy.deepcopy(parents[1])]
+		x1 = array_solutions.variables_array(parents[0]).astype(float)
+		x2 = array_solutions.variables_array(parents[1]).astype(float)
+		child1, child2 = self.crossover(x1, x2, parents[0].problem)
+		return [self._child(parents[0], child1), self._child(parents[1], child2)]
+
+	def crossover(self, x1, x2, problem):
+		"""
+			Swaps segment patterns between two variable arrays
+		:return: tuple of the two children's variable arrays
+		"""
+		swapping = numpy.repeat(self.random_generator.uniform(size=self.segment_count(problem)) < self.swap_probability, 365)
+		return numpy.where(swapping, x2, x1), numpy.where(swapping, x1, x2)
+
+
+class HydrographOperator(Variator):
+	"""
+		Segment pattern crossover followed by window block mutation, and a smooth shift some of the time - the
+		hydrograph-aware counterpart to ArrayGAOperator. Works on the variable arrays and only makes the children at the
+		end, so combining operators doesn't cost extra copies.
+	"""
+
+	def __init__(self, crossover=None, mutations=None, seed=None):
+		"""
+		:param crossover: a SegmentPatternCrossover (or anything else with crossover(x1, x2, problem)). Defaults to
+				SegmentPatternCrossover()
+		:param mutations: list of (operator, probability) tuples applied in order - operators need
+				mutate_array(x, problem). Defaults to a WindowBlockMutation every time and a SmoothShiftMutation half of
+				the time.
+		:param seed: seeds the default operators, each with a different offset from it
+		"""
+		def offset(amount):
+			return None if seed is None else seed + amount
+
+		self.crossover = crossover or SegmentPatternCrossover(seed=seed)
+		if mutations is None:
+			mutations = [(WindowBlockMutation(seed=offset(1)), 1.0), (SmoothShiftMutation(seed=offset(2)), 0.5)]
+		self.mutations = mutations
+		self.random_generator = _make_random_generator(offset(3))
+		super(HydrographOperator, self).__init__(2)
+
+	def evolve(self, parents):
+		problem = parents[0].problem
+		children = (array_solutions.variables_array(parents[0]).astype(float), array_solutions.variables_array(parents[1]).astype(float))
+		crossover_random = getattr(self.crossover, "random_generator", self.random_generator)
+		if crossover_random.uniform() <= getattr(self.crossover, "probability", 1.0):  # like SegmentPatternCrossover.evolve
+			children = self.crossover.crossover(children[0], children[1], problem)
+
+		results = []
+		for parent, values in zip(parents, children):
+			for mutation, probability in self.mutations:
+				if self.random_generator.uniform() <= probability:
+					values = mutation.mutate_array(values, problem)
+			results.append(_ArrayOperatorMixin._child(parent, values))
+		return results
+
+
+def hydrograph_operators(algorithm, seed=None):
+	"""
+		Arguments for making an algorithm with the hydrograph-aware operators, like
+		algorithm(problem, **hydrograph_operators(algorithm)). Only for the network problems, which have 365 decision
+		variables per segment.
+	:param algorithm: platypus algorithm class
+	:param seed: seed for the operators' random numbers
+	:return: dict of keyword arguments for the algorithm
+	"""
+	name = algorithm.__name__
+	if name == "GDE3":
+		raise ValueError("GDE3 needs differential evolution - use vectorized_operators for it instead")
+	if name == "OMOPSO":
+		raise ValueError("OMOPSO uses its own mutation operators, which can't be replaced")
+	if name == "SMPSO":
+		return {"mutate": WindowBlockMutation(seed=seed)}
+	return {"variator": HydrographOperator(seed=seed)}
+
+
+def vectorized_operators(algorithm, seed=None):
+	"""
+		Arguments for making an algorithm with vectorized operators in place of its default Platypus ones, like
+		algorithm(problem, **vectorized_operators(algorithm))
+	:param algorithm: platypus algorithm class
+	:param seed: seed for the operators' random numbers
+	:return: dict of keyword arguments for the algorithm
+	"""
+	name = algorithm.__name__
+	if name == "GDE3":
+		return {"variator": ArrayDifferentialEvolution(seed=seed)}
+	if name == "SMPSO":
+		return {"mutate": ArrayPM(seed=seed)}
+	if name == "OMOPSO":
+		raise ValueError("OMOPSO uses its own mutation operators, which don't have vectorized versions")
+	return {"variator": ArrayGAOperator(seed=seed)}